@@ -0,0 +1,111 @@
+__author__ = 'Stanislav Ushakov'
+
+import heapq
+import math
+
+class HallOfFame:
+    """
+    Bounded archive of the best distinct expressions seen during the run.
+    Expressions are ordered by fitness value, then by size (number of
+    nodes), so of two equally good expressions the smaller one is better.
+    Expressions with the same text are stored only once.
+    Archive is the heap with the worst entry on the top, so adding
+    of the expression costs O(log capacity), and the expression that
+    is worse than all stored ones is rejected without copying or
+    even rendering it.
+    """
+    def __init__(self, capacity=10):
+        self.capacity = capacity
+        self._heap = []
+        self._keys = set()
+        self._counter = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, expression, fitness):
+        """
+        Adds copy of the expression if it is better than the worst stored
+        one and isn't stored yet. Returns True if expression was added.
+        """
+        if not self._accepts(fitness, None):
+            return False
+        size = expression.size()
+        if not self._accepts(fitness, size):
+            return False
+        key = str(expression)
+        if key in self._keys:
+            return False
+        self._push(fitness, size, key, expression.copy())
+        return True
+
+    def add_entry(self, key, fitness, size, item=None):
+        """
+        Adds entry given by its text, e.g. received from the other node.
+        item - object stored with the entry, by default - text itself.
+        """
+        if not self._accepts(fitness, size) or key in self._keys:
+            return False
+        self._push(fitness, size, key, item if item is not None else key)
+        return True
+
+    def merge(self, other):
+        """
+        Adds all entries of the other archive.
+        """
+        for (fitness, size, key, item) in other.entries():
+            self.add_entry(key, fitness, size, item)
+
+    def entries(self):
+        """
+        Returns list of (fitness value, size, text, expression), the best first.
+        """
+        return [(-f, -s, key, item) for (f, s, c, key, item) in sorted(self._heap, reverse=True)]
+
+    def expressions(self):
+        """
+        Returns stored expressions, the best first.
+        """
+        return [item for (fitness, size, key, item) in self.entries()]
+
+    def to_list(self):
+        """
+        Returns entries as list of dictionaries, suitable for json.
+        """
+        return [{'expression': key, 'fitness': fitness, 'size': size}
+                for (fitness, size, key, item) in self.entries()]
+
+    @classmethod
+    def from_list(cls, entries, capacity=None):
+        """
+        Creates archive from the list returned by to_list. Stored items
+        are the texts of the expressions.
+        """
+        result = cls(capacity if capacity is not None else len(entries))
+        for entry in entries:
+            result.add_entry(entry['expression'], entry['fitness'], entry['size'])
+        return result
+
+    def _accepts(self, fitness, size):
+        """
+        Checks if the entry would get into the archive. If size is None,
+        only fitness is checked.
+        """
+        if self.capacity <= 0 or not math.isfinite(fitness):
+            return False
+        if len(self._heap) < self.capacity:
+            return True
+        (worst_fitness, worst_size) = (-self._heap[0][0], -self._heap[0][1])
+        if size is None:
+            return fitness <= worst_fitness
+        return (fitness, size) < (worst_fitness, worst_size)
+
+    def _push(self, fitness, size, key, item):
+        self._counter += 1
+        entry = (-fitness, -size, -self._counter, key, item)
+        self._keys.add(key)
+        if len(self._heap) < self.capacity:
+            heapq.heappush(self._heap, entry)
+        else:
+            removed = heapq.heapreplace(self._heap, entry)
+            self._keys.discard(removed[3])
@@ -0,0 +1,132 @@
+__author__ = 'Stanislav Ushakov'
+
+import argparse
+import itertools
+import math
+import os
+import random
+import statistics
+
+from immune import DataFileStorageHelper, ExpressionsImmuneSystemConfig
+from runner import SharedDataset, run_trials
+
+#start as "python autotune.py [--data test_x_y.txt] [--processes N] [--budget 0.5]"
+
+#values of the tuned parameters
+DEFAULT_GRID = {'number_of_lymphocytes': [50, 100, 200, 400],
+                'maximal_height': [3, 4, 5, 6],
+                'number_of_iterations_to_exchange': [10, 25, 50]}
+
+#number of iterations for the time-boxed trials, solve is stopped by time
+_unlimited_iterations = 10 ** 9
+
+def grid_candidates(grid):
+    """
+    Returns list of dictionaries with all combinations of the grid values.
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+def score(results, accuracy):
+    """
+    Returns score of the candidate by results of its trials, the less -
+    the better: (median fitness, median time). Fitness values that reached
+    the accuracy are equal, so such candidates are compared by time.
+    """
+    return (statistics.median(max(r['fitness'], accuracy) for r in results),
+            statistics.median(r['seconds'] for r in results))
+
+def successive_halving(dataset, candidates, base_config, budget=0.5, eta=3, seeds=2,
+                       accuracy=0.001, processes=None, report=None):
+    """
+    Selects the best candidate config by successive halving: every
+    candidate is solved with the time limit budget (seconds) for each
+    of seeds, the best 1/eta of candidates are solved again with the
+    time limit eta times larger, until one candidate is left.
+    Trials of one round are run in parallel on processes workers, so
+    the time limit is the time of a solve on one core.
+    report - function called with (round, budget, ranked list of
+    (score, candidate, results)) after every round.
+    Returns (best candidate, its results in the last round).
+    Number of iterations isn't tuned (trials are stopped by time), so
+    candidates mustn't contain it.
+    """
+    if eta < 2:
+        raise ValueError('eta must be at least 2, not {0}'.format(eta))
+    if seeds < 1:
+        raise ValueError('seeds must be at least 1, not {0}'.format(seeds))
+    if any('number_of_iterations' in candidate for candidate in candidates):
+        raise ValueError('number_of_iterations is set by the time limit and can\'t be tuned')
+    round_number = 0
+    while True:
+        seed_values = [random.getrandbits(32) for i in range(0, seeds)]
+        trials = []
+        for candidate in candidates:
+            config = dict(base_config, number_of_iterations=_unlimited_iterations, **candidate)
+            trials.extend((seed, config, accuracy, budget) for seed in seed_values)
+        results = run_trials(dataset, trials, processes=processes)
+        ranked = []
+        for (i, candidate) in enumerate(candidates):
+            candidate_results = results[i * seeds:(i + 1) * seeds]
+            ranked.append((score(candidate_results, accuracy), i, candidate, candidate_results))
+        ranked.sort(key=lambda item: item[:2])
+        if report is not None:
+            report(round_number, budget,
+                   [(s, candidate, r) for (s, i, candidate, r) in ranked])
+        if len(candidates) == 1:
+            (s, i, candidate, candidate_results) = ranked[0]
+            return candidate, candidate_results
+        candidates = [candidate for (s, i, candidate, r)
+                      in ranked[:max(1, len(candidates) // eta)]]
+        budget *= eta
+        round_number += 1
+
+def tune(variables, columns, targets, grid=None, budget=0.5, eta=3, seeds=2, accuracy=0.001,
+         processes=None, report=None):
+    """
+    Tunes config for the data set. Returns config object with the values
+    of the best candidate. Number of iterations is set to the median
+    number of generations done by the best candidate in the last round.
+    """
+    config = ExpressionsImmuneSystemConfig()
+    dataset = SharedDataset(variables, columns, targets)
+    try:
+        best, results = successive_halving(dataset, grid_candidates(grid or DEFAULT_GRID),
+                                           config.to_dict(), budget=budget, eta=eta,
+                                           seeds=seeds, accuracy=accuracy,
+                                           processes=processes, report=report)
+    finally:
+        dataset.close()
+    for (name, value) in best.items():
+        setattr(config, name, value)
+    config.number_of_iterations = int(math.ceil(statistics.median(
+        r['generations'] for r in results)))
+    return config
+
+def print_round(round_number, budget, ranked):
+    print('round {0}: {1} candidates, {2:.2f}s per trial'.format(round_number, len(ranked), budget))
+    for ((fitness, seconds), candidate, results) in ranked[:5]:
+        print('    fitness {0:>12.6f} time {1:>7.2f}s  {2}'.format(fitness, seconds, candidate))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tunes config of the immune system for the data set.')
+    parser.add_argument('--data', default='test_x_y.txt')
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--budget', type=float, default=0.5,
+                        help='time limit of the trial solve in the first round, seconds')
+    parser.add_argument('--eta', type=int, default=3, help='1/eta of candidates survive each round')
+    parser.add_argument('--seeds', type=int, default=2, help='trials of each candidate per round')
+    parser.add_argument('--accuracy', type=float, default=0.001)
+    parser.add_argument('--no-save', action='store_true', help="don't write config file")
+    args = parser.parse_args()
+    if args.eta < 2:
+        parser.error('--eta must be at least 2')
+    if args.seeds < 1:
+        parser.error('--seeds must be at least 1')
+
+    variables, columns, targets = DataFileStorageHelper.load_columns(args.data)
+    config = tune(variables, columns, targets, budget=args.budget, eta=args.eta, seeds=args.seeds,
+                  accuracy=args.accuracy, processes=args.processes, report=print_round)
+    print('best config: {0}'.format(config.to_dict()))
+    if not args.no_save:
+        config.save()
@@ -0,0 +1,8 @@
+"""
+Benchmarks for the immune system.
+problems - standard symbolic regression problems,
+micro - micro-benchmarks of the single operations,
+selection - cost of the survivors selection,
+run - runs all benchmarks and saves results to json file.
+Start from the root of the project, e.g. "python -m benchmarks.run".
+"""
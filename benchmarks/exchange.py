@@ -0,0 +1,144 @@
+__author__ = 'Stanislav Ushakov'
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from expression import Expression
+from immune import ExpressionsImmuneSystem, ExpressionsImmuneSystemConfig, FitnessFunction
+from exchanger import SimpleRandomExchanger, PeerToPeerExchanger, RosterNodesManager
+from benchmarks.problems import get_problem
+
+#start as "python -m benchmarks.exchange [--latency 0.05]"
+
+class DelayedExchanger(SimpleRandomExchanger):
+    """
+    Random exchanger that waits latency seconds on every exchange,
+    simulates the network round-trip to the other node.
+    """
+    def __init__(self, generator, latency):
+        SimpleRandomExchanger.__init__(self, generator)
+        self.latency = latency
+
+    def get_lymphocytes(self, generation=0):
+        time.sleep(self.latency)
+        return SimpleRandomExchanger.get_lymphocytes(self, generation)
+
+def compare_schedules(problem_name='nguyen-10', points_number=1000, seeds=(1, 2, 3),
+                      latency=0.05, generations=100):
+    """
+    Solves the problem with the fixed and the stagnation-driven exchange
+    schedules. Returns dictionary {schedule: list of results for every
+    seed}, result contains number of exchanges, time spent in them,
+    total time and fitness value of the best expression.
+    """
+    problem = get_problem(problem_name)
+    exact_values = problem.exact_values(points_number)
+    f = FitnessFunction(exact_values)
+    results = {}
+    for schedule in ('fixed', 'stagnation'):
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_iterations = generations
+        config.exchange_schedule = schedule
+        results[schedule] = []
+        for seed in seeds:
+            exchanger = DelayedExchanger(
+                lambda: [Expression.generate_random(config.maximal_height, problem.variables)
+                         for i in range(0, config.number_of_lymphocytes // 2)], latency)
+            start = time.perf_counter()
+            system = ExpressionsImmuneSystem(exact_values, problem.variables, exchanger,
+                                             config, seed=seed)
+            best = system.solve(accuracy=0.0)
+            statistics = system.exchange_schedule.statistics()
+            results[schedule].append({'seed': seed,
+                                      'exchanges': statistics['exchanges'],
+                                      'exchange_time': statistics['time'],
+                                      'time': time.perf_counter() - start,
+                                      'fitness': f.expression_value(best)})
+    return results
+
+def _populations(problem, config, points_number, seed, exchanges):
+    """
+    Returns populations of the solving system at the exchanging steps.
+    """
+    exact_values = problem.exact_values(points_number)
+    exchanger = SimpleRandomExchanger(
+        lambda: [Expression.generate_random(config.maximal_height, problem.variables)
+                 for i in range(0, config.number_of_lymphocytes // 2)])
+    system = ExpressionsImmuneSystem(exact_values, problem.variables, exchanger, config,
+                                     seed=seed)
+    populations = []
+    for i in range(0, exchanges * config.number_of_iterations_to_exchange):
+        system.run_generation(i)
+        if (i + 1) % config.number_of_iterations_to_exchange == 0:
+            populations.append([e.copy() for e in system.lymphocytes])
+    return populations
+
+def compare_delta(problem_name='nguyen-10', points_number=1000, seed=1, exchanges=8,
+                  interval=25, port=47100):
+    """
+    Sends populations of the solving system (taken every interval
+    generations) to the other exchanger on localhost with the full and
+    the delta protocol. Returns dictionary {protocol: list of
+    (lymphocytes received, bytes received, seconds of the request)},
+    the first exchange is the same for both protocols, the following
+    ones show the steady state.
+    """
+    config = ExpressionsImmuneSystemConfig()
+    config.number_of_iterations_to_exchange = interval
+    populations = _populations(get_problem(problem_name), config, points_number, seed,
+                               exchanges)
+    results = {}
+    for (offset, delta) in ((0, False), (2, True)):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as roster:
+            json.dump({'nodes': [{'host': 'localhost', 'port': port + offset},
+                                 {'host': 'localhost', 'port': port + offset + 1}]}, roster)
+        try:
+            sender = PeerToPeerExchanger(RosterNodesManager(roster.name, 2))
+            receiver = PeerToPeerExchanger(RosterNodesManager(roster.name, 1),
+                                           mode=PeerToPeerExchanger.SYNC, timeout=5.0,
+                                           delta=delta)
+        finally:
+            os.remove(roster.name)
+        runs = []
+        try:
+            for (generation, population) in enumerate(populations, start=1):
+                sender.set_lymphocytes_to_exchange(population, generation=generation)
+                bytes_received = receiver.bytes_received
+                start = time.perf_counter()
+                received = receiver.get_lymphocytes(generation=generation)
+                runs.append((len(received), receiver.bytes_received - bytes_received,
+                             time.perf_counter() - start))
+        finally:
+            sender.close()
+            receiver.close()
+        results['delta' if delta else 'full'] = runs
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares exchange schedules and protocols.')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='simulated round-trip of the exchange, seconds')
+    parser.add_argument('--generations', type=int, default=100)
+    args = parser.parse_args()
+    print('{0:>11} {1:>5} {2:>10} {3:>14} {4:>10} {5:>12}'.format(
+        'schedule', 'seed', 'exchanges', 'exchange time', 'time', 'fitness'))
+    for (schedule, runs) in compare_schedules(latency=args.latency,
+                                              generations=args.generations).items():
+        for r in runs:
+            print('{0:>11} {1:>5} {2:>10} {3:>13.3f}s {4:>9.3f}s {5:>12.4f}'.format(
+                schedule, r['seed'], r['exchanges'], r['exchange_time'], r['time'],
+                r['fitness']))
+    print()
+    print('{0:>9} {1:>6} {2:>16} {3:>16} {4:>16}'.format(
+        'interval', 'proto', 'received/exch', 'bytes/exch', 'ms/exch'))
+    for (i, interval) in enumerate((25, 5, 1)):
+        for (protocol, runs) in compare_delta(interval=interval, port=47100 + 10 * i).items():
+            #the first exchange is the same for both protocols
+            steady = runs[1:]
+            print('{0:>9} {1:>6} {2:>16.1f} {3:>16.0f} {4:>16.2f}'.format(
+                interval, protocol, sum(r[0] for r in steady) / len(steady),
+                sum(r[1] for r in steady) / len(steady),
+                sum(r[2] for r in steady) / len(steady) * 1000))
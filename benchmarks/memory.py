@@ -0,0 +1,101 @@
+__author__ = 'Stanislav Ushakov'
+
+import gc
+import time
+import tracemalloc
+
+from expression import Expression, Node
+from immune import ExpressionsImmuneSystem, ExpressionsImmuneSystemConfig
+from exchanger import SimpleRandomExchanger
+from benchmarks.problems import get_problem
+
+#start as "python -m benchmarks.memory"
+
+class _NodeCounter:
+    """
+    Counts nodes created by the Node constructor while it is active.
+    Nodes taken from the NodePool aren't constructed, nodes allocated
+    by the pool are counted by the pool itself.
+    """
+    def __enter__(self):
+        self.created = 0
+        self._init = Node.__init__
+        counter = self
+        init = self._init
+        def counting_init(node, *args, **kwargs):
+            counter.created += 1
+            init(node, *args, **kwargs)
+        Node.__init__ = counting_init
+        return self
+
+    def __exit__(self, *exception):
+        Node.__init__ = self._init
+
+def _gc_collections():
+    return sum(s['collections'] for s in gc.get_stats())
+
+def _create_system(config, problem, points_number, seed):
+    exact_values = problem.exact_values(points_number, seed=seed)
+    exchanger = SimpleRandomExchanger(
+        lambda: [Expression.generate_random(config.maximal_height, problem.variables)
+                 for i in range(0, config.number_of_lymphocytes // 2)])
+    return ExpressionsImmuneSystem(exact_values, problem.variables, exchanger, config,
+                                   seed=seed)
+
+def profile_solve(config, problem_name='nguyen-10', points_number=1000, seed=1):
+    """
+    Solves the problem twice with the same seed: the first solve is timed
+    and counts garbage collections and allocated nodes, the second one
+    is traced by tracemalloc (tracing slows down allocations, so it
+    isn't timed). Returns dictionary with time per generation, peak
+    traced memory in bytes, number of garbage collections and nodes
+    allocated and reused per generation.
+    """
+    problem = get_problem(problem_name)
+    system = _create_system(config, problem, points_number, seed)
+    collections = _gc_collections()
+    with _NodeCounter() as counter:
+        start = time.perf_counter()
+        system.solve(accuracy=0.0)
+        seconds = time.perf_counter() - start
+    collections = _gc_collections() - collections
+    generations = system.generation + 1
+    pool = system.node_pool
+
+    system = _create_system(config, problem, points_number, seed)
+    tracemalloc.start()
+    system.solve(accuracy=0.0)
+    (current, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds_per_generation': seconds / generations,
+            'peak_bytes': peak,
+            'gc_collections': collections,
+            'nodes_per_generation': (counter.created + (pool.created if pool is not None else 0))
+                                    / generations,
+            'nodes_reused_per_generation': pool.reused / generations if pool is not None else 0.0}
+
+def compare(generations=30, number_of_lymphocytes=100, node_pool_size=100000, **kwargs):
+    """
+    Profiles solve with the default allocation and with the node pool
+    and tuned garbage collector. Returns dictionary {mode: profile}.
+    Both runs use the same seed, so they find the same expression.
+    """
+    results = {}
+    for (mode, pool_size, gc_tuning) in (('default', 0, False),
+                                         ('pool+gc', node_pool_size, True)):
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_iterations = generations
+        config.number_of_lymphocytes = number_of_lymphocytes
+        config.subsample_size = 0
+        config.node_pool_size = pool_size
+        config.gc_tuning = gc_tuning
+        results[mode] = profile_solve(config, **kwargs)
+    return results
+
+if __name__ == '__main__':
+    print('{0:>10} {1:>12} {2:>12} {3:>6} {4:>12} {5:>12}'.format(
+        'mode', 'ms/gen', 'peak KiB', 'gc', 'nodes/gen', 'reused/gen'))
+    for (mode, r) in compare().items():
+        print('{0:>10} {1:>12.3f} {2:>12.1f} {3:>6} {4:>12.1f} {5:>12.1f}'.format(
+            mode, r['seconds_per_generation'] * 1000, r['peak_bytes'] / 1024,
+            r['gc_collections'], r['nodes_per_generation'], r['nodes_reused_per_generation']))
@@ -0,0 +1,110 @@
+__author__ = 'Stanislav Ushakov'
+
+import copy
+import pickle
+import random
+import timeit
+
+from expression import Expression
+from immune import FitnessFunction, ExpressionMutator
+from benchmarks.problems import get_problem
+
+#start as "python -m benchmarks.micro"
+
+def _measure(function, number, repeat=5):
+    """
+    Returns the best time (in seconds) of a single call of the function.
+    """
+    timer = timeit.Timer(function)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def _random_expressions(number, max_height, variables, seed):
+    random.seed(seed)
+    return [Expression.generate_random(max_height, variables) for i in range(0, number)]
+
+def benchmark_generate_random(max_height=5, variables=('x', 'y'), number=200, seed=0):
+    random.seed(seed)
+    return _measure(lambda: Expression.generate_random(max_height, list(variables)), number)
+
+def benchmark_mutation(max_height=5, variables=('x', 'y'), number=200, seed=0):
+    expressions = _random_expressions(number, max_height, list(variables), seed)
+    iterator = iter(expressions * 10)
+    return _measure(lambda: ExpressionMutator(next(iterator)).mutation(), number)
+
+def benchmark_expression_value(points_number, max_height=5, number=50, seed=0):
+    problem = get_problem('nguyen-10')
+    f = FitnessFunction(problem.exact_values(points_number, seed=seed))
+    expressions = _random_expressions(number, max_height, problem.variables, seed)
+    iterator = iter(expressions * 10)
+    return _measure(lambda: f.expression_value(next(iterator)), number)
+
+def benchmark_lower_bound(points_number, max_height=5, number=200, seed=0):
+    problem = get_problem('nguyen-10')
+    f = FitnessFunction(problem.exact_values(points_number, seed=seed))
+    expressions = _random_expressions(number, max_height, problem.variables, seed)
+    iterator = iter(expressions * 10)
+    return _measure(lambda: f.lower_bound(next(iterator)), number)
+
+def precision_report(points_number=100000, max_height=5, number=50, seed=0):
+    """
+    Compares float32 and float64 evaluation of the same random expressions.
+    Returns dictionary with time per evaluation in both modes, speed-up,
+    bytes read by single evaluation and ranking changes: number of
+    pairs of expressions ordered differently and whether the best
+    expression is the same.
+    """
+    problem = get_problem('nguyen-10')
+    f = FitnessFunction(problem.exact_values(points_number, seed=seed))
+    expressions = _random_expressions(number, max_height, problem.variables, seed)
+    report = {}
+    values = {}
+    for precision in ('float64', 'float32'):
+        f.set_precision(precision)
+        iterator = iter(expressions * 10)
+        report[precision] = _measure(lambda: f.expression_value(next(iterator)), number)
+        report[precision + '_bytes'] = f.memory_usage()
+        values[precision] = [f.expression_value(e) for e in expressions]
+    report['speedup'] = report['float64'] / report['float32']
+    exact, approximate = values['float64'], values['float32']
+    report['discordant_pairs'] = sum(
+        1 for i in range(0, number) for j in range(i + 1, number)
+        if (exact[i] < exact[j]) != (approximate[i] < approximate[j]) and exact[i] != exact[j])
+    report['best_changed'] = (min(range(number), key=exact.__getitem__) !=
+                              min(range(number), key=approximate.__getitem__))
+    return report
+
+def benchmark_pickle(max_height=5, variables=('x', 'y'), number=100, seed=0):
+    expressions = _random_expressions(number, max_height, list(variables), seed)
+    return _measure(lambda: pickle.loads(pickle.dumps(expressions)), 1) / number
+
+def benchmark_simplify(max_height=5, variables=('x', 'y'), number=200, seed=0):
+    expressions = _random_expressions(number, max_height, list(variables), seed)
+    def simplify_all():
+        for e in copy.deepcopy(expressions):
+            e.simplify()
+    copy_time = _measure(lambda: copy.deepcopy(expressions), 1)
+    return max(0.0, _measure(simplify_all, 1) - copy_time) / number
+
+def run_all():
+    """
+    Runs all micro-benchmarks. Returns dictionary {name: seconds per call}.
+    """
+    results = {
+        'generate_random': benchmark_generate_random(),
+        'mutation': benchmark_mutation(),
+        'pickle': benchmark_pickle(),
+        'simplify': benchmark_simplify()}
+    for points_number in (100, 1000, 10000):
+        results['expression_value_{0}'.format(points_number)] = \
+            benchmark_expression_value(points_number)
+    results['lower_bound_10000'] = benchmark_lower_bound(10000)
+    return results
+
+if __name__ == '__main__':
+    for (name, seconds) in run_all().items():
+        print('{0:>25} {1:>12.2f}us'.format(name, seconds * 10 ** 6))
+    report = precision_report()
+    print('float32 evaluation: {0:.2f}x faster, {1} -> {2} bytes, '
+          '{3} discordant pairs, best changed: {4}'.format(
+              report['speedup'], report['float64_bytes'], report['float32_bytes'],
+              report['discordant_pairs'], report['best_changed']))
@@ -0,0 +1,62 @@
+__author__ = 'Stanislav Ushakov'
+
+import numpy
+
+class Problem:
+    """
+    Symbolic regression problem: target function and the domain of
+    the variables. Points are generated uniformly at random with the
+    fixed seed, so every run uses the same data set.
+    function - takes numpy arrays (one for each variable) and returns
+    numpy array of values.
+    """
+    def __init__(self, name, variables, function, min_point, max_point):
+        self.name = name
+        self.variables = variables
+        self.function = function
+        self.min_point = min_point
+        self.max_point = max_point
+
+    def exact_values(self, points_number, seed=0):
+        """
+        Returns exact values in the form accepted by FitnessFunction:
+        [({'x': 1}, 1), ...]
+        """
+        rng = numpy.random.default_rng(seed)
+        columns = [rng.uniform(self.min_point, self.max_point, points_number)
+                   for var in self.variables]
+        values = self.function(*columns)
+        return [({var: float(column[i]) for (var, column) in zip(self.variables, columns)},
+                 float(values[i]))
+                for i in range(0, points_number)]
+
+#Nguyen and Keijzer style problems with 1 to 5 variables
+PROBLEMS = [
+    Problem('nguyen-1', ['x'],
+            lambda x: x ** 3 + x ** 2 + x, -1.0, 1.0),
+    Problem('nguyen-5', ['x'],
+            lambda x: numpy.sin(x ** 2) * numpy.cos(x) - 1, -1.0, 1.0),
+    Problem('nguyen-7', ['x'],
+            lambda x: numpy.log(x + 1) + numpy.log(x ** 2 + 1), 0.0, 2.0),
+    Problem('nguyen-10', ['x', 'y'],
+            lambda x, y: 2 * numpy.sin(x) * numpy.cos(y), -1.0, 1.0),
+    Problem('keijzer-14', ['x', 'y'],
+            lambda x, y: 8 / (2 + x ** 2 + y ** 2), -3.0, 3.0),
+    Problem('keijzer-5', ['x', 'y', 'z'],
+            lambda x, y, z: 30 * x * z / ((x - 10) * y ** 2), 1.0, 2.0),
+    Problem('friedman-1', ['a', 'b', 'c', 'd', 'e'],
+            lambda a, b, c, d, e: (10 * numpy.sin(numpy.pi * a * b) +
+                                   20 * (c - 0.5) ** 2 + 10 * d + 5 * e), 0.0, 1.0),
+]
+
+#data set sizes used for the benchmarks
+DATASET_SIZES = [20, 100, 1000]
+
+def get_problem(name):
+    """
+    Returns problem by its name.
+    """
+    for problem in PROBLEMS:
+        if problem.name == name:
+            return problem
+    raise KeyError(name)
@@ -0,0 +1,102 @@
+__author__ = 'Stanislav Ushakov'
+
+import argparse
+import json
+import platform
+import time
+
+import numpy
+
+from expression import Expression
+from immune import ExpressionsImmuneSystem, ExpressionsImmuneSystemConfig, FitnessFunction
+from exchanger import SimpleRandomExchanger
+from benchmarks import micro
+from benchmarks.problems import PROBLEMS, DATASET_SIZES
+
+#start as "python -m benchmarks.run --output results.json [--compare old.json]"
+
+SEEDS = [1, 2, 3]
+
+def benchmark_solve(problem, points_number, seeds=SEEDS, config=None):
+    """
+    Solves the problem once for every seed. Returns dictionary with
+    solving times and fitness values of the found expressions.
+    """
+    if config is None:
+        config = ExpressionsImmuneSystemConfig()
+    exact_values = problem.exact_values(points_number)
+    f = FitnessFunction(exact_values)
+    times = []
+    fitness_values = []
+    for seed in seeds:
+        exchanger = SimpleRandomExchanger(
+            lambda: [Expression.generate_random(config.maximal_height, problem.variables)
+                     for i in range(0, config.number_of_lymphocytes // 2)])
+        start = time.perf_counter()
+        system = ExpressionsImmuneSystem(exact_values, problem.variables, exchanger,
+                                         config, seed=seed)
+        best = system.solve()
+        times.append(time.perf_counter() - start)
+        fitness_values.append(f.expression_value(best))
+    return {'times': times,
+            'mean_time': sum(times) / len(times),
+            'fitness': fitness_values,
+            'best_fitness': min(fitness_values)}
+
+def run_all(quick=False):
+    """
+    Runs micro-benchmarks and solves all problems. Returns dictionary
+    ready to be saved as json.
+    """
+    config = ExpressionsImmuneSystemConfig()
+    sizes = DATASET_SIZES
+    if quick:
+        config.number_of_iterations = 20
+        sizes = DATASET_SIZES[:1]
+    results = {'meta': {'python': platform.python_version(),
+                        'numpy': numpy.__version__,
+                        'machine': platform.machine(),
+                        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                        'config': config.to_dict()},
+               'micro': micro.run_all(),
+               'solve': {}}
+    for problem in PROBLEMS:
+        for points_number in sizes:
+            name = '{0}/{1}'.format(problem.name, points_number)
+            results['solve'][name] = benchmark_solve(problem, points_number, config=config)
+    return results
+
+def compare(old, new, threshold=1.1):
+    """
+    Compares two results of run_all. Returns list of strings describing
+    benchmarks that became slower more than threshold times.
+    """
+    regressions = []
+    for (name, seconds) in new['micro'].items():
+        if name in old['micro'] and seconds > old['micro'][name] * threshold:
+            regressions.append('micro {0}: {1:.2f}us -> {2:.2f}us'.format(
+                name, old['micro'][name] * 10 ** 6, seconds * 10 ** 6))
+    for (name, result) in new['solve'].items():
+        if name in old['solve'] and result['mean_time'] > old['solve'][name]['mean_time'] * threshold:
+            regressions.append('solve {0}: {1:.3f}s -> {2:.3f}s'.format(
+                name, old['solve'][name]['mean_time'], result['mean_time']))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs benchmarks of the immune system.')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='json file with the previous results')
+    parser.add_argument('--quick', action='store_true', help='less iterations and data sets')
+    args = parser.parse_args()
+
+    results = run_all(quick=args.quick)
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2)
+    for (name, result) in results['solve'].items():
+        print('{0:>20} {1:>8.3f}s {2:>12.4f}'.format(name, result['mean_time'],
+                                                   result['best_fitness']))
+    if args.compare:
+        with open(args.compare) as input:
+            regressions = compare(json.load(input), results)
+        for regression in regressions:
+            print('REGRESSION', regression)
@@ -0,0 +1,60 @@
+__author__ = 'Stanislav Ushakov'
+
+import random
+import timeit
+
+import numpy
+
+from selection import TruncationSelection, TournamentSelection, best_index
+
+#start as "python -m benchmarks.selection"
+
+def full_sort_selection(fitness_values, k):
+    """
+    The old way of selection: sort all (index, fitness) pairs.
+    """
+    indexed = sorted(enumerate(fitness_values), key=lambda item: item[1])
+    return [i for (i, f) in indexed[:k]]
+
+def sorted_indices_selection(fitness_values, k):
+    """
+    Sorting of the indices only, used by truncation for big k before
+    numpy.argpartition.
+    """
+    return sorted(range(len(fitness_values)), key=fitness_values.__getitem__)[:k]
+
+def benchmark(sizes=(10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5), repeat=5):
+    """
+    Measures time of selecting the best half of the population with
+    different strategies. Returns list of (size, {strategy: seconds}).
+    Fitness values are numpy array (as the immune system keeps them),
+    'truncation (list)' shows truncation of the same values in list.
+    """
+    truncation = TruncationSelection().select
+    strategies = [
+        ('full sort', full_sort_selection, False),
+        ('sorted indices', sorted_indices_selection, False),
+        ('truncation (list)', truncation, False),
+        ('truncation', truncation, True),
+        ('tournament', TournamentSelection().select, True),
+        ('best only', lambda values, k: best_index(values), True)]
+    results = []
+    for size in sizes:
+        fitness_list = [random.random() * 100 for i in range(0, size)]
+        fitness_array = numpy.array(fitness_list)
+        number = max(1, 10 ** 5 // size)
+        timings = {}
+        for (name, select, is_array) in strategies:
+            values = fitness_array if is_array else fitness_list
+            timer = timeit.Timer(lambda: select(values, size // 2))
+            timings[name] = min(timer.repeat(repeat=repeat, number=number)) / number
+        results.append((size, timings))
+    return results
+
+if __name__ == '__main__':
+    results = benchmark()
+    names = list(results[0][1].keys())
+    print('{0:>8}'.format('size') + ''.join('{0:>19}'.format(n) for n in names))
+    for (size, timings) in results:
+        print('{0:>8}'.format(size) +
+              ''.join('{0:>17.3f}ms'.format(timings[n] * 1000) for n in names))
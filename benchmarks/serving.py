@@ -0,0 +1,52 @@
+__author__ = 'Stanislav Ushakov'
+
+import random
+import time
+
+import numpy
+
+from expression import Expression
+from export import export_predictor
+
+#start as "python -m benchmarks.serving"
+
+def _rows_per_second(function, rows, repeat=3):
+    best = min(_timed(function) for i in range(0, repeat))
+    return rows / best if best > 0 else float('inf')
+
+def _timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+def compare_predictors(expression=None, rows=1000000, point_rows=10000, seed=0):
+    """
+    Compares rows per second of value_in_point (one row at a time,
+    measured on point_rows rows), value_in_columns and the exported
+    predict(X) on rows rows. Returns dictionary {method: rows per second}.
+    """
+    if expression is None:
+        expression = Expression.parse('((x * sin((x * y))) + ((x * x) / (y - 0.5)))',
+                                      ['x', 'y'])
+    rng = numpy.random.default_rng(seed)
+    X = rng.uniform(-5.0, 5.0, size=(rows, len(expression.variables)))
+    points = [dict(zip(expression.variables, row)) for row in X[:point_rows].tolist()]
+    columns = {var: numpy.ascontiguousarray(X[:, i])
+               for (i, var) in enumerate(expression.variables)}
+    predict = export_predictor(expression)
+    with numpy.errstate(all='ignore'):
+        return {'value_in_point': _rows_per_second(
+                    lambda: [expression.value_in_point(p) for p in points], point_rows),
+                'value_in_columns': _rows_per_second(
+                    lambda: expression.value_in_columns(columns), rows),
+                'predict': _rows_per_second(lambda: predict(X), rows)}
+
+if __name__ == '__main__':
+    random.seed(0)
+    expressions = [None] + [Expression.generate_random(6, ['x', 'y']) for i in range(0, 3)]
+    for expression in expressions:
+        results = compare_predictors(expression)
+        print(expression if expression is not None else 'default expression')
+        for (method, speed) in results.items():
+            print('{0:>18} {1:>16,.0f} rows/s {2:>10.1f}x'.format(
+                method, speed, speed / results['value_in_point']))
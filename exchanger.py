@@ -1,9 +1,14 @@
 __author__ = 'Stanislav Ushakov'
 
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition
 from socketserver import BaseRequestHandler, TCPServer
 import socket
 import pickle
+import hashlib
+import json
+import random
+import struct
+import time
 
 class SimpleRandomExchanger:
     """
@@ -13,20 +18,65 @@ class SimpleRandomExchanger:
     def __init__(self, generator):
         self.generator = generator
 
-    def set_lymphocytes_to_exchange(self, lymphocytes):
+    def close(self):
+        """
+        Stops the server thread and closes its socket.
+        """
+        self.server_thread.close()
+
+    def set_lymphocytes_to_exchange(self, lymphocytes, generation=0):
         """
         Set the lymphocytes using for exchange - these lymphocytes will
         be given to the other node when requested.
         """
         self.to_exchange = lymphocytes
 
-    def get_lymphocytes(self):
+    def get_lymphocytes(self, generation=0):
         """
         Returns lymphocytes from the other node.
         In this class - simply randomly generated.
         """
         return self.generator()
 
+class RingExchanger:
+    """
+    Exchanger of one of several immune systems running in the same
+    process and connected in a ring: every system receives lymphocytes
+    set by the next one. Create the ring with RingExchanger.ring.
+    Lymphocytes are copied when they are set, so the systems never share
+    trees (discarded trees may be released to the NodePool).
+    """
+    def __init__(self, batches, index):
+        self.batches = batches
+        self.index = index
+
+    @classmethod
+    def ring(cls, size):
+        """
+        Returns list of size connected exchangers.
+        """
+        batches = [[] for i in range(0, size)]
+        return [cls(batches, i) for i in range(0, size)]
+
+    def close(self):
+        """
+        Stops the server thread and closes its socket.
+        """
+        self.server_thread.close()
+
+    def set_lymphocytes_to_exchange(self, lymphocytes, generation=0):
+        """
+        Set the lymphocytes using for exchange - these lymphocytes will
+        be given to the previous system in the ring when requested.
+        """
+        self.batches[self.index] = [e.copy() for e in lymphocytes]
+
+    def get_lymphocytes(self, generation=0):
+        """
+        Returns copies of the lymphocytes set by the next system in the ring.
+        """
+        return [e.copy() for e in self.batches[(self.index + 1) % len(self.batches)]]
+
 class LocalhostNodesManager:
     """
     This class is used for getting information about other running nodes.
@@ -61,6 +111,167 @@ class LocalhostNodesManager:
         self.current_node = (self.current_node + 1) % self.other_nodes_len
         return result
 
+    def report_success(self, address, latency):
+        """
+        Called after successful exchange with the node. Does nothing.
+        """
+        pass
+
+    def report_failure(self, address):
+        """
+        Called after failed exchange with the node. Does nothing.
+        """
+        pass
+
+class PeerState:
+    """
+    State of the single peer in the roster.
+    latency - exponential moving average of the exchange time in seconds,
+    None if there were no successful exchanges.
+    failures - number of consecutive failures.
+    retry_at - time before which the peer isn't used (back off).
+    """
+    def __init__(self, name, host, port, weight=1.0):
+        self.name = name
+        self.address = (host, port)
+        self.weight = weight
+        self.latency = None
+        self.failures = 0
+        self.total_failures = 0
+        self.exchanges = 0
+        self.retry_at = 0.0
+        self.evicted = False
+
+    def to_dict(self):
+        return {'name': self.name, 'host': self.address[0], 'port': self.address[1],
+                'weight': self.weight, 'latency': self.latency, 'failures': self.failures,
+                'total_failures': self.total_failures, 'exchanges': self.exchanges,
+                'evicted': self.evicted}
+
+class RosterNodesManager:
+    """
+    Nodes manager that reads addresses of all nodes from the roster file:
+    {"nodes": [{"name": "a", "host": "10.0.0.1", "port": 5001, "weight": 1.0}, ...]}
+    name and weight are optional (name defaults to host:port, weight to 1).
+    Tracks latency and failures of every peer. Failed peers are not used
+    for exponentially growing time and evicted after max_failures
+    consecutive failures. Exchanges are routed to healthy peers at random
+    with possibility proportional to weight / latency, so the fastest peers
+    are used more often. Peers without measured latency are tried first.
+    """
+    _latency_decay = 0.3
+
+    def __init__(self, roster_filename, node, max_failures=5, base_backoff=1.0,
+                 max_backoff=60.0, clock=time.monotonic):
+        """
+        Initializes manager with the roster file and the current node -
+        its name or 1-based number in the roster.
+        """
+        with open(roster_filename) as input:
+            roster = json.load(input)
+        nodes = [PeerState(n.get('name', '{0}:{1}'.format(n['host'], n['port'])),
+                           n['host'], n['port'], n.get('weight', 1.0))
+                 for n in roster['nodes']]
+        if isinstance(node, int) or str(node).isdigit():
+            self_node = nodes[int(node) - 1]
+        else:
+            self_node = [n for n in nodes if n.name == node][0]
+        self.self_address = self_node.address
+        self.peers = [n for n in nodes if n is not self_node]
+        self.peers_by_address = {p.address: p for p in self.peers}
+        self.max_failures = max_failures
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.clock = clock
+        self.lock = Lock()
+
+    def get_self_address(self):
+        """
+        Returns address of the current node in form (host, port).
+        """
+        return self.self_address
+
+    def get_next_node_address(self):
+        """
+        Returns address (host, port) of the healthy peer to exchange.
+        Returns None if all peers are evicted or backing off, so a dead
+        peer isn't requested until its back off time passes.
+        """
+        with self.lock:
+            now = self.clock()
+            alive = [p for p in self.peers if not p.evicted]
+            if not alive:
+                return None
+            healthy = [p for p in alive if p.retry_at <= now]
+            if not healthy:
+                return None
+            unmeasured = [p for p in healthy if p.latency is None]
+            if unmeasured:
+                return unmeasured[0].address
+            weights = [p.weight / max(p.latency, 1e-6) for p in healthy]
+            return random.choices(healthy, weights=weights)[0].address
+
+    def report_success(self, address, latency):
+        """
+        Called after successful exchange with the peer, latency in seconds.
+        """
+        with self.lock:
+            peer = self.peers_by_address.get(address)
+            if peer is None:
+                return
+            if peer.latency is None:
+                peer.latency = latency
+            else:
+                peer.latency += self._latency_decay * (latency - peer.latency)
+            peer.failures = 0
+            peer.retry_at = 0.0
+            peer.exchanges += 1
+
+    def report_failure(self, address):
+        """
+        Called after failed exchange with the peer.
+        """
+        with self.lock:
+            peer = self.peers_by_address.get(address)
+            if peer is None:
+                return
+            peer.failures += 1
+            peer.total_failures += 1
+            if peer.failures >= self.max_failures:
+                peer.evicted = True
+            else:
+                peer.retry_at = self.clock() + min(self.max_backoff,
+                                                   self.base_backoff * 2 ** (peer.failures - 1))
+
+    def statistics(self):
+        """
+        Returns list of dictionaries describing state of every peer.
+        """
+        with self.lock:
+            return [p.to_dict() for p in self.peers]
+
+#size of the structural hash of the lymphocyte in bytes
+HASH_SIZE = 8
+#prefix of the request listing hashes of the lymphocytes known to the requester,
+#followed by the number of hashes (4 bytes, big-endian) and the hashes
+DELTA_REQUEST = b'DELTA1'
+#the request is rejected if it contains more hashes
+_max_known_hashes = 1 << 20
+
+def structural_hash(lymphocyte):
+    """
+    Returns hash of the lymphocyte structure (blake2b of its text
+    representation), equal expressions have equal hashes on all nodes.
+    """
+    return hashlib.blake2b(str(lymphocyte).encode('utf-8'), digest_size=HASH_SIZE).digest()
+
+def delta_request(known):
+    """
+    Returns request for lymphocytes except the ones with the known hashes.
+    """
+    known = list(known)
+    return DELTA_REQUEST + struct.pack('>I', len(known)) + b''.join(known)
+
 class TCPHandler(BaseRequestHandler):
     """
     The RequestHandler class for this node.
@@ -68,74 +279,145 @@ class TCPHandler(BaseRequestHandler):
 
     def handle(self):
         """
-        Main method - receive dummy data and send currently stored lymphocytes -
-        first pickle them.
+        Main method - receive request and send currently stored lymphocytes.
+        Lymphocytes getter returns already pickled bytes. If the request
+        lists hashes of the lymphocytes known to the requester (see
+        delta_request), getter is called with the set of these hashes.
+        """
+        request = self.request.recv(1024)
+        if not request.startswith(DELTA_REQUEST):
+            self.request.sendall(self.server.lymphocytes_getter())
+            return
+        header = len(DELTA_REQUEST) + 4
+        request = self._receive_at_least(request, header)
+        if request is None:
+            return
+        (count,) = struct.unpack_from('>I', request, len(DELTA_REQUEST))
+        if count > _max_known_hashes:
+            return
+        request = self._receive_at_least(request, header + count * HASH_SIZE)
+        if request is None:
+            return
+        known = set(request[i:i + HASH_SIZE]
+                    for i in range(header, header + count * HASH_SIZE, HASH_SIZE))
+        self.request.sendall(self.server.lymphocytes_getter(known))
+
+    def _receive_at_least(self, data, size):
         """
-        self.request.recv(1024)
-        self.request.sendall(pickle.dumps(self.server.lymphocytes_getter()))
+        Receives data until its size is at least size bytes. Returns
+        None if the connection is closed earlier.
+        """
+        while len(data) < size:
+            chunk = self.request.recv(max(1024, size - len(data)))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+class ReusableTCPServer(TCPServer):
+    """
+    TCP server that can be restarted on the same port immediately
+    (socket in TIME_WAIT state doesn't block it).
+    """
+    allow_reuse_address = True
 
 class ServerThread(Thread):
     """
     This Thread class is used for keeping always open socket for incoming
     connections. This thread must send currently storing lymphocytes.
     """
+    #seconds between checks of the close request
+    _poll_interval = 0.1
+
     def __init__(self, host, port, lymphocytes_getter):
         """
         Initializes thread with host and port that this node is listening for,
-        function that returns currently stored lymphocytes.
+        function that returns currently stored lymphocytes as pickled bytes.
+        Socket is opened here, so port 0 is replaced by the port chosen
+        by the system.
         """
         Thread.__init__(self)
+        self.server = ReusableTCPServer((host, port), TCPHandler)
+        self.server.lymphocytes_getter = lymphocytes_getter
         self.host = host
-        self.port = port
+        self.port = self.server.server_address[1]
         self.lymphocytes_getter = lymphocytes_getter
 
     def run(self):
         """
-        Main thread method. Open socket and waiting for connections.
+        Main thread method. Waiting for connections until close.
         """
-        server = TCPServer((self.host, self.port), TCPHandler)
-        server.lymphocytes_getter = self.lymphocytes_getter
+        #runs until close - so make this thread daemon
+        self.server.serve_forever(poll_interval=self._poll_interval)
 
-        #runs forever - so make this thread daemon
-        server.serve_forever()
+    def close(self):
+        """
+        Stops serving and closes the listening socket.
+        """
+        if self.is_alive():
+            self.server.shutdown()
+        self.server.server_close()
 
 class GetterThread(Thread):
     """
     This Thread class is used for getting lymphocytes from another node.
     """
-    def __init__(self, node_address, lymphocytes_setter):
+    #seconds to wait for the other node
+    timeout = 10.0
+
+    def __init__(self, node_address, lymphocytes_setter, on_success=None, on_failure=None,
+                 request=None, decode=pickle.loads, timeout=None):
         """
         Initializes thread with the address of node being requested and
-        method that will store received lymphocytes.
+        method that will store received lymphocytes and size of the
+        received data in bytes.
+        on_success(address, latency) and on_failure(address) are called
+        after the exchange.
+        request - bytes sent to the node (see delta_request), by default -
+        request for all lymphocytes.
+        decode - function that turns received bytes into lymphocytes.
+        timeout - seconds to wait for the other node, by default - the
+        class timeout.
         """
         Thread.__init__(self)
         self.address = node_address
         self.lymphocytes_setter = lymphocytes_setter
+        self.on_success = on_success
+        self.on_failure = on_failure
+        self.request = request if request is not None else bytes("Give me", "utf-8")
+        self.decode = decode
+        if timeout is not None:
+            self.timeout = timeout
 
     def run(self):
         """
         Main thread method. Creates socket, receives data, unpickle it
         and call setter function.
         """
+        sock = None
         try:
-            sock =  socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect(self.address)
+            start = time.perf_counter()
+            sock = socket.create_connection(self.address, timeout=self.timeout)
 
-            #send dummy data
-            sock.sendall(bytes("Give me", "utf-8"))
+            sock.sendall(self.request)
             received = sock.recv(1024)
             while True:
                 data = sock.recv(1024)
                 if not data: break
                 received += data
-            lymphocytes = pickle.loads(received)
-            self.lymphocytes_setter(lymphocytes)
-        except ConnectionRefusedError:
-            #Don't bother. May be it's better to add more logic to determine
-            #permanent connection errors.
-            pass
+            lymphocytes = self.decode(received)
+            latency = time.perf_counter() - start
+        except (OSError, EOFError, pickle.UnpicklingError):
+            #peer is dead, slow or sent broken data
+            if self.on_failure is not None:
+                self.on_failure(self.address)
+            return
         finally:
-            sock.close()
+            if sock is not None:
+                sock.close()
+        if self.on_success is not None:
+            self.on_success(self.address, latency)
+        self.lymphocytes_setter(lymphocytes, len(received))
 
 
 class PeerToPeerExchanger:
@@ -143,74 +425,237 @@ class PeerToPeerExchanger:
     Class represents p2p exchanger. Addresses of the other peers are
     provided by special manager object. Connect to one of this nodes and ask
     for lymphocytes.
+    Every batch of lymphocytes is tagged with the generation of the node
+    that sent it. Exchange semantics is defined by mode:
+    ASYNC - never block, return the last received batch (may be stale),
+    BOUNDED - wait up to timeout seconds for the batch received after
+    the previous exchange,
+    SYNC - barrier: request the other node until it reaches the same
+    generation (or timeout expires).
+    Wait time and staleness (in generations) of every exchange are stored
+    in exchange_statistics.
+    If delta is True, the request lists structural hashes of the
+    lymphocytes this node already has: received from the same peer
+    earlier or present in its own population. The peer sends only the
+    other ones, so in the steady state, when most survivors don't
+    change, few lymphocytes are sent and unpickled.
     """
-    def __init__(self, nodes_manager):
+    ASYNC = 'async'
+    BOUNDED = 'bounded'
+    SYNC = 'sync'
+
+    #pause between requests in SYNC mode
+    _sync_retry_interval = 0.01
+
+    def __init__(self, nodes_manager, mode=ASYNC, timeout=1.0, delta=True,
+                 known_capacity=1000):
         """
         Initializes exchanger with the host and port of this node.
         nodes_addresses - list of (host, port) other nodes addresses.
-        """
-        self.lock_to_exchange = Lock()
-        self.lock_to_return = Lock()
+        mode - ASYNC, BOUNDED or SYNC, timeout - maximal wait in seconds
+        for BOUNDED and SYNC modes.
+        delta - if True, only lymphocytes unknown to this node are requested.
+        known_capacity - maximal number of remembered hashes for every peer.
+        """
+        if mode not in (self.ASYNC, self.BOUNDED, self.SYNC):
+            raise ValueError('Unknown exchange mode: {0}'.format(mode))
+        self.mode = mode
+        self.timeout = timeout
+        self.delta = delta
+        self.known_capacity = known_capacity
+        self.condition_to_return = Condition()
         self.nodes_manager = nodes_manager
+        #total size of the received data in bytes
+        self.bytes_received = 0
+        #number of lymphocytes the peers didn't send because they were known
+        self.lymphocytes_skipped = 0
+        #{peer address: {hash: None}} of the returned lymphocytes in the order of receiving
+        self.known_hashes = {}
+        self.exchange_statistics = []
 
         #start server thread
         self.server_thread = ServerThread(self.nodes_manager.get_self_address()[0],
                                           self.nodes_manager.get_self_address()[1],
                                           self._get_lymphocytes_to_exchange)
-        self.server_thread.setDaemon(daemonic=True)
+        self.server_thread.daemon = True
         self.server_thread.start()
 
+        self.set_lymphocytes_to_exchange([])
+
         #prepare lymphocytes to return
-        self.to_return = []
-        self._receive_lymphocytes()
+        self.to_return = {'generation': None, 'lymphocytes': [], 'skipped': 0}
+        self.fresh = False
+        if self.mode != self.SYNC:
+            self._receive_lymphocytes()
 
-        self.to_exchange = []
+    def close(self):
+        """
+        Stops the server thread and closes its socket.
+        """
+        self.server_thread.close()
 
-    def set_lymphocytes_to_exchange(self, lymphocytes):
+    def set_lymphocytes_to_exchange(self, lymphocytes, generation=0):
         """
         Set the lymphocytes using for exchange - these lymphocytes will
         be given to the other node when requested.
-        """
-        self.lock_to_exchange.acquire()
-        self.to_exchange = lymphocytes
-        self.lock_to_exchange.release()
+        generation - current generation of this node.
+        Lymphocytes are pickled here once, each one separately together
+        with its structural hash, so the snapshot is immutable (later
+        changes of the lymphocytes don't affect it) and the response to
+        every request is built from the same bytes. Replacing the
+        reference is atomic, so no lock is needed.
+        """
+        items = [(structural_hash(l), pickle.dumps(l, protocol=pickle.HIGHEST_PROTOCOL))
+                 for l in lymphocytes]
+        self.to_exchange = {'generation': generation,
+                            'items': items,
+                            'full': self._response(generation, items, [])}
+
+    def get_lymphocytes(self, generation=0):
+        """
+        Returns lymphocytes from the other node according to the mode.
+        And start to receive the new ones.
+        generation - current generation of this node.
+        """
+        start = time.perf_counter()
+        if self.mode == self.SYNC:
+            self._wait_for_generation(generation, start)
+        with self.condition_to_return:
+            if self.mode == self.BOUNDED:
+                self.condition_to_return.wait_for(lambda: self.fresh, timeout=self.timeout)
+            batch = self.to_return
+            fresh = self.fresh
+            self.fresh = False
+            if fresh and self.delta:
+                #only returned lymphocytes are known, SYNC retries overwrite
+                #stale batches that are never returned
+                self._remember(batch['address'], batch['hashes'])
+        wait_time = time.perf_counter() - start
 
-    def get_lymphocytes(self):
+        if self.mode != self.SYNC:
+            self._receive_lymphocytes()
+
+        source_generation = batch['generation']
+        self.exchange_statistics.append({
+            'generation': generation,
+            'source_generation': source_generation,
+            'staleness': (generation - source_generation
+                          if source_generation is not None else None),
+            'fresh': fresh,
+            'wait_time': wait_time,
+            'received': len(batch['lymphocytes']),
+            'skipped': batch['skipped']})
+        return batch['lymphocytes'][:]
+
+    def _wait_for_generation(self, generation, start):
+        """
+        Requests the other node until it sends batch of at least the
+        given generation or timeout expires.
+        """
+        while True:
+            #the request itself mustn't outlast the barrier
+            remaining = self.timeout - (time.perf_counter() - start)
+            if remaining <= 0:
+                return
+            self._receive_lymphocytes(wait=True, timeout=remaining)
+            with self.condition_to_return:
+                source_generation = self.to_return['generation']
+                if self.fresh and source_generation is not None and source_generation >= generation:
+                    return
+            if time.perf_counter() - start >= self.timeout:
+                return
+            time.sleep(self._sync_retry_interval)
+
+    def _get_lymphocytes_to_exchange(self, known=None):
+        """
+        Returns pickled snapshot of the lymphocytes that are going to
+        be sent to another node together with the generation.
+        known - set of hashes of the lymphocytes that aren't sent.
+        """
+        snapshot = self.to_exchange
+        if not known:
+            return snapshot['full']
+        sent = []
+        skipped = []
+        for item in snapshot['items']:
+            (skipped if item[0] in known else sent).append(item)
+        return self._response(snapshot['generation'], sent, skipped)
+
+    @staticmethod
+    def _response(generation, sent, skipped):
         """
-        Returns lymphocytes from the other node. And start to
-        receive the new ones.
+        Returns pickled batch: generation, pickled lymphocytes, their
+        hashes and number of skipped ones.
         """
-        self.lock_to_return.acquire()
-        lymphocytes = self.to_return[:]
-        self.lock_to_return.release()
+        return pickle.dumps({'generation': generation,
+                             'lymphocytes': [data for (h, data) in sent],
+                             'hashes': [h for (h, data) in sent],
+                             'skipped': len(skipped)},
+                            protocol=pickle.HIGHEST_PROTOCOL)
 
-        self._receive_lymphocytes()
+    @staticmethod
+    def _decode(received):
+        """
+        Unpickles batch received from the other node.
+        """
+        batch = pickle.loads(received)
+        batch['lymphocytes'] = [pickle.loads(data) for data in batch['lymphocytes']]
+        return batch
 
-        return lymphocytes
+    def _known(self, address):
+        """
+        Returns hashes of the lymphocytes that the peer doesn't have to send:
+        received from it earlier or present in the own snapshot.
+        """
+        with self.condition_to_return:
+            known = list(self.known_hashes.get(address, ()))
+        return known + [h for (h, data) in self.to_exchange['items']]
 
-    def _get_lymphocytes_to_exchange(self):
+    def _remember(self, address, hashes):
         """
-        This thread-safe method returns lymphocytes that are going to
-        be sent to another node.
+        Stores hashes of the lymphocytes received from the peer, the
+        oldest ones are forgotten when there are more than known_capacity.
         """
-        self.lock_to_exchange.acquire()
-        lymphocytes = self.to_exchange[:]
-        self.lock_to_exchange.release()
-        return lymphocytes
+        known = self.known_hashes.setdefault(address, {})
+        for h in hashes:
+            known.pop(h, None)
+            known[h] = None
+        for h in list(known)[:max(0, len(known) - self.known_capacity)]:
+            del known[h]
 
-    def _set_lymphocytes_to_return(self, lymphocytes):
+    def _set_lymphocytes_to_return(self, batch, size=0):
         """
         This thread-safe method sets lymphocytes returned from another
-        node.
-        """
-        self.lock_to_return.acquire()
-        self.to_return = lymphocytes
-        self.lock_to_return.release()
+        node. batch - dictionary with generation and lymphocytes,
+        size - size of the received data in bytes.
+        """
+        with self.condition_to_return:
+            self.lymphocytes_skipped += batch['skipped']
+            self.to_return = batch
+            self.fresh = True
+            self.bytes_received += size
+            self.condition_to_return.notify_all()
 
-    def _receive_lymphocytes(self):
+    def _receive_lymphocytes(self, wait=False, timeout=None):
         """
         Starts thread that is getting lymphocytes from another node.
-        """
-        getter_thread = GetterThread(self.nodes_manager.get_next_node_address(),
-                                     self._set_lymphocytes_to_return)
-        getter_thread.start()
\ No newline at end of file
+        wait - if True, lymphocytes are received in the calling thread.
+        timeout - seconds to wait for the other node, by default -
+        GetterThread.timeout.
+        """
+        address = self.nodes_manager.get_next_node_address()
+        if address is None:
+            return
+        def setter(batch, size):
+            batch['address'] = address
+            self._set_lymphocytes_to_return(batch, size)
+        getter_thread = GetterThread(address, setter,
+                                     on_success=self.nodes_manager.report_success,
+                                     on_failure=self.nodes_manager.report_failure,
+                                     request=delta_request(self._known(address))
+                                             if self.delta else None,
+                                     decode=self._decode, timeout=timeout)
+        if wait:
+            getter_thread.run()
+        else:
+            getter_thread.start()
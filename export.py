@@ -0,0 +1,221 @@
+__author__ = 'Stanislav Ushakov'
+
+import argparse
+import math
+
+import numpy
+
+from expression import Expression, Operations, NotSupportedOperationError
+
+#start as "python export.py "(x * sin(y))" --variables x y --output predictor.py"
+
+#numpy source of the operations, {0} and {1} are replaced by the arguments
+_templates = {Operations.PLUS.opcode: '{0} + {1}',
+              Operations.MINUS.opcode: '{0} - {1}',
+              Operations.MULTIPLICATION.opcode: '{0} * {1}',
+              Operations.DIVISION.opcode: '_division({0}, {1})',
+              Operations.SIN.opcode: 'numpy.sin({0})',
+              Operations.COS.opcode: 'numpy.cos({0})',
+              Operations.EXP.opcode: 'numpy.exp(numpy.minimum({0}, 700.0))',
+              Operations.LOG.opcode: '_log({0})',
+              Operations.SQRT.opcode: 'numpy.sqrt(numpy.abs({0}))',
+              Operations.POWER.opcode: '_power({0}, {1})'}
+
+#in place versions of the operations, the first argument is updated
+_in_place = {Operations.PLUS.opcode: '{0} += {1}',
+             Operations.MINUS.opcode: '{0} -= {1}',
+             Operations.MULTIPLICATION.opcode: '{0} *= {1}',
+             Operations.SIN.opcode: 'numpy.sin({0}, out={0})',
+             Operations.COS.opcode: 'numpy.cos({0}, out={0})'}
+_commutative = {Operations.PLUS.opcode, Operations.MULTIPLICATION.opcode}
+
+#protected operations, the same as vector actions of the operations
+_helpers = {
+    Operations.DIVISION.opcode: '''def _division(x, y):
+    return numpy.where(y != 0, x, x * 1000000) / numpy.where(y != 0, y, 1)
+''',
+    Operations.LOG.opcode: '''def _log(x):
+    return numpy.where(x != 0, numpy.log(numpy.where(x != 0, numpy.abs(x), 1)), 0.0)
+''',
+    Operations.POWER.opcode: '''def _power(x, y):
+    return numpy.where(x != 0, numpy.power(numpy.where(x != 0, numpy.abs(x), 1), y), 0.0)
+'''}
+
+_module_template = '''"""
+Predictor exported from the expression
+{expression}
+Requires only numpy.
+"""
+import numpy
+
+VARIABLES = {variables!r}
+EXPRESSION = {expression!r}
+
+{helpers}
+def {name}(X):
+    """
+    Returns array of the expression values for all rows of X at once.
+    X - 2D array with one column for each of VARIABLES (in this order),
+    1D array is a single row (or the only column for single variable).
+    """
+    X = numpy.asarray(X, dtype=numpy.float64)
+    if X.ndim == 1:
+        X = X.reshape({row_shape})
+    if X.ndim != 2 or X.shape[1] != {width}:
+        raise ValueError('expected array with {width} columns: ' + ', '.join(VARIABLES))
+{columns}    with numpy.errstate(all='ignore'):
+{body}    return {result}
+'''
+
+def _number(value):
+    value = float(value)
+    return repr(value) if math.isfinite(value) else "float('{0}')".format(value)
+
+def _statements(expression):
+    """
+    Returns list of (name, opcode, arguments) of the assignments computing
+    the expression and name of the result (temporary, variable or number).
+    Nodes are visited in post-order without recursion, subtrees without
+    variables are computed here (the same way as Expression.value_in_columns
+    does) and equal subtrees are computed once.
+    """
+    variables = {var: 'v{0}'.format(i) for (i, var) in enumerate(expression.variables)}
+    statements = []
+    names = {}
+    computed = {}
+    constants = {}
+    stack = [(expression.root, False)]
+    while stack:
+        (node, visited) = stack.pop()
+        if node.is_number():
+            constants[id(node)] = node.value
+            continue
+        if node.is_variable():
+            if node.value not in variables:
+                raise ValueError('unknown variable: {0}'.format(node.value))
+            names[id(node)] = variables[node.value]
+            continue
+        if not visited:
+            stack.append((node, True))
+            for child in (node.right, node.left):
+                if child is not None:
+                    stack.append((child, False))
+            continue
+        children = [child for child in (node.left, node.right) if child is not None]
+        if all(id(child) in constants for child in children):
+            with numpy.errstate(all='ignore'):
+                constants[id(node)] = node.operation.vector_action(
+                    *[constants[id(child)] for child in children])
+            continue
+        if node.operation.opcode not in _templates:
+            raise NotSupportedOperationError(node.operation.string_representation)
+        key = (node.operation.opcode,) + tuple(
+            names[id(child)] if id(child) in names else _number(constants[id(child)])
+            for child in children)
+        if key not in computed:
+            computed[key] = 't{0}'.format(len(statements))
+            statements.append((computed[key], key[0], key[1:]))
+        names[id(node)] = computed[key]
+    root = expression.root
+    return statements, names[id(root)] if id(root) in names else _number(constants[id(root)])
+
+def _body(statements, result):
+    """
+    Returns source of the statements and of the returned value.
+    Temporary array is updated in place by its last user if possible
+    (x + y is the same as y + x in floating point), otherwise it is
+    deleted after the last use, so the memory is reused as early as
+    in Expression.value_in_columns.
+    """
+    last_use = {}
+    for (i, (target, opcode, arguments)) in enumerate(statements):
+        for argument in arguments:
+            last_use[argument] = i
+    last_use[result] = len(statements)
+    #temporary name -> name of the array holding its value
+    arrays = {}
+    lines = []
+    for (i, (target, opcode, arguments)) in enumerate(statements):
+        dying = [a for a in dict.fromkeys(arguments) if a in arrays and last_use[a] == i]
+        template = _in_place.get(opcode)
+        if template is not None and dying and (dying[0] == arguments[0] or
+                                               opcode in _commutative):
+            array = arrays[dying[0]]
+            other = list(arguments)
+            other.remove(dying[0])
+            lines.append(template.format(array, *[arrays.get(a, a) for a in other]))
+            arrays[target] = array
+            dying = dying[1:]
+        else:
+            lines.append('{0} = {1}'.format(
+                target, _templates[opcode].format(*[arrays.get(a, a) for a in arguments])))
+            arrays[target] = target
+        if dying:
+            lines.append('del ' + ', '.join(arrays[a] for a in dying))
+    if result in arrays:
+        #temporary arrays are computed from variables, so they have all rows
+        returned = arrays[result]
+    elif result.startswith('v'):
+        returned = result + '.copy()'
+    else:
+        returned = 'numpy.full(X.shape[0], {0})'.format(result)
+    return lines, returned
+
+def export_source(expression:Expression, name='predict'):
+    """
+    Returns source of the standalone Python module with the function
+    name(X) that computes the expression for all rows of the 2D array X
+    with numpy, see the docstring of the generated function. Module
+    depends only on numpy, protected operations (division, log, power)
+    give the same values as Expression.value_in_columns.
+    Expression is exported as is, simplify it before the export (solve
+    returns already simplified expression).
+    """
+    lines, result = _body(*_statements(expression))
+    opcodes = set()
+    stack = [expression.root]
+    while stack:
+        node = stack.pop()
+        opcodes.add(node.operation.opcode)
+        stack.extend(child for child in (node.left, node.right) if child is not None)
+    helpers = ''.join(_helpers[opcode] + '\n' for opcode in sorted(_helpers) if opcode in opcodes)
+    return _module_template.format(
+        expression=str(expression),
+        variables=list(expression.variables),
+        helpers=helpers,
+        name=name,
+        width=len(expression.variables),
+        row_shape='-1, 1' if len(expression.variables) == 1 else '1, -1',
+        columns=''.join('    v{0} = numpy.ascontiguousarray(X[:, {0}])\n'.format(i)
+                        for i in range(0, len(expression.variables))),
+        body=''.join('        {0}\n'.format(line) for line in lines) or '        pass\n',
+        result=result)
+
+def export_predictor(expression:Expression):
+    """
+    Returns function predict(X) compiled from the exported source,
+    see export_source.
+    """
+    namespace = {}
+    exec(compile(export_source(expression), '<exported {0}>'.format(expression), 'exec'),
+         namespace)
+    return namespace['predict']
+
+def save(expression:Expression, filename, name='predict'):
+    """
+    Writes exported module to the file.
+    """
+    with open(filename, 'w') as output:
+        output.write(export_source(expression, name))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports expression as numpy predictor module.')
+    parser.add_argument('expression', help='expression text, e.g. printed by node_main.py')
+    parser.add_argument('--variables', nargs='+', required=True,
+                        help='names of the variables in the order of the columns')
+    parser.add_argument('--output', default='predictor.py')
+    parser.add_argument('--name', default='predict', help='name of the exported function')
+    args = parser.parse_args()
+
+    save(Expression.parse(args.expression, args.variables), args.output, args.name)
+    print('Saved {0}'.format(args.output))
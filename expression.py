@@ -2,22 +2,44 @@ __author__ = 'Stanislav Ushakov'
 
 import random
 import math
+import re
+
+import numpy
 
 class NotSupportedOperationError(Exception): pass
 
+class ExpressionSyntaxError(ValueError): pass
+
 class Operation:
     """
     Class represents single operation.
     It isn't supposed to create instances of Operation class in code.
-    Operations.{OPERATION} must be used instead.
-    is_unary - True, if operation is unary
+    Operations.{OPERATION} must be used instead, new operations must be
+    added with Operations.register.
+    opcode - small integer, unique key of the operation in the registry,
+    it is used for pickling.
+    operation_type - number, variable, unary or binary operation.
     action - function that returns result of this operation (1 or 2 arguments)
+    vector_action - the same as action, but works with numpy arrays
     string_representation - for printing expressions
+    Protected operations (e.g. division by zero) are handled inside both
+    action and vector_action, so they never raise for any float arguments,
+    including inf and nan (results of exp and power may be infinite).
+    enabled - if True, operation is used for generating and mutating
+    expressions.
+    interval_action - function that returns interval (low, high) containing
+    all results of the operation for arguments from the given intervals
+    (1 or 2 intervals), if None - result isn't bounded.
     """
-    def __init__(self, operation_type, action, string_representation=''):
+    def __init__(self, opcode, operation_type, action, string_representation='',
+                 vector_action=None, enabled=True, interval_action=None):
+        self.opcode = opcode
         self._operation_type = operation_type
         self.action = action
+        self.vector_action = vector_action if vector_action is not None else action
         self.string_representation = string_representation
+        self.enabled = enabled
+        self.interval_action = interval_action
 
     def is_number(self):
         return self._operation_type == Operations._number
@@ -31,94 +53,256 @@ class Operation:
     def is_binary(self):
         return  self._operation_type == Operations._binary_operation
 
-    #ugly stuff for serializing
-
-    _dict_key = 'operation'
-
-    def __getstate__(self):
-        """
-        Because of problems with pickle, have to override this method.
+    def arity(self):
         """
-        if self._operation_type == Operations._number:
-            return {self._dict_key : 'number'}
-        if self._operation_type == Operations._variable:
-            return {self._dict_key : 'variable'}
-        return {self._dict_key : self.string_representation}
-
-    def __setstate__(self, state):
+        Returns number of arguments of the operation.
+        Number and variable have no arguments.
         """
-        Initializes operation where unpickling
-        """
-        if state[self._dict_key] == 'number':
-            operator = Operations.NUMBER
-        elif state[self._dict_key] == 'variable':
-            operator = Operations.IDENTITY
-        elif state[self._dict_key] == '+':
-            operator = Operations.PLUS
-        elif state[self._dict_key] == '-':
-            operator = Operations.MINUS
-        elif state[self._dict_key] == '*':
-            operator = Operations.MULTIPLICATION
-        elif state[self._dict_key] == '/':
-            operator = Operations.DIVISION
-        elif state[self._dict_key] == 'sin':
-            operator = Operations.SIN
-        elif state[self._dict_key] == 'cos':
-            operator = Operations.COS
-        self._init_from_operation(operator)
-
-    def _init_from_operation(self, operation):
-        self._operation_type = operation._operation_type
-        self.action = operation.action
-        if hasattr(operation, 'string_representation'):
-            self.string_representation = operation.string_representation
+        if self.is_unary():
+            return 1
+        if self.is_binary():
+            return 2
+        return 0
+
+    def __reduce__(self):
+        """
+        Operations are singletons: only opcode is pickled and
+        unpickling returns the registered operation.
+        """
+        return Operations.get_operation, (self.opcode,)
+
+def _protected_division(x, y):
+    return x / y if y != 0 else x / 0.000001
+
+def _protected_exp(x):
+    return math.exp(min(x, 700.0))
+
+def _protected_sin(x):
+    #math.sin raises for inf, numpy.sin gives nan
+    return math.sin(x) if math.isfinite(x) else math.nan
+
+def _protected_cos(x):
+    return math.cos(x) if math.isfinite(x) else math.nan
+
+def _protected_log(x):
+    return math.log(abs(x)) if x != 0 else 0.0
+
+def _protected_power(x, y):
+    if x == 0:
+        return 0.0
+    try:
+        return math.pow(abs(x), y)
+    except OverflowError:
+        return math.inf
+
+def _vector_protected_division(x, y):
+    return numpy.where(y != 0, x, x * 1000000) / numpy.where(y != 0, y, 1)
+
+def _vector_protected_log(x):
+    return numpy.where(x != 0, numpy.log(numpy.where(x != 0, numpy.abs(x), 1)), 0.0)
+
+def _vector_protected_power(x, y):
+    #numpy raises on integers to negative integer powers, numbers may be integers after rounding
+    x = numpy.asarray(x, dtype=numpy.float64)
+    return numpy.where(x != 0, numpy.power(numpy.where(x != 0, numpy.abs(x), 1), y), 0.0)
+
+#interval arithmetic, intervals are tuples (low, high)
+_unbounded = (-math.inf, math.inf)
+
+def _interval(low, high):
+    #inf - inf and 0 * inf give nan, such interval isn't bounded
+    if math.isnan(low) or math.isnan(high):
+        return _unbounded
+    return low, high
+
+def _interval_multiplication(x, y):
+    products = [x[0] * y[0], x[0] * y[1], x[1] * y[0], x[1] * y[1]]
+    if any(math.isnan(p) for p in products):
+        return _unbounded
+    return min(products), max(products)
+
+def _interval_division(x, y):
+    if y[0] == 0 and y[1] == 0:
+        return _interval_multiplication(x, (1000000.0, 1000000.0))
+    if y[0] <= 0 <= y[1]:
+        return _unbounded
+    return _interval_multiplication(x, (1 / y[1], 1 / y[0]))
+
+def _interval_absolute(x):
+    if x[0] >= 0:
+        return x
+    if x[1] <= 0:
+        return -x[1], -x[0]
+    return 0.0, max(-x[0], x[1])
+
+def _interval_log(x):
+    (low, high) = _interval_absolute(x)
+    if high == 0:
+        return 0.0, 0.0
+    if low == 0:
+        #log(0) is replaced by 0
+        return -math.inf, max(math.log(high), 0.0)
+    return math.log(low), math.log(high)
 
 class Operations:
     """
-    Class represents all possible operations.
+    Class represents registry of all possible operations.
+    Operations are stored by opcode, so decoding of the pickled
+    operation is a single dictionary lookup.
     """
     _number = 0
     _variable = 1
     _unary_operation = 2
     _binary_operation = 3
 
-    NUMBER = Operation(operation_type=_number,
-                       action=(lambda x: x))
-    IDENTITY = Operation(operation_type=_variable,
-                         action=(lambda x: x))
-    PLUS =  Operation(operation_type=_binary_operation,
-                      action=(lambda x, y: x + y),
-                      string_representation='+')
-    MINUS = Operation(operation_type=_binary_operation,
-                      action=(lambda x, y: x - y),
-                      string_representation='-')
-    MULTIPLICATION = Operation(operation_type=_binary_operation,
-                               action=(lambda x, y: x * y),
-                               string_representation='*')
-    DIVISION = Operation(operation_type=_binary_operation,
-                         action=(lambda x, y: x / y if y != 0 else x / 0.000001),
-                         string_representation='/')
-    SIN = Operation(operation_type=_unary_operation,
-                    action=(lambda x: math.sin(x)),
-                    string_representation='sin')
-    COS = Operation(operation_type=_unary_operation,
-                    action=(lambda x: math.cos(x)),
-                    string_representation='cos')
+    #opcode -> operation
+    _registry = {}
+    #string representation -> operation
+    _registry_by_name = {}
+    #cached lists of enabled operations
+    _unary_operations = []
+    _binary_operations = []
+
+    @classmethod
+    def register(cls, operation):
+        """
+        Adds new operation to the registry and returns it.
+        Opcodes and string representations of the operations
+        must be unique.
+        """
+        if operation.opcode in cls._registry:
+            raise ValueError('Opcode {0} is already registered'.format(operation.opcode))
+        cls._registry[operation.opcode] = operation
+        if operation.string_representation:
+            cls._registry_by_name[operation.string_representation] = operation
+        cls._update_enabled()
+        return operation
+
+    @classmethod
+    def get_operation(cls, opcode):
+        """
+        Returns operation by its opcode.
+        """
+        try:
+            return cls._registry[opcode]
+        except KeyError:
+            raise NotSupportedOperationError(opcode)
+
+    @classmethod
+    def get_operation_by_name(cls, name):
+        """
+        Returns operation by its string representation, e.g. '+' or 'sin'.
+        """
+        try:
+            return cls._registry_by_name[name]
+        except KeyError:
+            raise NotSupportedOperationError(name)
+
+    @classmethod
+    def get_all_operations(cls):
+        """
+        Returns list of all registered operations ordered by opcode.
+        """
+        return [cls._registry[opcode] for opcode in sorted(cls._registry)]
+
+    @classmethod
+    def set_enabled(cls, operation, enabled=True):
+        """
+        Enables or disables operation for generating and mutating expressions.
+        """
+        operation.enabled = enabled
+        cls._update_enabled()
 
     @classmethod
     def get_unary_operations(cls):
         """
-        Returns list of unary operations.
+        Returns list of enabled unary operations.
         Number and variable are not unary operations
         """
-        return [Operations.SIN, Operations.COS]
+        return cls._unary_operations
 
     @classmethod
     def get_binary_operations(cls):
         """
-        Returns list of all possible binary operations
+        Returns list of all enabled binary operations
         """
-        return [Operations.PLUS, Operations.MINUS, Operations.MULTIPLICATION, Operations.DIVISION]
+        return cls._binary_operations
+
+    @classmethod
+    def _update_enabled(cls):
+        operations = cls.get_all_operations()
+        cls._unary_operations = [op for op in operations if op.is_unary() and op.enabled]
+        cls._binary_operations = [op for op in operations if op.is_binary() and op.enabled]
+
+Operations.NUMBER = Operations.register(Operation(
+    opcode=0, operation_type=Operations._number,
+    action=(lambda x: x)))
+Operations.IDENTITY = Operations.register(Operation(
+    opcode=1, operation_type=Operations._variable,
+    action=(lambda x: x)))
+Operations.PLUS = Operations.register(Operation(
+    opcode=2, operation_type=Operations._binary_operation,
+    action=(lambda x, y: x + y),
+    interval_action=(lambda x, y: _interval(x[0] + y[0], x[1] + y[1])),
+    string_representation='+'))
+Operations.MINUS = Operations.register(Operation(
+    opcode=3, operation_type=Operations._binary_operation,
+    action=(lambda x, y: x - y),
+    interval_action=(lambda x, y: _interval(x[0] - y[1], x[1] - y[0])),
+    string_representation='-'))
+Operations.MULTIPLICATION = Operations.register(Operation(
+    opcode=4, operation_type=Operations._binary_operation,
+    action=(lambda x, y: x * y),
+    interval_action=_interval_multiplication,
+    string_representation='*'))
+Operations.DIVISION = Operations.register(Operation(
+    opcode=5, operation_type=Operations._binary_operation,
+    action=_protected_division,
+    vector_action=_vector_protected_division,
+    interval_action=_interval_division,
+    string_representation='/'))
+Operations.SIN = Operations.register(Operation(
+    opcode=6, operation_type=Operations._unary_operation,
+    action=_protected_sin,
+    vector_action=numpy.sin,
+    interval_action=(lambda x: (-1.0, 1.0)),
+    string_representation='sin'))
+Operations.COS = Operations.register(Operation(
+    opcode=7, operation_type=Operations._unary_operation,
+    action=_protected_cos,
+    vector_action=numpy.cos,
+    interval_action=(lambda x: (-1.0, 1.0)),
+    string_representation='cos'))
+
+#additional operations, disabled by default
+Operations.EXP = Operations.register(Operation(
+    opcode=8, operation_type=Operations._unary_operation,
+    action=_protected_exp,
+    vector_action=(lambda x: numpy.exp(numpy.minimum(x, 700.0))),
+    interval_action=(lambda x: (_protected_exp(x[0]), _protected_exp(x[1]))),
+    string_representation='exp',
+    enabled=False))
+Operations.LOG = Operations.register(Operation(
+    opcode=9, operation_type=Operations._unary_operation,
+    action=_protected_log,
+    vector_action=_vector_protected_log,
+    interval_action=_interval_log,
+    string_representation='log',
+    enabled=False))
+Operations.SQRT = Operations.register(Operation(
+    opcode=10, operation_type=Operations._unary_operation,
+    action=(lambda x: math.sqrt(abs(x))),
+    vector_action=(lambda x: numpy.sqrt(numpy.abs(x))),
+    interval_action=(lambda x: tuple(math.sqrt(v) for v in _interval_absolute(x))),
+    string_representation='sqrt',
+    enabled=False))
+Operations.POWER = Operations.register(Operation(
+    opcode=11, operation_type=Operations._binary_operation,
+    action=_protected_power,
+    vector_action=_vector_protected_power,
+    interval_action=(lambda x, y: (0.0, math.inf)),
+    string_representation='^',
+    enabled=False))
 
 class Node:
     """
@@ -161,6 +345,64 @@ class Node:
         return self.operation.action(self.left.value_in_point(values),
             self.right.value_in_point(values))
 
+    def value_in_columns(self, columns):
+        """
+        Vectorized version of value_in_point. Returns values in the current
+        node calculated for all points at once.
+        columns - dictionary containing numpy arrays with values for all
+        needed variables, e.g. {'x': array([1, 2]), 'y': array([2, 3])}
+        Result may be a single number, if there are no variables in the tree.
+        """
+        if self.is_number():
+            return self.value
+        if self.is_variable():
+            return columns[self.value]
+
+        if self.is_unary():
+            return self.operation.vector_action(self.left.value_in_columns(columns))
+
+        return self.operation.vector_action(self.left.value_in_columns(columns),
+            self.right.value_in_columns(columns))
+
+    def copy(self, pool=None):
+        """
+        Returns copy of the tree which root is the current node.
+        Much faster than copy.deepcopy, nodes are taken from the pool
+        if it is passed (see NodePool).
+        """
+        make = pool.node if pool is not None else Node
+        root = make(self.operation, value=self.value)
+        stack = [(self, root)]
+        while stack:
+            (source, target) = stack.pop()
+            if source.left is not None:
+                target.left = make(source.left.operation, value=source.left.value)
+                stack.append((source.left, target.left))
+            if source.right is not None:
+                target.right = make(source.right.operation, value=source.right.value)
+                stack.append((source.right, target.right))
+        return root
+
+    def interval(self, ranges):
+        """
+        Returns interval (low, high) containing values of the tree which
+        root is the current node for all values of the variables from
+        ranges - dictionary {variable name: (low, high)}.
+        Bound is computed with interval arithmetic in O(number of nodes),
+        it may be wider than the real range of values.
+        """
+        if self.is_number():
+            value = float(self.value)
+            return (value, value) if not math.isnan(value) else _unbounded
+        if self.is_variable():
+            return ranges[self.value]
+        if self.operation.interval_action is None:
+            return _unbounded
+        if self.is_unary():
+            return self.operation.interval_action(self.left.interval(ranges))
+        return self.operation.interval_action(self.left.interval(ranges),
+                                              self.right.interval(ranges))
+
     def height(self):
         """
         Returns height of the tree which root is the current node.
@@ -173,6 +415,21 @@ class Node:
         return max(self.left.height() if self.left is not None else 0,
             self.right.height() if self.right is not None else 0) + 1
 
+    def size(self):
+        """
+        Returns number of nodes in the tree which root is the current node.
+        """
+        size = 0
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            size += 1
+            if node.left is not None:
+                stack.append(node.left)
+            if node.right is not None:
+                stack.append(node.right)
+        return size
+
     def is_number(self):
         """
         Returns True only if the current node represents a number.
@@ -207,8 +464,9 @@ class Node:
         """
         #TODO: add more rules
 
-        #leave only 3 digits after decimal point
-        if self.is_number():
+        #leave only 3 digits after decimal point, exp and power may give
+        #numbers too big for rounding
+        if self.is_number() and math.isfinite(self.value * 1000):
             self.value = round(self.value * 1000) / 1000
 
         #calculate unary function for number
@@ -281,18 +539,30 @@ class Node:
         Returns string representation of tree which root is the
         current node.
         All binary operation has a pair of parentheses.
-        """
-        if self.is_number() or self.is_variable():
-            return str(self.value)
-
-        if self.is_unary():
-            return self.operation.string_representation + '(' +\
-                   (str(self.left) if self.left is not None else 'None') + ')'
-
-        if self.is_binary():
-            return '(' + (str(self.left) if self.left is not None else 'None') +\
-                   ' ' + self.operation.string_representation + ' ' +\
-                   (str(self.right) if self.right is not None else 'None') + ')'
+        Parts of the string are collected in the list and joined once,
+        so the time is linear in the size of the tree for any height.
+        """
+        parts = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.__class__ is str:
+                parts.append(node)
+            elif node is None:
+                parts.append('None')
+            elif node.is_number() or node.is_variable():
+                parts.append(str(node.value))
+            elif node.is_unary():
+                parts.append(node.operation.string_representation + '(')
+                stack.append(')')
+                stack.append(node.left)
+            else:
+                parts.append('(')
+                stack.append(')')
+                stack.append(node.right)
+                stack.append(' ' + node.operation.string_representation + ' ')
+                stack.append(node.left)
+        return ''.join(parts)
 
     def __repr__(self):
         """
@@ -311,8 +581,9 @@ class Node:
     def __getstate__(self):
         """
         Override this method due to pickling instance.
+        Operation is stored as its opcode.
         """
-        result = {self._operation_dict_key: self.operation.__getstate__(),
+        result = {self._operation_dict_key: self.operation.opcode,
                   self._value_dict_key: self.value}
         if self.left is not None:
             result[self._left_node_dict_key] = self.left.__getstate__()
@@ -325,15 +596,67 @@ class Node:
         This method is being called while unpickling.
         """
         self.value = state[self._value_dict_key]
-        self.operation = Operation(None, None)
-        self.operation.__setstate__(state[self._operation_dict_key])
+        self.operation = Operations.get_operation(state[self._operation_dict_key])
+        self.left = None
+        self.right = None
         if self._left_node_dict_key in state:
-            self.left = Node(Operations.NUMBER)
+            self.left = Node.__new__(Node)
             self.left.__setstate__(state[self._left_node_dict_key])
         if self._right_node_dict_key in state:
-            self.right = Node(Operations.NUMBER)
+            self.right = Node.__new__(Node)
             self.right.__setstate__(state[self._right_node_dict_key])
 
+class NodePool:
+    """
+    Free list of Node objects. Nodes of the discarded trees are given
+    back with release and reused for the new trees, so fewer objects
+    are allocated and tracked by the garbage collector.
+    Released tree must not be used anymore.
+    capacity - maximal number of free nodes kept in the pool.
+    created and reused - number of nodes allocated and taken from the pool.
+    """
+    def __init__(self, capacity=100000):
+        self.capacity = capacity
+        self.created = 0
+        self.reused = 0
+        self._free = []
+
+    def node(self, operation, left=None, right=None, value=None):
+        """
+        Returns node initialized as Node(operation, left, right, value).
+        """
+        if self._free:
+            node = self._free.pop()
+            self.reused += 1
+        else:
+            node = Node.__new__(Node)
+            self.created += 1
+        node.operation = operation
+        node.left = left
+        node.right = right
+        node.value = value
+        return node
+
+    def release(self, node, recursive=True):
+        """
+        Returns all nodes of the tree which root is the given node to the
+        pool, or only the node itself if recursive is False.
+        """
+        free = self._free
+        stack = [node]
+        while stack and len(free) < self.capacity:
+            node = stack.pop()
+            if recursive:
+                if node.left is not None:
+                    stack.append(node.left)
+                if node.right is not None:
+                    stack.append(node.right)
+            node.left = node.right = node.value = None
+            free.append(node)
+
+    def __len__(self):
+        return len(self._free)
+
 class Expression:
     """
     This class is used for representing expression tree.
@@ -362,12 +685,14 @@ class Expression:
                                  Operations.get_binary_operations())
 
     @classmethod
-    def generate_random(cls, max_height, variables):
+    def generate_random(cls, max_height, variables, pool=None):
         """
         Generates random expression tree which height is not more than given
         max_height value with variable names from variables list.
+        pool - NodePool to take nodes from, if None - nodes are created.
         """
-        root = Node(Expression.generate_operator(only_binary=True))
+        make = pool.node if pool is not None else Node
+        root = make(Expression.generate_operator(only_binary=True))
         current = [root]
         while len(current) > 0:
             node = current.pop(0)
@@ -380,16 +705,21 @@ class Expression:
                 continue
 
             if node.is_unary():
-                node.left = Node(Expression.generate_operator())
+                node.left = make(Expression.generate_operator())
                 if root.height() > max_height:
+                    if pool is not None:
+                        pool.release(node.left)
                     node.left = None
                 else:
                     current.append(node.left)
 
             if node.is_binary():
-                node.left = Node(Expression.generate_operator())
-                node.right = Node(Expression.generate_operator())
+                node.left = make(Expression.generate_operator())
+                node.right = make(Expression.generate_operator())
                 if root.height() > max_height:
+                    if pool is not None:
+                        pool.release(node.left)
+                        pool.release(node.right)
                     node.left = None
                     node.right = None
                 else:
@@ -397,23 +727,26 @@ class Expression:
                     current.append(node.right)
 
         #turn all leaves into numbers or variables
+        #(iterative pre-order traversal, recursive closure would be
+        #a reference cycle left for the garbage collector)
         leaves = []
-        def traverse_tree(node):
+        stack = [root]
+        while stack:
+            node = stack.pop()
             if node.is_number() or node.is_variable():
-                return
+                continue
             if node.is_unary():
                 if node.left is None:
                     leaves.append(node)
                 else:
-                    traverse_tree(node.left)
+                    stack.append(node.left)
             if node.is_binary():
                 if node.left is None:
                     leaves.append(node)
-                else:
-                    traverse_tree(node.left)
                 if node.right is not None:
-                    traverse_tree(node.right)
-        traverse_tree(root)
+                    stack.append(node.right)
+                if node.left is not None:
+                    stack.append(node.left)
 
         for node in leaves:
             if random.random() > 0.5:
@@ -433,12 +766,141 @@ class Expression:
         self.root = root
         self.variables = variables
 
+    _operand_pattern = re.compile(
+        r'\s*(?:(\()|([A-Za-z_]\w*)(\()?|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|[-+]inf))')
+    _operator_pattern = re.compile(r'\s*(\S+)\s')
+    _close_pattern = re.compile(r'\s*\)')
+    _special_numbers = {'inf': math.inf, 'nan': math.nan}
+
+    @classmethod
+    def parse(cls, text, variables=None):
+        """
+        Returns expression from its string representation, e.g.
+        '(sin(x) + (2.5 * y))', so str(Expression.parse(s)) == s
+        for every s returned by str.
+        variables - list of variable names of the expression, by default
+        all names used in the text. Names that aren't variables or
+        operations are 'inf' and 'nan' numbers.
+        Raises ExpressionSyntaxError if the text is malformed and
+        NotSupportedOperationError for unknown operations.
+        Parser is not recursive, so the height of the tree is not limited.
+        """
+        known = set(variables) if variables is not None else None
+        found = []
+        #stack of unfinished nodes: unary node or binary node without the right child
+        stack = []
+        position = 0
+        while True:
+            match = cls._operand_pattern.match(text, position)
+            if match is None:
+                raise ExpressionSyntaxError('expected operand at {0}: {1!r}'.format(
+                    position, text))
+            position = match.end()
+            (opening, name, call, number) = match.groups()
+            if opening is not None:
+                stack.append(None)
+                continue
+            if call is not None:
+                operation = Operations.get_operation_by_name(name)
+                if not operation.is_unary():
+                    raise ExpressionSyntaxError('{0} is not unary operation'.format(name))
+                stack.append(Node(operation))
+                continue
+            if name == 'None':
+                raise ExpressionSyntaxError('missing operand at {0}: {1!r}'.format(
+                    match.start(2), text))
+            if name is not None:
+                if (name in known) if known is not None else (name not in cls._special_numbers):
+                    node = Node(Operations.IDENTITY, value=name)
+                    if known is None and name not in found:
+                        found.append(name)
+                elif name in cls._special_numbers:
+                    node = Node(Operations.NUMBER, value=cls._special_numbers[name])
+                else:
+                    raise ExpressionSyntaxError('unknown variable: {0}'.format(name))
+            else:
+                node = Node(Operations.NUMBER,
+                            value=int(number) if number.lstrip('+-').isdigit() else float(number))
+
+            #close finished nodes
+            while stack and stack[-1] is not None and (
+                    stack[-1].is_unary() or stack[-1].left is not None):
+                match = cls._close_pattern.match(text, position)
+                if match is None:
+                    raise ExpressionSyntaxError('expected ) at {0}: {1!r}'.format(
+                        position, text))
+                position = match.end()
+                parent = stack.pop()
+                if parent.is_unary():
+                    parent.left = node
+                else:
+                    parent.right = node
+                node = parent
+            if not stack:
+                break
+            #node is the left child of the binary operation
+            match = cls._operator_pattern.match(text, position)
+            if match is None:
+                raise ExpressionSyntaxError('expected operation at {0}: {1!r}'.format(
+                    position, text))
+            position = match.end()
+            operation = Operations.get_operation_by_name(match.group(1))
+            if not operation.is_binary():
+                raise ExpressionSyntaxError('{0} is not binary operation'.format(match.group(1)))
+            stack[-1] = Node(operation, left=node)
+        if text[position:].strip():
+            raise ExpressionSyntaxError('unexpected text at {0}: {1!r}'.format(position, text))
+        return Expression(root=node, variables=list(variables) if variables is not None else found)
+
     def value_in_point(self, values):
         """
         Returns value calculated for given values of variables.
         """
         return self.root.value_in_point(values)
 
+    def value_in_columns(self, columns):
+        """
+        Returns values calculated for all points at once.
+        columns - dictionary {variable name: numpy array of values}.
+        """
+        return self.root.value_in_columns(columns)
+
+    def size(self):
+        """
+        Returns number of nodes in the expression tree.
+        """
+        return self.root.size()
+
+    def copy(self, pool=None):
+        """
+        Returns copy of the expression tree, see Node.copy.
+        List of variables is shared.
+        """
+        return Expression(root=self.root.copy(pool), variables=self.variables)
+
+    def interval(self, ranges):
+        """
+        Returns interval containing all values of the expression for the
+        variables from ranges, see Node.interval.
+        """
+        return self.root.interval(ranges)
+
+    def get_number_nodes(self):
+        """
+        Returns list of all nodes representing numbers.
+        """
+        nodes = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.is_number():
+                nodes.append(node)
+            if node.right is not None:
+                stack.append(node.right)
+            if node.left is not None:
+                stack.append(node.left)
+        return nodes
+
     def simplify(self):
         """
         Simplifies entire expression tree.
@@ -2,16 +2,46 @@ __author__ = 'Stanislav Ushakov'
 
 import math
 import random
-import copy
 import json
+import gc
+import contextlib
+import io
+import os
+import pickle
+import time
 
-from expression import Expression, Operations
+import numpy
+
+from expression import Expression, Operations, NodePool
+from selection import create_selection, best_indices
+from optimization import ConstantsOptimizer
+from scheduling import create_mutation_scheduler, create_exchange_schedule, SubsampleSchedule
+from telemetry import NullTelemetry
+from archive import HallOfFame
+from exchanger import RingExchanger
+
+class DataFormatError(ValueError): pass
+
+#lower bound of the fitness value must exceed the threshold by this factor
+#to discard the expression, so rounding errors never discard good ones
+_pruning_margin = 1 + 1e-6
+
+#allocations between collections of the youngest generation if config.gc_tuning is set
+_gc_tuned_threshold = 50000
+
+#name of the target in the data file without names of the targets
+_default_target = 'f'
 
 class FitnessFunction:
     """
     Used for calculating fitness function for
     given expression.
     Value is simple Euclidean norm for vector.
+    Expressions are evaluated for all points at once using numpy arrays.
+    Function may be evaluated on a subset of points (see resample), in this
+    case value is scaled to estimate value on the full data set.
+    Expressions may be evaluated in float32 (see set_precision), in this
+    case full_value and exact_residuals still use float64.
     """
     def __init__(self, exact_values):
         """
@@ -21,46 +51,319 @@ class FitnessFunction:
          ({'x': 2, 'y': 2}, 0.250)]
         """
         self.exact_values = exact_values
+        variables = exact_values[0][0].keys() if exact_values else []
+        self._init_columns(
+            {var: numpy.array([point[var] for (point, value) in exact_values], dtype=float)
+             for var in variables},
+            numpy.array([value for (point, value) in exact_values], dtype=float))
+
+    @classmethod
+    def from_columns(cls, columns, targets):
+        """
+        Returns function initialized with numpy arrays of values:
+        columns - dictionary {variable name: array of values},
+        targets - array of the exact function values.
+        Arrays aren't copied, so they may be views of the shared memory.
+        """
+        result = cls.__new__(cls)
+        result.exact_values = None
+        result._init_columns(columns, targets)
+        return result
+
+    def _init_columns(self, columns, targets):
+        self.columns = columns
+        self.targets = targets
+        self.precision = 'float64'
+        self._evaluation_columns = columns
+        self._evaluation_targets = targets
+        self._set_active(None)
+        self._targets_order = None
+
+    def set_precision(self, precision):
+        """
+        Sets precision of the evaluation: 'float64' or 'float32'.
+        In float32 mode the float32 copy of the data set is used by
+        expression_value, so evaluation reads half as much memory,
+        but the values are approximate and have to be verified with
+        full_value.
+        """
+        if precision == 'float64':
+            self._evaluation_columns = self.columns
+            self._evaluation_targets = self.targets
+        elif precision == 'float32':
+            self._evaluation_columns = {var: column.astype(numpy.float32)
+                                        for (var, column) in self.columns.items()}
+            self._evaluation_targets = self.targets.astype(numpy.float32)
+        else:
+            raise ValueError('Unknown precision: {0}'.format(precision))
+        self.precision = precision
+        self._set_active(self.sample)
+
+    def resample(self, size, stratified=False):
+        """
+        Selects subset of size points that is used for the following
+        evaluations. If size isn't less than number of points - full data
+        set is used.
+        stratified - if True, points are selected uniformly from the
+        sorted exact values, so the subset covers the whole range of values.
+        """
+        number_of_points = len(self.targets)
+        if size >= number_of_points:
+            self._set_active(None)
+            return
+        rng = numpy.random.default_rng(random.getrandbits(64))
+        if stratified:
+            if self._targets_order is None:
+                self._targets_order = numpy.argsort(self.targets, kind='stable')
+            strata = number_of_points / size
+            positions = ((numpy.arange(size) + rng.random(size)) * strata).astype(int)
+            sample = self._targets_order[numpy.minimum(positions, number_of_points - 1)]
+        else:
+            sample = rng.choice(number_of_points, size=size, replace=False)
+        self._set_active(sample)
+
+    def is_subsampled(self):
+        """
+        Returns True if only subset of points is used for evaluation.
+        """
+        return self.sample is not None
+
+    def is_approximate(self):
+        """
+        Returns True if expression_value differs from full_value: only
+        subset of points is used or evaluation is done in float32.
+        """
+        return self.sample is not None or self.precision != 'float64'
+
+    def memory_usage(self):
+        """
+        Returns number of bytes of the data read by single evaluation.
+        """
+        return (sum(column.nbytes for column in self.evaluation_columns.values()) +
+                self.evaluation_targets.nbytes)
+
+    def residuals(self, expression:Expression):
+        """
+        Returns numpy array of differences between expression values
+        and exact values in all currently used points, calculated with
+        the current precision.
+        """
+        with numpy.errstate(all='ignore'):
+            return expression.value_in_columns(self.evaluation_columns) - self.evaluation_targets
+
+    def exact_residuals(self, expression:Expression):
+        """
+        The same as residuals, but always calculated in float64.
+        """
+        with numpy.errstate(all='ignore'):
+            return expression.value_in_columns(self.active_columns) - self.active_targets
+
+    def norm(self, residuals):
+        """
+        Returns value of the fitness function for the given residuals in
+        currently used points.
+        """
+        with numpy.errstate(all='ignore'):
+            value = math.sqrt(numpy.dot(residuals, residuals)) * self.scale
+        return value if not math.isnan(value) else math.inf
 
     def expression_value(self, expression:Expression):
         """
         Returns value of the fitness function for given
         expression. The less the value - the closer expression to
         the unknown function.
+        If expression can't be calculated (e.g. overflow) returns infinity.
         """
-        sum = 0
-        for (variables, value) in self.exact_values:
-            sum += ((expression.value_in_point(variables) - value) *
-                    (expression.value_in_point(variables) - value))
-        return math.sqrt(sum)
+        return self.norm(numpy.broadcast_to(self.residuals(expression),
+                                            self.evaluation_targets.shape))
 
+    def lower_bound(self, expression:Expression):
+        """
+        Returns lower bound of expression_value without evaluating the
+        expression in the points. Interval of the expression values over
+        the ranges of the variables is computed in O(number of nodes),
+        then distance from every exact value to this interval is summed
+        in O(log(number of points)) using prefix sums of the sorted
+        exact values.
+        Bound is exact up to rounding errors, so it should be compared
+        with some margin.
+        """
+        if self._bound_data is None:
+            self._bound_data = self._prepare_bound()
+        (ranges, center, sorted_targets, sums, squares) = self._bound_data
+        (low, high) = expression.interval(ranges)
+        if low == math.inf or high == -math.inf:
+            return math.inf
+        n = len(sorted_targets)
+        total = 0.0
+        if low > -math.inf:
+            low -= center
+            i = int(numpy.searchsorted(sorted_targets, low, side='left'))
+            if i > 0:
+                total += i * low * low - 2 * low * sums[i] + squares[i]
+        if high < math.inf:
+            high -= center
+            j = int(numpy.searchsorted(sorted_targets, high, side='right'))
+            if j < n:
+                total += ((n - j) * high * high - 2 * high * (sums[n] - sums[j]) +
+                          (squares[n] - squares[j]))
+        return math.sqrt(max(total, 0.0)) * self.scale
+
+    def _prepare_bound(self):
+        """
+        Returns ranges of the variables and prefix sums of the sorted
+        exact values used by lower_bound. Values are centered to
+        reduce rounding errors.
+        """
+        ranges = {var: (float(column.min()), float(column.max())) if len(column) > 0
+                  else (0.0, 0.0) for (var, column) in self.active_columns.items()}
+        center = float(self.active_targets.mean()) if len(self.active_targets) > 0 else 0.0
+        sorted_targets = numpy.sort(self.active_targets) - center
+        sums = numpy.concatenate(([0.0], numpy.cumsum(sorted_targets)))
+        squares = numpy.concatenate(([0.0], numpy.cumsum(sorted_targets * sorted_targets)))
+        return ranges, center, sorted_targets, sums, squares
+
+    def full_value(self, expression:Expression):
+        """
+        Returns value of the fitness function calculated for all points
+        regardless of the current subset.
+        """
+        with numpy.errstate(all='ignore'):
+            residuals = expression.value_in_columns(self.columns) - self.targets
+            value = math.sqrt(numpy.dot(residuals, residuals))
+        return value if not math.isnan(value) else math.inf
+
+    def _set_active(self, sample):
+        """
+        Sets points used for evaluation: sample - array of indices or
+        None for all points.
+        """
+        self.sample = sample
+        self._bound_data = None
+        if sample is None:
+            self.active_columns = self.columns
+            self.active_targets = self.targets
+            self.evaluation_columns = self._evaluation_columns
+            self.evaluation_targets = self._evaluation_targets
+            self.scale = 1.0
+        else:
+            self.active_columns = {var: column[sample] for (var, column) in self.columns.items()}
+            self.active_targets = self.targets[sample]
+            if self.precision == 'float64':
+                self.evaluation_columns = self.active_columns
+                self.evaluation_targets = self.active_targets
+            else:
+                self.evaluation_columns = {var: column[sample] for (var, column)
+                                           in self._evaluation_columns.items()}
+                self.evaluation_targets = self._evaluation_targets[sample]
+            self.scale = math.sqrt(len(self.targets) / len(sample))
+
+
+class MultiTargetFitnessFunction:
+    """
+    Fitness function for several targets depending on the same variables.
+    Expression is evaluated once and compared with all targets in one pass.
+    Values are cached by the text of the expression, so the populations
+    of the different targets (see MultiTargetImmuneSystem) don't evaluate
+    the same tree twice.
+    evaluations and cache_hits - number of evaluations and cached values
+    returned.
+    """
+    def __init__(self, columns, targets, cache_size=10000):
+        """
+        columns - dictionary {variable name: array of values},
+        targets - dictionary {target name: array of values}.
+        cache_size - maximal number of cached expressions.
+        """
+        self.columns = columns
+        self.target_names = list(targets)
+        self.targets = numpy.vstack([targets[name] for name in self.target_names])
+        self.cache_size = cache_size
+        self.evaluations = 0
+        self.cache_hits = 0
+        self._cache = {}
+
+    def values(self, expression:Expression):
+        """
+        Returns array of the fitness values of the expression for all
+        targets, in the order of target_names.
+        """
+        key = str(expression)
+        values = self._cache.get(key)
+        if values is not None:
+            self.cache_hits += 1
+            return values
+        with numpy.errstate(all='ignore'):
+            residuals = expression.value_in_columns(self.columns) - self.targets
+            values = numpy.sqrt(numpy.einsum('ij,ij->i', residuals, residuals))
+        values[numpy.isnan(values)] = math.inf
+        if len(self._cache) >= self.cache_size:
+            self._cache.clear()
+        self._cache[key] = values
+        self.evaluations += 1
+        return values
+
+    def target(self, name):
+        """
+        Returns FitnessFunction of the single target that takes values
+        from this function.
+        """
+        return TargetFitnessFunction.from_shared(self, self.target_names.index(name))
+
+class TargetFitnessFunction(FitnessFunction):
+    """
+    Fitness function of the single target of MultiTargetFitnessFunction.
+    While all points are evaluated in float64, expression_value is taken
+    from the shared evaluation of all targets, otherwise it is calculated
+    as usual.
+    """
+    @classmethod
+    def from_shared(cls, shared, index):
+        result = cls.from_columns(shared.columns, shared.targets[index])
+        result.shared = shared
+        result.index = index
+        return result
+
+    def expression_value(self, expression:Expression):
+        if self.is_approximate():
+            return FitnessFunction.expression_value(self, expression)
+        return float(self.shared.values(expression)[self.index])
 
 class ExpressionMutator:
     """
     This class encapsulates all logic for mutating selected lymphocytes.
     """
-    def __init__(self, expression:Expression):
+    #names of all mutation methods
+    mutation_names = ['number_mutation', 'variable_mutation', 'unary_mutation',
+                      'binary_mutation', 'subtree_mutation']
+
+    def __init__(self, expression:Expression, scheduler=None, pool=None):
         """
         Initializes mutator with the given expression.
         NOTE: expression itself won't be changed. Instead of its
         changing, the new expression will be returned.
+        scheduler - object that chooses the mutation (see scheduling module),
+        if None - all mutations are of equal possibilities.
+        pool - NodePool used for the new nodes, replaced nodes are
+        returned to it.
         """
-        self.expression = copy.deepcopy(expression)
-        self.mutations = [
-            self.number_mutation,
-            self.variable_mutation,
-            self.unary_mutation,
-            self.binary_mutation,
-            self.subtree_mutation]
+        self.expression = expression.copy(pool)
+        self.scheduler = scheduler
+        self.pool = pool
+        self.last_mutation = None
 
     def mutation(self):
         """
         Returns the mutated version of the expression.
-        All mutations are of equal possibilities.
-        May be change.
+        Name of the applied mutation is stored in last_mutation.
         """
-        mutation = random.choice(self.mutations)
-        mutation()
+        #bound methods aren't stored in the mutator, otherwise every
+        #mutator would be a reference cycle freed only by the collector
+        if self.scheduler is None:
+            self.last_mutation = random.choice(self.mutation_names)
+        else:
+            self.last_mutation = self.scheduler.choose()
+        getattr(self, self.last_mutation)()
         return self.expression
 
     def number_mutation(self):
@@ -121,11 +424,18 @@ class ExpressionMutator:
 
         selected_node = random.choice(nodes)
         max_height = self.expression.root.height() - selected_node.height()
-        new_subtree = Expression.generate_random(max_height, self.expression.variables)
+        new_subtree = Expression.generate_random(max_height, self.expression.variables,
+                                                 pool=self.pool)
+        if self.pool is not None:
+            for child in (selected_node.left, selected_node.right):
+                if child is not None:
+                    self.pool.release(child)
         selected_node.operation = new_subtree.root.operation
         selected_node.value = new_subtree.root.value
         selected_node.left = new_subtree.root.left
         selected_node.right = new_subtree.root.right
+        if self.pool is not None:
+            self.pool.release(new_subtree.root, recursive=False)
 
     def _get_all_nodes_by_filter(self, filter_func):
         """
@@ -133,14 +443,17 @@ class ExpressionMutator:
         """
         nodes = []
 
-        def traverse_tree(node):
+        #iterative pre-order traversal, recursive closure would be
+        #a reference cycle left for the garbage collector
+        stack = [self.expression.root]
+        while stack:
+            node = stack.pop()
             if filter_func(node):
                 nodes.append(node)
-            if node.left is not None:
-                traverse_tree(node.left)
             if node.right is not None:
-                traverse_tree(node.right)
-        traverse_tree(self.expression.root)
+                stack.append(node.right)
+            if node.left is not None:
+                stack.append(node.left)
 
         return nodes
 
@@ -158,6 +471,43 @@ class ExpressionsImmuneSystemConfig:
     _number_of_iterations_default = 100
     _number_of_iterations_to_exchange_default = 25
     _maximal_height_default = 4
+    _selection_default = 'truncation'
+    _tournament_size_default = 3
+    _constants_optimization_top_k_default = 0
+    _constants_optimization_iterations_default = 5
+    _mutation_scheduler_default = 'uniform'
+    _subsample_size_default = 0
+    _subsample_mode_default = 'random'
+    _subsample_growth_default = 2.0
+    #number of the best lymphocytes re-scored on the full data set in float64
+    #when fitness values are approximate (subsample or float32 evaluation)
+    _verification_elites_default = 5
+    _exchange_mode_default = 'async'
+    _exchange_timeout_default = 1.0
+    _hall_of_fame_size_default = 10
+    _evaluation_precision_default = 'float64'
+    _interval_pruning_default = False
+    _node_pool_size_default = 0
+    _gc_tuning_default = False
+    _exchange_schedule_default = 'fixed'
+    _exchange_window_default = 10
+    _exchange_min_interval_default = 10
+    _exchange_max_interval_default = 50
+    _exchange_delta_default = True
+
+    #names of all values
+    _names = ['number_of_lymphocytes', 'number_of_iterations',
+              'number_of_iterations_to_exchange', 'maximal_height',
+              'selection', 'tournament_size',
+              'constants_optimization_top_k', 'constants_optimization_iterations',
+              'mutation_scheduler',
+              'subsample_size', 'subsample_mode', 'subsample_growth',
+              'verification_elites',
+              'exchange_mode', 'exchange_timeout',
+              'hall_of_fame_size', 'evaluation_precision', 'interval_pruning',
+              'node_pool_size', 'gc_tuning',
+              'exchange_schedule', 'exchange_window', 'exchange_min_interval',
+              'exchange_max_interval', 'exchange_delta']
 
     def __init__(self):
         """
@@ -169,29 +519,44 @@ class ExpressionsImmuneSystemConfig:
             file.close()
         except IOError:
             config = None
-        if config is None:
-            self.number_of_lymphocytes = ExpressionsImmuneSystemConfig._number_of_lymphocytes_default
-            self.number_of_iterations = ExpressionsImmuneSystemConfig._number_of_iterations_default
-            self.number_of_iterations_to_exchange = ExpressionsImmuneSystemConfig._number_of_iterations_to_exchange_default
-            self.maximal_height = ExpressionsImmuneSystemConfig._maximal_height_default
-        else:
-            self.number_of_lymphocytes = config['number_of_lymphocytes']
-            self.number_of_iterations = config['number_of_iterations']
-            self.number_of_iterations_to_exchange = config['number_of_iterations_to_exchange']
-            self.maximal_height = config['maximal_height']
+        self._load(config if config is not None else {})
+
+    @classmethod
+    def from_dict(cls, config):
+        """
+        Returns config object with values from the given dictionary
+        (config file isn't read). Missing values are set to defaults.
+        """
+        result = cls.__new__(cls)
+        result._load(config)
+        return result
+
+    def _load(self, config):
+        """
+        Sets values from the config dictionary, missing values are
+        set to defaults.
+        """
+        if 'subsample_elites' in config and 'verification_elites' not in config:
+            #old name of verification_elites, it is used by float32 mode too
+            config = dict(config, verification_elites=config['subsample_elites'])
+        for name in self._names:
+            setattr(self, name, config.get(name, getattr(ExpressionsImmuneSystemConfig,
+                                                         '_' + name + '_default')))
 
     def save(self):
         """
         Saves current configuration to config file.
         """
         file = open(ExpressionsImmuneSystemConfig._filename, mode='w')
-        config = {'number_of_lymphocytes': self.number_of_lymphocytes,
-                  'number_of_iterations': self.number_of_iterations,
-                  'number_of_iterations_to_exchange': self.number_of_iterations_to_exchange,
-                  'maximal_height': self.maximal_height}
-        json.dump(config, file)
+        json.dump(self.to_dict(), file)
         file.close()
 
+    def to_dict(self):
+        """
+        Returns current configuration as dictionary.
+        """
+        return {name: getattr(self, name) for name in self._names}
+
 class ExpressionsImmuneSystem:
     """
     Class represents entire immune system.
@@ -199,52 +564,211 @@ class ExpressionsImmuneSystem:
     On each step the best lymphocytes are selected for the mutation.
     """
 
-    def __init__(self, exact_values, variables, exchanger, config):
+    def __init__(self, exact_values, variables, exchanger, config, seed=None,
+                 telemetry=None, fitness_function=None, initial_expressions=None):
         """
         Initializes the immune system with the exact_values, list of variables,
         exchanger object and config object.
+        fitness_function - already created FitnessFunction, if passed
+        exact_values are not used and may be None.
+        seed - seed for the random numbers generator, if None - system
+        time or other random source is used.
+        telemetry - Telemetry object collecting time of each phase and
+        counters for every generation, if None - nothing is collected.
+        initial_expressions - expressions (Expression objects or strings,
+        see Expression.parse) included in the first generation, e.g. the
+        best results of the previous runs. The rest of the lymphocytes
+        is generated randomly.
         lymphocytes - list that stores current value of the whole system.
+        fitness_values - numpy array of the fitness values of the lymphocytes
+        in the same order, None if they have to be recalculated.
+        mutation_statistics - statistics of the mutation operators, filled
+        at the end of solve.
+        exchange_schedule - defines generations of the exchanging steps and
+        collects their number and time (see scheduling.ExchangeSchedule).
+        hall_of_fame - archive of the best distinct expressions seen during
+        all generations (see HallOfFame).
+        node_pool - NodePool if config.node_pool_size > 0, discarded
+        lymphocytes are released to it, so the exchanger must not keep
+        references to the lymphocytes given to it (PeerToPeerExchanger
+        serializes them at once).
+        verification_statistics - if fitness values are approximate
+        (subsample or float32 evaluation), number of generations when the
+        best elites were verified on the full data set in float64, and how
+        many times verification changed the best one or the order of elites.
         """
         self.exact_values = exact_values
         self.variables = variables
-        self.fitness_function = FitnessFunction(exact_values)
+        self.fitness_function = (fitness_function if fitness_function is not None
+                                 else FitnessFunction(exact_values))
+        self.fitness_function.set_precision(config.evaluation_precision)
         self.exchanger = exchanger
+        self.telemetry = telemetry if telemetry is not None else NullTelemetry()
+        self.generation = 0
+        #first generation of the next solve, changed by restore_state
+        self.start_generation = 0
 
         #config
         self.config = config
+        self.selection = create_selection(config)
+        self.constants_optimizer = ConstantsOptimizer(
+            self.fitness_function,
+            iterations=self.config.constants_optimization_iterations)
+        self.mutation_scheduler = create_mutation_scheduler(config,
+                                                            ExpressionMutator.mutation_names)
+        self.mutation_statistics = None
+        self.exchange_schedule = create_exchange_schedule(config)
+        self.hall_of_fame = HallOfFame(self.config.hall_of_fame_size)
+        self.verification_statistics = {'generations': 0, 'best_changed': 0, 'reordered': 0}
+        #nodes of the discarded lymphocytes are reused for the new ones
+        self.node_pool = (NodePool(self.config.node_pool_size)
+                          if self.config.node_pool_size > 0 else None)
+        if self.config.subsample_size > 0:
+            self.subsample_schedule = SubsampleSchedule(self.config.subsample_size,
+                                                        len(self.fitness_function.targets),
+                                                        growth=self.config.subsample_growth)
+        else:
+            self.subsample_schedule = None
 
-        self.lymphocytes = []
-        for i in range(0, self.config.number_of_lymphocytes):
+        random.seed(seed)
+        self.lymphocytes = [e.copy() if isinstance(e, Expression)
+                            else Expression.parse(e, variables)
+                            for e in (initial_expressions or [])]
+        del self.lymphocytes[self.config.number_of_lymphocytes:]
+        for i in range(len(self.lymphocytes), self.config.number_of_lymphocytes):
             self.lymphocytes.append(Expression.generate_random(
                                         self.config.maximal_height,
                                         variables))
+        self.fitness_values = None
 
         #Initialize Exchanger with the first generated lymphocytes
         self.exchanger.set_lymphocytes_to_exchange(self.lymphocytes[:])
 
-        random.seed()
-
-    def solve(self, accuracy=0.001):
+    def solve(self, accuracy=0.001, checkpoint=None, checkpoint_interval=10,
+              with_hall_of_fame=False, time_limit=None):
         """
         After defined number of steps returns the best lymphocyte as
         an answer.
+        checkpoint - file name, if passed state of the system is saved to
+        this file every checkpoint_interval generations (see restore_state).
+        with_hall_of_fame - if True, tuple (best, hall_of_fame) is returned.
+        time_limit - if passed, solving is stopped after the generation
+        that exceeded this number of seconds.
+        """
+        start = time.perf_counter()
+        self.telemetry.start_capture()
+        #profiler and memory tracing must not stay on if the generation fails
+        try:
+            with self._gc_tuning():
+                start_generation, self.start_generation = self.start_generation, 0
+                for i in range(start_generation, self.config.number_of_iterations):
+                    best_value = self.run_generation(i)
+                    if checkpoint is not None and (i + 1) % checkpoint_interval == 0:
+                        self.save_state(checkpoint, next_generation=i + 1)
+                    if best_value <= accuracy:
+                        break
+                    if time_limit is not None and time.perf_counter() - start >= time_limit:
+                        break
+                best = self.finish()
+        finally:
+            self.telemetry.stop_capture()
+        return (best, self.hall_of_fame) if with_hall_of_fame else best
+
+    def run_generation(self, i):
+        """
+        Runs generation number i: step or exchanging step, local search,
+        choosing of the best lymphocyte and updating of the hall of fame.
+        Returns fitness value of the best lymphocyte.
         """
-        def return_best():
+        telemetry = self.telemetry
+        self.generation = i
+        if self.subsample_schedule is not None:
+            self.resampling_step()
+        #if we reach exchanging step
+        if self.exchange_schedule.is_exchange(i):
+            start = time.perf_counter()
+            self.exchanging_step()
+            self.exchange_schedule.record(i, time.perf_counter() - start)
+        else:
+            self.step()
+        if self.config.constants_optimization_top_k > 0:
+            self.optimization_step()
+        with telemetry.phase('best'):
+            scored = self._get_scored_elites()
+            best_value = min(value for (index, value) in scored)
+            if self.fitness_function.is_approximate():
+                self._update_verification_statistics(scored)
+            for (index, value) in scored:
+                self.hall_of_fame.add(self.lymphocytes[index], value)
+        self.exchange_schedule.update(i, best_value)
+        telemetry.end_generation(i, best_fitness=best_value,
+                                 lymphocytes=len(self.lymphocytes))
+        return best_value
+
+    def finish(self):
+        """
+        Returns simplified best lymphocyte at the end of solving and
+        collects statistics.
+        """
+        with self.telemetry.phase('simplify'):
             best = self.best()
             best.simplify()
-            return best
+        self.mutation_statistics = self.mutation_scheduler.statistics()
+        self.telemetry.stop_capture()
+        return best
 
-        for i in range(0, self.config.number_of_iterations):
-            #if we reach exchanging step
-            if i != 0 and i % self.config.number_of_iterations_to_exchange == 0:
-                self.exchanging_step()
-            else:
-                self.step()
-            best = self.best()
-            if self.fitness_function.expression_value(best) <= accuracy:
-                return return_best()
+    @contextlib.contextmanager
+    def _gc_tuning(self):
+        """
+        If config.gc_tuning is set, objects existing before the solve
+        (data, operations, modules) are moved to the permanent generation,
+        so the collector doesn't traverse them, and the collection of the
+        youngest generation is triggered less often. Trees don't have
+        reference cycles, so they are freed by reference counting anyway.
+        Previous state of the collector is restored at the end.
+        """
+        if not self.config.gc_tuning:
+            yield
+            return
+        thresholds = gc.get_threshold()
+        gc.collect()
+        gc.freeze()
+        gc.set_threshold(_gc_tuned_threshold, *thresholds[1:])
+        try:
+            yield
+        finally:
+            gc.set_threshold(*thresholds)
+            gc.unfreeze()
+
+    def save_state(self, filename, next_generation=None):
+        """
+        Saves lymphocytes, state of the random numbers generator and
+        generation to continue from (by default - the current one) to the
+        file. File is replaced atomically, so it always contains the
+        complete state.
+        """
+        state = {'generation': (next_generation if next_generation is not None
+                                else self.generation),
+                 'lymphocytes': self.lymphocytes,
+                 'hall_of_fame': self.hall_of_fame,
+                 'random_state': random.getstate()}
+        temporary = filename + '.tmp'
+        with open(temporary, 'wb') as output:
+            pickle.dump(state, output, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, filename)
 
-        return return_best()
+    def restore_state(self, filename):
+        """
+        Restores state saved by save_state. The following solve
+        continues from the saved generation.
+        """
+        with open(filename, 'rb') as input:
+            state = pickle.load(input)
+        self.generation = self.start_generation = state['generation']
+        self.lymphocytes = state['lymphocytes']
+        self.hall_of_fame = state['hall_of_fame']
+        self.fitness_values = None
+        random.setstate(state['random_state'])
 
     def step(self):
         """
@@ -252,12 +776,67 @@ class ExpressionsImmuneSystem:
         The half of the lymphocytes are mutated. The new system
         consists of this half and their mutated 'children'.
         """
-        sorted_lymphocytes = self._get_sorted_lymphocytes_index_and_value()
-        best = []
-        for (i, e) in sorted_lymphocytes[:self.config.number_of_lymphocytes // 2]:
-            best.append(self.lymphocytes[i])
-        mutated = [ExpressionMutator(e).mutation() for e in best]
+        fitness_values = self._get_fitness_values()
+        with self.telemetry.phase('selection'):
+            selected = self.selection.select(fitness_values,
+                                             self.config.number_of_lymphocytes // 2)
+        best = [self.lymphocytes[i] for i in selected]
+        best_values = [fitness_values[i] for i in selected]
+        #mutant that is worse than all selected lymphocytes can't survive
+        threshold = max(best_values) if self.config.interval_pruning and best_values else None
+        mutated = []
+        mutated_values = []
+        evaluated = []
+        mutation_time = evaluation_time = 0.0
+        for (e, value) in zip(best, best_values):
+            start = time.perf_counter()
+            mutator = ExpressionMutator(e, self.mutation_scheduler, self.node_pool)
+            mutant = mutator.mutation()
+            mutated_time = time.perf_counter()
+            if threshold is not None and self._is_hopeless(mutant, threshold):
+                mutant_value = math.inf
+            else:
+                mutant_value = self.fitness_function.expression_value(mutant)
+                evaluated.append(mutant)
+            end = time.perf_counter()
+            self.mutation_scheduler.update(mutator.last_mutation, value, mutant_value,
+                                           end - start)
+            mutation_time += mutated_time - start
+            evaluation_time += end - mutated_time
+            mutated.append(mutant)
+            mutated_values.append(mutant_value)
+        if self.telemetry.enabled:
+            self.telemetry.add_time('mutation', mutation_time)
+            self.telemetry.add_time('evaluation', evaluation_time)
+            self.telemetry.count('trees_copied', len(mutated))
+            self.telemetry.count('lymphocytes_pruned', len(mutated) - len(evaluated))
+            self._count_evaluated_nodes(evaluated)
+        self._release_discarded(selected)
         self.lymphocytes = best + mutated
+        self.fitness_values = numpy.array(best_values + mutated_values, dtype=numpy.float64)
+
+    def resampling_step(self):
+        """
+        Selects new subset of points for the fitness function. Size of the
+        subset grows as the best fitness value improves.
+        """
+        with self.telemetry.phase('resampling'):
+            best_value = (min(self.fitness_values) if self.fitness_values is not None
+                          else math.inf)
+            size = self.subsample_schedule.next_size(best_value)
+            self.fitness_function.resample(size,
+                                           stratified=(self.config.subsample_mode == 'stratified'))
+            self.fitness_values = None
+
+    def optimization_step(self):
+        """
+        Represents the local search step: numbers of the best lymphocytes
+        are tuned by the constants optimizer.
+        """
+        fitness_values = self._get_fitness_values()
+        with self.telemetry.phase('optimization'):
+            for i in best_indices(fitness_values, self.config.constants_optimization_top_k):
+                fitness_values[i] = self.constants_optimizer.optimize(self.lymphocytes[i])
 
     def exchanging_step(self):
         """
@@ -265,33 +844,171 @@ class ExpressionsImmuneSystem:
         Take some lymphocytes from the exchanger and merge them with current available.
         Also set new lymphocytes to exchange (exactly - copy of them)
         """
-        self.exchanger.set_lymphocytes_to_exchange(self.lymphocytes[:])
-        others = self.exchanger.get_lymphocytes()
+        fitness_values = self._get_fitness_values()
+        with self.telemetry.phase('exchange'):
+            bytes_received = getattr(self.exchanger, 'bytes_received', 0)
+            self.exchanger.set_lymphocytes_to_exchange(self.lymphocytes[:],
+                                                       generation=self.generation)
+            others = self.exchanger.get_lymphocytes(generation=self.generation)
+        if self.telemetry.enabled:
+            self.telemetry.count('exchange_bytes',
+                                 getattr(self.exchanger, 'bytes_received', 0) - bytes_received)
+            self.telemetry.count('lymphocytes_received', len(others))
+            self._count_evaluated_nodes(others)
+        with self.telemetry.phase('evaluation'):
+            #received lymphocyte that is worse than all current ones can't survive
+            threshold = (fitness_values.max()
+                         if self.config.interval_pruning and len(fitness_values) > 0 else None)
+            fitness_values = numpy.concatenate((fitness_values, numpy.array([
+                math.inf if threshold is not None and self._is_hopeless(e, threshold)
+                else self.fitness_function.expression_value(e) for e in others],
+                dtype=numpy.float64)))
         self.lymphocytes = self.lymphocytes + others
 
         #get only best - as many as we need
-        sorted_lymphocytes = self._get_sorted_lymphocytes_index_and_value()
-        best = []
-        for (i, e) in sorted_lymphocytes[:self.config.number_of_lymphocytes]:
-            best.append(self.lymphocytes[i])
-
-        self.lymphocytes = best
+        with self.telemetry.phase('selection'):
+            selected = self.selection.select(fitness_values,
+                                             self.config.number_of_lymphocytes)
+        self._release_discarded(selected)
+        self.lymphocytes = [self.lymphocytes[i] for i in selected]
+        self.fitness_values = fitness_values[selected]
 
     def best(self):
         """
         Returns the best lymphocyte in the system.
         """
-        return self.lymphocytes[self._get_sorted_lymphocytes_index_and_value()[0][0]]
+        return self.lymphocytes[self._get_best_index_and_value()[0]]
+
+    def _get_best_index_and_value(self):
+        """
+        Returns index of the best lymphocyte and its fitness value.
+        """
+        return min(self._get_scored_elites(), key=lambda scored: scored[1])
+
+    def _get_scored_elites(self):
+        """
+        Returns list of (index, fitness value) of the lymphocytes competing
+        for the best one. Usually these are all lymphocytes, but if fitness
+        values are approximate (subsample or float32), the best
+        config.verification_elites lymphocytes (elites) are re-scored on
+        the full data set in float64, elites are in the order of
+        approximate values.
+        """
+        fitness_values = self._get_fitness_values()
+        if not self.fitness_function.is_approximate():
+            return list(enumerate(fitness_values))
+        elites = best_indices(fitness_values, self.config.verification_elites)
+        return [(i, self.fitness_function.full_value(self.lymphocytes[i])) for i in elites]
 
-    def _get_sorted_lymphocytes_index_and_value(self):
+    def _release_discarded(self, selected):
         """
-        Returns list of lymphocytes and their numbers in the original system
-        in sorted order.
+        Returns nodes of the lymphocytes that aren't selected to the pool.
         """
-        fitness_values = []
-        for (i, e) in enumerate(self.lymphocytes):
-            fitness_values.append((i, self.fitness_function.expression_value(e)))
-        return sorted(fitness_values, key=lambda item: item[1])
+        if self.node_pool is None:
+            return
+        #the same tree may be referenced twice, so trees are compared by identity
+        kept = set(id(self.lymphocytes[i]) for i in selected)
+        for e in self.lymphocytes:
+            if id(e) not in kept:
+                kept.add(id(e))
+                self.node_pool.release(e.root)
+
+    def _is_hopeless(self, expression, threshold):
+        """
+        Returns True if lower bound of the fitness value of the expression
+        (see FitnessFunction.lower_bound) is worse than threshold,
+        so the expression may be discarded without evaluation.
+        """
+        return self.fitness_function.lower_bound(expression) > threshold * _pruning_margin
+
+    def _update_verification_statistics(self, scored):
+        """
+        Compares the order of elites by approximate and verified values.
+        """
+        values = [value for (index, value) in scored]
+        statistics = self.verification_statistics
+        statistics['generations'] += 1
+        if values and min(values) < values[0]:
+            statistics['best_changed'] += 1
+        if values != sorted(values):
+            statistics['reordered'] += 1
+
+    def _get_fitness_values(self):
+        """
+        Returns numpy array of fitness values of the lymphocytes in the
+        same order as lymphocytes are stored. Values are calculated only
+        once for each generation.
+        """
+        if self.fitness_values is None:
+            with self.telemetry.phase('evaluation'):
+                self.fitness_values = numpy.array(
+                    [self.fitness_function.expression_value(e) for e in self.lymphocytes],
+                    dtype=numpy.float64)
+            if self.telemetry.enabled:
+                self._count_evaluated_nodes(self.lymphocytes)
+        return self.fitness_values
+
+    def _count_evaluated_nodes(self, expressions):
+        """
+        Increases telemetry counter of evaluated nodes: each node of
+        the expression is evaluated once for every used point.
+        """
+        points = len(self.fitness_function.active_targets)
+        self.telemetry.count('nodes_evaluated',
+                             sum(e.size() for e in expressions) * points)
+
+class MultiTargetImmuneSystem:
+    """
+    Solves several targets depending on the same variables at once: one
+    immune system (population) for each target, all of them are run
+    generation by generation in turn. Systems share evaluations through
+    MultiTargetFitnessFunction and exchange lymphocytes with each other
+    in a ring (see RingExchanger), so lymphocytes received from the other
+    target are usually already evaluated.
+    """
+    def __init__(self, variables, columns, targets, config, seed=None, cache_size=10000):
+        """
+        columns - dictionary {variable name: array of values},
+        targets - dictionary {target name: array of values},
+        see DataFileStorageHelper.load_targets.
+        seed - seed of the first system, the following systems get seed + 1,
+        seed + 2 and so on.
+        systems - dictionary {target name: ExpressionsImmuneSystem}.
+        """
+        self.config = config
+        self.fitness_function = MultiTargetFitnessFunction(columns, targets, cache_size)
+        names = self.fitness_function.target_names
+        exchangers = RingExchanger.ring(len(names))
+        self.systems = {}
+        for (i, name) in enumerate(names):
+            self.systems[name] = ExpressionsImmuneSystem(
+                None, variables, exchangers[i], config,
+                seed=seed + i if seed is not None else None,
+                fitness_function=self.fitness_function.target(name))
+
+    def solve(self, accuracy=0.001, time_limit=None):
+        """
+        Returns dictionary {target name: the best lymphocyte}. System
+        stops when its best value reaches the accuracy, the others
+        continue.
+        """
+        start = time.perf_counter()
+        running = list(self.systems.values())
+        for system in running:
+            system.telemetry.start_capture()
+        try:
+            with running[0]._gc_tuning():
+                for i in range(0, self.config.number_of_iterations):
+                    running = [system for system in running
+                               if system.run_generation(i) > accuracy]
+                    if not running:
+                        break
+                    if time_limit is not None and time.perf_counter() - start >= time_limit:
+                        break
+                return {name: system.finish() for (name, system) in self.systems.items()}
+        finally:
+            for system in self.systems.values():
+                system.telemetry.stop_capture()
 
 class DataFileStorageHelper:
     """
@@ -300,25 +1017,63 @@ class DataFileStorageHelper:
     """
     @classmethod
     def save_to_file(cls, filename, variables, function, points_number,
-                     min_point=-5.0, max_point=5.0):
+                     min_point=-5.0, max_point=5.0, seed=None, grid=False):
         """
         Saves values of the function in randomly generated points.
+        seed - seed of the points generator, makes the file reproducible.
+        grid - if True, points are placed on the regular grid with
+        round(points_number ** (1 / len(variables))) points on each axis
+        instead of uniformly random points.
+        Function is called once with arrays of the variable values (so
+        functions written with numpy are evaluated in one pass), if it
+        fails - once per point.
+        If filename ends with '.npz', the values are saved in binary
+        columnar format, otherwise as text.
+        """
+        columns = cls.generate_points(len(variables), points_number, min_point, max_point,
+                                      seed, grid)
+        targets = cls.evaluate(function, columns)
+        if filename.endswith('.npz'):
+            numpy.savez(filename, variables=numpy.array(variables), data=numpy.vstack(
+                [columns, targets]))
+            return
+        with open(filename, 'w') as output:
+            numpy.savetxt(output, numpy.vstack([columns, targets]).T, fmt='%.17g',
+                          header=' '.join(variables), comments='')
+
+    @staticmethod
+    def generate_points(dimension, points_number, min_point=-5.0, max_point=5.0,
+                        seed=None, grid=False):
         """
-        values = []
-        for i in range(0, points_number):
-            arg_dict = {}
-            for arg in variables:
-                arg_dict[arg] = random.random() * (max_point - min_point) + min_point
-            values.append((arg_dict, function(*arg_dict.values())))
-        output = open(filename, 'w')
-        for arg in variables:
-            print(arg, end=' ', file=output)
-        print(file=output)
-        for (arg, f) in values:
-            for var in variables:
-                print(arg[var], end=' ', file=output)
-            print(f, file=output)
-        output.close()
+        Returns 2D array of the points: one row of values for each variable.
+        """
+        if grid:
+            size = max(2, int(round(points_number ** (1.0 / dimension))))
+            axis = numpy.linspace(min_point, max_point, size)
+            mesh = numpy.meshgrid(*([axis] * dimension), indexing='ij')
+            return numpy.array([m.ravel() for m in mesh])
+        generator = numpy.random.default_rng(seed)
+        return generator.uniform(min_point, max_point, size=(dimension, points_number))
+
+    @staticmethod
+    def evaluate(function, columns):
+        """
+        Returns array of the function values in the points (see
+        generate_points). Function is called with arrays first, then
+        point by point if the result is not an array of the right shape.
+        """
+        points_number = columns.shape[1]
+        try:
+            with numpy.errstate(all='ignore'):
+                targets = numpy.asarray(function(*columns), dtype=numpy.float64)
+            if targets.ndim == 0:
+                targets = numpy.full(points_number, targets)
+            if targets.shape == (points_number,):
+                return targets
+        except (TypeError, ValueError):
+            pass
+        return numpy.fromiter((function(*point) for point in columns.T),
+                              dtype=numpy.float64, count=points_number)
 
     @classmethod
     def load_from_file(cls, filename):
@@ -327,15 +1082,164 @@ class DataFileStorageHelper:
         Returns tuple (variables, values), where
         variables - list of variable names,
         values - list of ({'x': 0, 'y': 0}, 0)
+        For large files use load_columns, it doesn't create the
+        dictionary for every point.
+        """
+        variables, columns, targets = cls.load_columns(filename)
+        return variables, cls._to_values(variables, columns, targets)
+
+    @classmethod
+    def load_from_string(cls, text):
+        """
+        Loads values of the function from string with the same content
+        as file. Returns tuple (variables, values), see load_from_file.
+        """
+        variables, columns, targets = cls.load_columns_from_string(text)
+        return variables, cls._to_values(variables, columns, targets)
+
+    @classmethod
+    def load_columns(cls, filename):
+        """
+        Loads values of the function from file (text or .npz, see
+        save_to_file) into arrays.
+        Returns tuple (variables, columns, targets), where
+        columns - dictionary {variable name: array of values},
+        targets - array of the exact function values.
+        Raises DataFormatError with the line number if some row is malformed,
+        or if the file contains several targets (see load_targets).
+        """
+        return cls._single_target(*cls.load_targets(filename))
+
+    @classmethod
+    def load_columns_from_string(cls, text):
+        """
+        Loads values of the function from string, see load_columns.
+        """
+        return cls._single_target(*cls.load_targets_from_string(text))
+
+    @classmethod
+    def load_targets(cls, filename):
+        """
+        Loads values of several functions of the same variables from file.
+        Header of the text file is "x y | f g": names of the variables,
+        then names of the targets, one column for each. Header without
+        '|' means the single target named 'f'.
+        Returns tuple (variables, columns, targets), where
+        columns - dictionary {variable name: array of values},
+        targets - dictionary {target name: array of values} in the order
+        of the file.
+        """
+        if filename.endswith('.npz'):
+            with numpy.load(filename) as archive:
+                variables = [str(var) for var in archive['variables']]
+                target_names = ([str(name) for name in archive['targets']]
+                                if 'targets' in archive.files else [_default_target])
+                data = archive['data']
+            return cls._split(variables, target_names, data)
+        with open(filename) as input:
+            return cls._load_columns(input)
+
+    @classmethod
+    def load_targets_from_string(cls, text):
         """
-        input = open(filename)
-        values = []
-        variables = input.readline().split()
-        for s in input:
-            arg = s.split()[:-1]
-            f = s.split()[-1]
-            arg_dict = {}
-            for i in range(0, len(variables)):
-                arg_dict[variables[i]] = float(arg[i])
-            values.append((arg_dict, float(f)))
-        return variables, values
\ No newline at end of file
+        Loads values of several functions from string, see load_targets.
+        """
+        return cls._load_columns(io.StringIO(text))
+
+    @classmethod
+    def iterate(cls, filename):
+        """
+        Generator of the function values from the text file, yields
+        ({'x': 0, 'y': 0}, 0) for every point without loading the whole
+        file. If the file contains several targets, the value is the
+        tuple of their values in the order of the header, e.g.
+        ({'x': 0, 'y': 0}, (0, 1)). Raises DataFormatError with the line
+        number if some row is malformed.
+        """
+        with open(filename) as input:
+            variables, target_names = cls._parse_header(input.readline())
+            width = len(variables) + len(target_names)
+            for (number, line) in enumerate(input, start=2):
+                row = cls._parse_line(line, number, width)
+                if row is not None:
+                    point = dict(zip(variables, row[:len(variables)]))
+                    if len(target_names) == 1:
+                        yield point, row[-1]
+                    else:
+                        yield point, tuple(row[len(variables):])
+
+    @classmethod
+    def _load_columns(cls, input):
+        """
+        Parses the whole input at once with numpy, if it fails - scans
+        the input line by line to find the malformed row.
+        """
+        variables, target_names = cls._parse_header(input.readline())
+        width = len(variables) + len(target_names)
+        data = None
+        try:
+            data = numpy.loadtxt(input, dtype=numpy.float64, ndmin=2)
+        except ValueError:
+            pass
+        if data is None or (data.size > 0 and data.shape[1] != width):
+            input.seek(0)
+            input.readline()
+            for (number, line) in enumerate(input, start=2):
+                cls._parse_line(line, number, width)
+            raise DataFormatError('malformed data')
+        return cls._split(variables, target_names, data.reshape(-1, width).T)
+
+    @staticmethod
+    def _parse_header(line):
+        """
+        Returns names of the variables and names of the targets.
+        """
+        names = line.split()
+        if '|' not in names:
+            target_names = [_default_target]
+        else:
+            separator = names.index('|')
+            names, target_names = names[:separator], names[separator + 1:]
+            if not target_names or '|' in target_names:
+                raise DataFormatError("line 1: expected names of the targets after '|'")
+        if not names:
+            raise DataFormatError('line 1: expected names of the variables')
+        return names, target_names
+
+    @staticmethod
+    def _split(variables, target_names, data):
+        """
+        Returns variables, columns and targets dictionaries, data - 2D
+        array with one row for each variable and target.
+        """
+        return (variables, {var: data[i] for (i, var) in enumerate(variables)},
+                {name: data[len(variables) + i] for (i, name) in enumerate(target_names)})
+
+    @staticmethod
+    def _single_target(variables, columns, targets):
+        if len(targets) != 1:
+            raise DataFormatError('expected single target, got {0} (see load_targets)'.format(
+                ', '.join(targets)))
+        (target,) = targets.values()
+        return variables, columns, target
+
+    @staticmethod
+    def _parse_line(line, number, width):
+        """
+        Returns list of values in the line or None if the line is empty.
+        """
+        values = line.split()
+        if not values:
+            return None
+        if len(values) != width:
+            raise DataFormatError('line {0}: expected {1} values, got {2}'.format(
+                number, width, len(values)))
+        try:
+            return [float(value) for value in values]
+        except ValueError as e:
+            raise DataFormatError('line {0}: {1}'.format(number, e))
+
+    @staticmethod
+    def _to_values(variables, columns, targets):
+        rows = zip(*([columns[var].tolist() for var in variables] + [targets.tolist()]))
+        return [(dict(zip(variables, row[:-1])), row[-1]) for row in rows]
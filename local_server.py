@@ -1,31 +1,206 @@
 __author__ = 'Stanislav Ushakov'
 
+import argparse
+import json
+import os
 import sys
+import threading
 import time
-from subprocess import Popen
+from subprocess import Popen, PIPE
 
-#start as local_server.py number_of_nodes
+from archive import HallOfFame
+
+class NodeProcess:
+    """
+    State of the single node process: output, timings and restarts.
+    """
+    def __init__(self, number, cpu=None):
+        self.number = number
+        self.cpu = cpu
+        self.process = None
+        self.restarts = 0
+        self.started = None
+        self.finished = None
+        self.output = []
+        self.errors = []
+        self.result = None
+        self.returncode = None
+
+    def summary(self):
+        """
+        Returns dictionary describing the node after it is finished.
+        Restarted node reports only generations since its checkpoint, so
+        generations done before the restarts are added, wall time covers
+        all runs as well.
+        """
+        result = self.result or {}
+        generations = result.get('start_generation', 0) + result.get('generations', 0)
+        wall_time = (self.finished - self.started) if self.finished else None
+        return {'node': self.number,
+                'returncode': self.returncode,
+                'restarts': self.restarts,
+                'wall_time': wall_time,
+                'generations': generations,
+                'generations_per_second': generations / wall_time if wall_time else 0.0,
+                'exchanges': result.get('exchanges', 0),
+                'exchange_time': result.get('exchange_time', 0.0),
+                'best': result.get('best'),
+                'fitness': result.get('fitness')}
+
+class NodeSupervisor:
+    """
+    Starts nodes of the distributed immune system on the local machine
+    and watches them. Each node is started with argv list (no shell), its
+    stdout and stderr are collected through pipes. Crashed node is
+    restarted from its last checkpoint up to max_restarts times.
+    pin_cpus - if True, every node is pinned to its own CPU (Linux only).
+    node_arguments - additional arguments for node_main.py.
+    """
+    def __init__(self, nodes, max_restarts=3, pin_cpus=False, checkpoint_directory='.',
+                 node_script='node_main.py', node_arguments=None):
+        self.nodes = nodes
+        self.max_restarts = max_restarts
+        self.checkpoint_directory = checkpoint_directory
+        self.node_script = node_script
+        self.node_arguments = list(node_arguments) if node_arguments is not None else []
+        cpus = (sorted(os.sched_getaffinity(0))
+                if pin_cpus and hasattr(os, 'sched_getaffinity') else None)
+        self.node_processes = [NodeProcess(i + 1, cpus[i % len(cpus)] if cpus else None)
+                               for i in range(0, nodes)]
+        self.lock = threading.Lock()
+
+    def run(self):
+        """
+        Starts all nodes and waits for them. Returns list of node summaries.
+        """
+        start = time.perf_counter()
+        monitors = []
+        for node in self.node_processes:
+            print('Starting {0}...'.format(node.number))
+            node.started = time.perf_counter()
+            self._start(node, resume=False)
+            monitor = threading.Thread(target=self._monitor, args=(node,))
+            monitor.start()
+            monitors.append(monitor)
+        for monitor in monitors:
+            monitor.join()
+        self.wall_time = time.perf_counter() - start
+        return [node.summary() for node in self.node_processes]
+
+    def hall_of_fame(self, capacity=10):
+        """
+        Returns hall of fame merged from the archives of all finished nodes.
+        """
+        result = HallOfFame(capacity)
+        for node in self.node_processes:
+            if node.result is not None:
+                result.merge(HallOfFame.from_list(node.result.get('hall_of_fame', [])))
+        return result
+
+    def _checkpoint(self, node):
+        return os.path.join(self.checkpoint_directory,
+                            'node_{0}.checkpoint'.format(node.number))
+
+    def _arguments(self, node, resume):
+        arguments = [sys.executable, self.node_script, str(node.number), str(self.nodes),
+                     '--json', '--checkpoint', self._checkpoint(node)] + self.node_arguments
+        if resume:
+            arguments.append('--resume')
+        return arguments
+
+    def _start(self, node, resume):
+        node.process = Popen(self._arguments(node, resume), stdout=PIPE, stderr=PIPE,
+                             universal_newlines=True)
+        if node.cpu is not None:
+            #preexec_fn isn't safe here: monitor and reader threads are running
+            try:
+                os.sched_setaffinity(node.process.pid, {node.cpu})
+            except ProcessLookupError:
+                #node has already exited, the monitor will see it
+                pass
+        node.readers = [threading.Thread(target=self._read, args=(node.process.stdout, node.output)),
+                        threading.Thread(target=self._read, args=(node.process.stderr, node.errors))]
+        for reader in node.readers:
+            reader.start()
+
+    @staticmethod
+    def _read(stream, lines):
+        for line in stream:
+            lines.append(line.rstrip('\n'))
+        stream.close()
+
+    def _monitor(self, node):
+        """
+        Waits for the node process, restarts it if it crashed.
+        """
+        while True:
+            returncode = node.process.wait()
+            for reader in node.readers:
+                reader.join()
+            if returncode == 0 or node.restarts >= self.max_restarts:
+                break
+            node.restarts += 1
+            with self.lock:
+                print('Node {0} failed with code {1}, restarting ({2}/{3})'.format(
+                    node.number, returncode, node.restarts, self.max_restarts))
+                for line in node.errors[-5:]:
+                    print('    ' + line)
+            self._start(node, resume=True)
+        node.returncode = returncode
+        node.finished = time.perf_counter()
+        node.result = self._parse_result(node.output)
+        if os.path.exists(self._checkpoint(node)):
+            os.remove(self._checkpoint(node))
+
+    @staticmethod
+    def _parse_result(lines):
+        for line in reversed(lines):
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(result, dict) and 'best' in result:
+                return result
+        return None
+
+def print_summary(summaries, wall_time, hall_of_fame=None):
+    print('{0:>5} {1:>6} {2:>9} {3:>12} {4:>10} {5:>12}  {6}'.format(
+        'node', 'code', 'restarts', 'generations', 'gen/s', 'fitness', 'best'))
+    for s in summaries:
+        print('{0:>5} {1:>6} {2:>9} {3:>12} {4:>10.2f} {5:>12}  {6}'.format(
+            s['node'], str(s['returncode']), s['restarts'], s['generations'],
+            s['generations_per_second'],
+            '{0:.4f}'.format(s['fitness']) if s['fitness'] is not None else '-',
+            s['best'] or '-'))
+    finished = [s for s in summaries if s['fitness'] is not None]
+    print('Total time: {0:.2f}s, total throughput: {1:.2f} generations/s'.format(
+        wall_time, sum(s['generations'] for s in summaries) / wall_time if wall_time > 0 else 0))
+    print('Exchanges: {0}, time spent in them: {1:.2f}s'.format(
+        sum(s['exchanges'] for s in summaries), sum(s['exchange_time'] for s in summaries)))
+    if finished:
+        best = min(finished, key=lambda s: s['fitness'])
+        print('Best: {0} (node {1}, fitness {2:.4f})'.format(best['best'], best['node'],
+                                                             best['fitness']))
+    if hall_of_fame is not None and len(hall_of_fame) > 0:
+        print('Hall of fame:')
+        for (fitness, size, key, item) in hall_of_fame.entries():
+            print('{0:>12.4f} {1:>5}  {2}'.format(fitness, size, key))
+
+#start as local_server.py number_of_nodes [--pin-cpus] [--max-restarts 3]
 if __name__ == '__main__':
-    nodes = int(sys.argv[1])
-
-    def done(p):
-        return p.poll() is not None
-    def success(p):
-        return p.returncode == 0
-
-    processes = []
-    for i in range(0, nodes):
-        print('Starting {0}...'.format(i))
-        processes.append(Popen('python node_main.py ' + str(i + 1) + ' ' + str(nodes)))
-    while True:
-        for p in processes:
-            if done(p):
-                if success(p):
-                    processes.remove(p)
-                else:
-                    print('Error')
-
-        if not processes:
-            break
-        else:
-            time.sleep(0.05)
+    parser = argparse.ArgumentParser(description='Starts nodes of the immune system on localhost.')
+    parser.add_argument('nodes', type=int)
+    parser.add_argument('--max-restarts', type=int, default=3)
+    parser.add_argument('--pin-cpus', action='store_true', help='pin every node to its own CPU')
+    parser.add_argument('--checkpoint-dir', default='.')
+    parser.add_argument('--data', default='test_x_y.txt')
+    args = parser.parse_args()
+
+    supervisor = NodeSupervisor(args.nodes, max_restarts=args.max_restarts,
+                                pin_cpus=args.pin_cpus,
+                                checkpoint_directory=args.checkpoint_dir,
+                                node_arguments=['--data', args.data])
+    summaries = supervisor.run()
+    print_summary(summaries, supervisor.wall_time, supervisor.hall_of_fame())
+    if any(s['returncode'] != 0 for s in summaries):
+        sys.exit(1)
@@ -1,11 +1,11 @@
 __author__ = 'Stanislav Ushakov'
 
-import math
-import time
+import argparse
 
-from expression import Expression
-from immune import ExpressionsImmuneSystem, FitnessFunction, DataFileStorageHelper, ExpressionsImmuneSystemConfig
-from exchanger import SimpleRandomExchanger
+import numpy
+
+from immune import DataFileStorageHelper, ExpressionsImmuneSystemConfig
+from runner import run_restarts
 
 def update_progress(progress:int):
     """
@@ -13,33 +13,24 @@ def update_progress(progress:int):
     """
     print('\r[{0}] {1}%'.format('#' * (progress // 10), progress), end='')
 
+#start as "python main.py [--restarts 5] [--processes N]"
 if __name__ == "__main__":
-    number_of_lymphocytes = 100
-    max_height = 4
+    parser = argparse.ArgumentParser(description='Runs independent restarts of the immune system.')
+    parser.add_argument('--restarts', type=int, default=5)
+    parser.add_argument('--processes', type=int, default=None,
+                        help='number of worker processes, by default number of CPUs')
+    args = parser.parse_args()
 
-    DataFileStorageHelper.save_to_file('test_x_y.txt', ['x', 'y'], lambda x, y: x*x + x*y*math.sin(x*y), 100)
+    DataFileStorageHelper.save_to_file('test_x_y.txt', ['x', 'y'], lambda x, y: x*x + x*y*numpy.sin(x*y), 100)
 
     variables, values = DataFileStorageHelper.load_from_file('test_x_y.txt')
 
-    f = FitnessFunction(values)
-    exchanger = SimpleRandomExchanger(
-        lambda: [Expression.generate_random(max_height=max_height, variables=variables)
-                for i in range(0, number_of_lymphocytes // 2)])
-
     config = ExpressionsImmuneSystemConfig()
 
-    results = []
-    iterations = 5
-    start = time.clock()
-    for i in range(0, iterations):
-        immuneSystem = ExpressionsImmuneSystem(exact_values=values,
-            variables=variables,
-            exchanger=exchanger,
-            config=config)
-        best = immuneSystem.solve()
-        results.append((f.expression_value(best), str(best)))
-        update_progress(int((i+1) / iterations * 100))
-    end = time.clock()
-    print('\n{0} seconds'.format(end - start))
-    for result in sorted(results):
-        print(result, sep='\n')
\ No newline at end of file
+    iterations = args.restarts
+    report = run_restarts(variables, values, config, iterations, processes=args.processes,
+                          progress=lambda i: update_progress(int(i / iterations * 100)))
+    print('\n{0} seconds, speed-up {1:.2f}'.format(report['wall_time'], report['speedup']))
+    print('per restart: ' + ', '.join('{0:.2f}s'.format(t) for t in report['timings']))
+    for result in report['results']:
+        print(result, sep='\n')
@@ -1,30 +1,72 @@
 __author__ = 'Stanislav Ushakov'
 
-from immune import ExpressionsImmuneSystem, DataFileStorageHelper, ExpressionsImmuneSystemConfig
-from exchanger import PeerToPeerExchanger, LocalhostNodesManager
-import sys
+from immune import (ExpressionsImmuneSystem, DataFileStorageHelper, ExpressionsImmuneSystemConfig,
+                    FitnessFunction)
+from exchanger import PeerToPeerExchanger, LocalhostNodesManager, RosterNodesManager
+import argparse
+import json
+import os
+import time
 
 #start as "python node_main.py node_num number_of_nodes"
+#or "python node_main.py node_name_or_num --roster roster.json" (see RosterNodesManager)
 if __name__ == '__main__':
-    number = int(sys.argv[1])
-    number_of_nodes = int(sys.argv[2])
+    parser = argparse.ArgumentParser(description='Runs single node of the distributed immune system.')
+    parser.add_argument('node', help='number of this node (1-based) or its name in the roster')
+    parser.add_argument('number_of_nodes', type=int, nargs='?',
+                        help='number of nodes running on localhost')
+    parser.add_argument('--roster', help='json file with addresses of all nodes')
+    parser.add_argument('--checkpoint', help='file to save state of the node to')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from the checkpoint file if it exists')
+    parser.add_argument('--data', default='test_x_y.txt', help='file with the function values')
+    parser.add_argument('--warm-start',
+                        help='file with expressions (one per line) to include in the first generation')
+    parser.add_argument('--json', action='store_true',
+                        help='print result as json line with timing')
+    args = parser.parse_args()
+    if args.roster is None and args.number_of_nodes is None:
+        parser.error('number_of_nodes is required without --roster')
+    start = time.perf_counter()
 
-    nodes_manager = LocalhostNodesManager(number, number_of_nodes)
+    if args.roster is not None:
+        nodes_manager = RosterNodesManager(args.roster, args.node)
+    else:
+        nodes_manager = LocalhostNodesManager(int(args.node), args.number_of_nodes)
 
+    #values are read from config.json, see autotune.py
     config = ExpressionsImmuneSystemConfig()
-    config.number_of_lymphocytes = 200
-    config.number_of_iterations = 200
-    config.number_of_iterations_to_exchange = 30
-    config.maximal_height = 5
 
-    variables, values = DataFileStorageHelper.load_from_file('test_x_y.txt')
+    variables, columns, targets = DataFileStorageHelper.load_columns(args.data)
 
-    exchanger = PeerToPeerExchanger(nodes_manager)
+    exchanger = PeerToPeerExchanger(nodes_manager, mode=config.exchange_mode,
+                                    timeout=config.exchange_timeout,
+                                    delta=config.exchange_delta)
 
-    results = []
-    immuneSystem = ExpressionsImmuneSystem(exact_values=values,
+    initial_expressions = None
+    if args.warm_start is not None:
+        with open(args.warm_start) as input:
+            initial_expressions = [line.strip() for line in input if line.strip()]
+
+    immuneSystem = ExpressionsImmuneSystem(exact_values=None,
             variables=variables,
             exchanger=exchanger,
-            config=config)
-    best = immuneSystem.solve()
-    print(best)
\ No newline at end of file
+            config=config,
+            fitness_function=FitnessFunction.from_columns(columns, targets),
+            initial_expressions=initial_expressions)
+    if args.resume and args.checkpoint is not None and os.path.exists(args.checkpoint):
+        immuneSystem.restore_state(args.checkpoint)
+    start_generation = immuneSystem.start_generation
+    best, hall_of_fame = immuneSystem.solve(checkpoint=args.checkpoint, with_hall_of_fame=True)
+    if args.json:
+        print(json.dumps({'node': args.node,
+                          'best': str(best),
+                          'fitness': immuneSystem.fitness_function.full_value(best),
+                          'start_generation': start_generation,
+                          'generations': immuneSystem.generation + 1 - start_generation,
+                          'time': time.perf_counter() - start,
+                          'exchanges': immuneSystem.exchange_schedule.exchanges,
+                          'exchange_time': immuneSystem.exchange_schedule.time,
+                          'hall_of_fame': hall_of_fame.to_list()}))
+    else:
+        print(best)
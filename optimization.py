@@ -0,0 +1,96 @@
+__author__ = 'Stanislav Ushakov'
+
+import numpy
+
+from expression import Expression
+
+class ConstantsOptimizer:
+    """
+    Local search over all numbers of the expression.
+    Uses Levenberg-Marquardt method with the Jacobian calculated by finite
+    differences. Every evaluation of the expression is vectorized over
+    all points of the data set, so one iteration costs
+    (number of constants + 1) vectorized evaluations.
+    """
+    def __init__(self, fitness_function, iterations=5, step=1e-6,
+                 initial_damping=1e-3):
+        """
+        Initializes optimizer with the fitness function that provides
+        residuals of the expression, maximal number of iterations,
+        relative step for the finite differences and initial damping factor.
+        """
+        self.fitness_function = fitness_function
+        self.iterations = iterations
+        self.step = step
+        self.initial_damping = initial_damping
+
+    def optimize(self, expression:Expression):
+        """
+        Changes numbers of the given expression in place and returns new
+        value of the fitness function. Expression is changed only if its
+        fitness is improved.
+        """
+        nodes = expression.get_number_nodes()
+        parameters = numpy.array([node.value for node in nodes], dtype=float)
+        residuals = self._residuals(expression, nodes, parameters)
+        cost = numpy.dot(residuals, residuals)
+        if not nodes or not numpy.isfinite(cost):
+            return self.fitness_function.norm(residuals)
+
+        damping = self.initial_damping
+        for i in range(0, self.iterations):
+            jacobian = self._jacobian(expression, nodes, parameters, residuals)
+            if not numpy.all(numpy.isfinite(jacobian)):
+                break
+            a = jacobian.T @ jacobian
+            g = jacobian.T @ residuals
+            improved = False
+            #increase damping until step decreases the cost
+            while damping < 1e10:
+                try:
+                    delta = numpy.linalg.solve(
+                        a + damping * numpy.diag(numpy.diag(a) + 1e-12), -g)
+                except numpy.linalg.LinAlgError:
+                    damping *= 10
+                    continue
+                new_parameters = parameters + delta
+                new_residuals = self._residuals(expression, nodes, new_parameters)
+                new_cost = numpy.dot(new_residuals, new_residuals)
+                if numpy.isfinite(new_cost) and new_cost < cost:
+                    parameters, residuals, cost = new_parameters, new_residuals, new_cost
+                    damping /= 10
+                    improved = True
+                    break
+                damping *= 10
+            if not improved:
+                break
+
+        self._set_parameters(nodes, parameters)
+        return self.fitness_function.norm(residuals)
+
+    def _jacobian(self, expression, nodes, parameters, residuals):
+        """
+        Returns Jacobian matrix (points x constants) calculated by forward
+        finite differences.
+        """
+        jacobian = numpy.empty((residuals.shape[0], len(nodes)))
+        for (j, p) in enumerate(parameters):
+            h = self.step * max(1.0, abs(p))
+            shifted = parameters.copy()
+            shifted[j] += h
+            jacobian[:, j] = (self._residuals(expression, nodes, shifted) - residuals) / h
+        self._set_parameters(nodes, parameters)
+        return jacobian
+
+    def _residuals(self, expression, nodes, parameters):
+        """
+        Sets parameters as values of the number nodes and returns residuals.
+        """
+        self._set_parameters(nodes, parameters)
+        with numpy.errstate(all='ignore'):
+            return numpy.broadcast_to(self.fitness_function.exact_residuals(expression),
+                                      self.fitness_function.active_targets.shape)
+
+    def _set_parameters(self, nodes, parameters):
+        for (node, p) in zip(nodes, parameters):
+            node.value = float(p)
@@ -0,0 +1,161 @@
+__author__ = 'Stanislav Ushakov'
+
+import multiprocessing
+import os
+import random
+import time
+from multiprocessing import shared_memory
+
+import numpy
+
+from expression import Expression
+from immune import ExpressionsImmuneSystem, ExpressionsImmuneSystemConfig, FitnessFunction
+from exchanger import SimpleRandomExchanger
+
+class SharedDataset:
+    """
+    Data set stored in the shared memory block, so worker processes
+    can read it without copying.
+    Values are stored as 2D float64 array: one row for each variable
+    and the last row for the exact function values, so every column
+    of the data set is a contiguous array.
+    """
+    def __init__(self, variables, columns, targets):
+        """
+        Creates shared memory block and copies data to it.
+        columns - dictionary {variable name: array of values},
+        targets - array of the exact function values.
+        """
+        self.variables = list(variables)
+        self.shape = (len(self.variables) + 1, len(targets))
+        self.memory = shared_memory.SharedMemory(create=True,
+                                                 size=max(1, 8 * self.shape[0] * self.shape[1]))
+        data = numpy.ndarray(self.shape, dtype=numpy.float64, buffer=self.memory.buf)
+        for (i, var) in enumerate(self.variables):
+            data[i] = columns[var]
+        data[-1] = targets
+
+    @classmethod
+    def from_exact_values(cls, variables, exact_values):
+        """
+        Creates data set from the values in the form
+        [({'x': 1}, 1), ...]
+        """
+        columns = {var: numpy.array([point[var] for (point, value) in exact_values])
+                   for var in variables}
+        targets = numpy.array([value for (point, value) in exact_values])
+        return cls(variables, columns, targets)
+
+    def descriptor(self):
+        """
+        Returns picklable description used by workers to attach the data set.
+        """
+        return self.memory.name, self.shape, self.variables
+
+    def close(self):
+        """
+        Releases shared memory block. Must be called by the owner process.
+        """
+        self.memory.close()
+        self.memory.unlink()
+
+def attach_dataset(descriptor):
+    """
+    Attaches to the shared data set by its descriptor.
+    Returns (memory, variables, columns, targets), where columns and
+    targets are read-only views of the shared memory.
+    """
+    name, shape, variables = descriptor
+    memory = shared_memory.SharedMemory(name=name)
+    data = numpy.ndarray(shape, dtype=numpy.float64, buffer=memory.buf)
+    data.flags.writeable = False
+    columns = {var: data[i] for (i, var) in enumerate(variables)}
+    return memory, variables, columns, data[-1]
+
+#data set of the worker process, initialized once per process
+_worker_state = {}
+
+def _init_worker(descriptor):
+    memory, variables, columns, targets = attach_dataset(descriptor)
+    _worker_state['memory'] = memory
+    _worker_state['variables'] = variables
+    _worker_state['fitness_function'] = FitnessFunction.from_columns(columns, targets)
+
+def _solve(seed, config_dict, accuracy, time_limit=None):
+    """
+    Runs single solve in the worker process.
+    Returns dictionary with fitness value and string of the found
+    expression, seed, number of generations and seconds.
+    """
+    start = time.perf_counter()
+    variables = _worker_state['variables']
+    fitness_function = _worker_state['fitness_function']
+    config = ExpressionsImmuneSystemConfig.from_dict(config_dict)
+    exchanger = SimpleRandomExchanger(
+        lambda: [Expression.generate_random(max_height=config.maximal_height, variables=variables)
+                 for i in range(0, config.number_of_lymphocytes // 2)])
+    system = ExpressionsImmuneSystem(exact_values=None, variables=variables,
+                                     exchanger=exchanger, config=config, seed=seed,
+                                     fitness_function=fitness_function)
+    best = system.solve(accuracy=accuracy, time_limit=time_limit)
+    return {'fitness': fitness_function.full_value(best),
+            'expression': str(best),
+            'seed': seed,
+            'generations': system.generation + 1,
+            'seconds': time.perf_counter() - start}
+
+def _indexed_solve(indexed):
+    (i, trial) = indexed
+    return i, _solve(*trial)
+
+def run_trials(dataset, trials, processes=None, progress=None):
+    """
+    Runs solves described by trials in the process pool.
+    dataset - SharedDataset, it isn't closed by this function.
+    trials - list of tuples (seed, config dictionary, accuracy, time limit).
+    progress - function called with the number of finished trials.
+    Returns list of results (see _solve) in the order of trials.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    results = [None] * len(trials)
+    indexed = list(enumerate(trials))
+    with multiprocessing.Pool(processes=max(1, min(processes, len(trials))),
+                              initializer=_init_worker,
+                              initargs=(dataset.descriptor(),)) as pool:
+        finished = 0
+        for (i, result) in pool.imap_unordered(_indexed_solve, indexed):
+            results[i] = result
+            finished += 1
+            if progress is not None:
+                progress(finished)
+    return results
+
+def run_restarts(variables, exact_values, config, restarts, processes=None, seeds=None,
+                 accuracy=0.001, progress=None):
+    """
+    Runs independent solves of the same problem in the process pool.
+    Data set is shared between processes through the shared memory.
+    processes - number of worker processes, by default number of CPUs.
+    seeds - seeds of the restarts, by default random.
+    progress - function called with the number of finished restarts.
+    Returns dictionary:
+    results - list of (fitness value, expression string, seed) sorted by fitness,
+    timings - list of seconds spent by each restart (in the order of seeds),
+    wall_time - total time, speedup - sum of timings divided by wall time.
+    """
+    if seeds is None:
+        seeds = [random.getrandbits(32) for i in range(0, restarts)]
+    start = time.perf_counter()
+    dataset = SharedDataset.from_exact_values(variables, exact_values)
+    try:
+        finished = run_trials(dataset, [(seed, config.to_dict(), accuracy, None) for seed in seeds],
+                              processes=processes, progress=progress)
+    finally:
+        dataset.close()
+    wall_time = time.perf_counter() - start
+    timings = [result['seconds'] for result in finished]
+    return {'results': sorted((r['fitness'], r['expression'], r['seed']) for r in finished),
+            'timings': timings,
+            'wall_time': wall_time,
+            'speedup': sum(timings) / wall_time if wall_time > 0 else 0.0}
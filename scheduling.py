@@ -0,0 +1,269 @@
+__author__ = 'Stanislav Ushakov'
+
+import math
+import random
+
+class MutationScheduler:
+    """
+    Chooses mutation operators with equal possibilities and collects
+    statistics for each operator: number of calls, number of improvements,
+    total relative improvement of the fitness function and time spent.
+    """
+    def __init__(self, operators):
+        """
+        Initializes scheduler with the list of operator names.
+        """
+        self.operators = list(operators)
+        self.calls = {name: 0 for name in self.operators}
+        self.improvements = {name: 0 for name in self.operators}
+        self.total_improvement = {name: 0.0 for name in self.operators}
+        self.time = {name: 0.0 for name in self.operators}
+
+    def choose(self):
+        """
+        Returns name of the operator to apply.
+        """
+        return random.choice(self.operators)
+
+    def update(self, name, parent_fitness, child_fitness, elapsed):
+        """
+        Stores result of the mutation: fitness function values of the
+        parent and the child and time spent (in seconds) for mutation and
+        evaluation of the child.
+        """
+        improvement = self._relative_improvement(parent_fitness, child_fitness)
+        self.calls[name] += 1
+        self.time[name] += elapsed
+        if improvement > 0:
+            self.improvements[name] += 1
+            self.total_improvement[name] += improvement
+        return improvement
+
+    def probabilities(self):
+        """
+        Returns dictionary {operator name: possibility to be chosen}.
+        """
+        return {name: 1 / len(self.operators) for name in self.operators}
+
+    def statistics(self):
+        """
+        Returns dictionary {operator name: dictionary of statistics}.
+        """
+        probabilities = self.probabilities()
+        return {name: {'calls': self.calls[name],
+                       'improvements': self.improvements[name],
+                       'total_improvement': self.total_improvement[name],
+                       'time': self.time[name],
+                       'improvement_per_second': (self.total_improvement[name] / self.time[name]
+                                                  if self.time[name] > 0 else 0.0),
+                       'probability': probabilities[name]}
+                for name in self.operators}
+
+    @staticmethod
+    def _relative_improvement(parent_fitness, child_fitness):
+        """
+        Returns relative decreasing of the fitness function, 0 if the child
+        isn't better than the parent.
+        """
+        if not child_fitness < parent_fitness:
+            return 0.0
+        if math.isinf(parent_fitness) or parent_fitness == 0:
+            return 1.0
+        return (parent_fitness - child_fitness) / parent_fitness
+
+class AdaptiveMutationScheduler(MutationScheduler):
+    """
+    Multi-armed bandit that shifts possibilities toward operators that
+    give more improvement per second (adaptive probability matching).
+    Reward of each operator is an exponential moving average of
+    relative improvement per second.
+    min_probability - every operator is chosen at least with this possibility.
+    decay - weight of the newest reward in the moving average.
+    """
+    def __init__(self, operators, min_probability=0.05, decay=0.1):
+        MutationScheduler.__init__(self, operators)
+        self.min_probability = min(min_probability, 1 / len(self.operators))
+        self.decay = decay
+        self.rewards = {name: 0.0 for name in self.operators}
+
+    def choose(self):
+        """
+        Returns name of the operator chosen according to current possibilities.
+        """
+        probabilities = self.probabilities()
+        return random.choices(self.operators,
+                              weights=[probabilities[name] for name in self.operators])[0]
+
+    def update(self, name, parent_fitness, child_fitness, elapsed):
+        """
+        Stores result of the mutation and updates reward of the operator.
+        """
+        improvement = MutationScheduler.update(self, name, parent_fitness,
+                                               child_fitness, elapsed)
+        rate = improvement / elapsed if elapsed > 0 else 0.0
+        self.rewards[name] += self.decay * (rate - self.rewards[name])
+        return improvement
+
+    def probabilities(self):
+        """
+        Returns dictionary {operator name: possibility to be chosen}.
+        """
+        total = sum(self.rewards.values())
+        if total <= 0:
+            return MutationScheduler.probabilities(self)
+        free = 1 - len(self.operators) * self.min_probability
+        return {name: self.min_probability + free * self.rewards[name] / total
+                for name in self.operators}
+
+def create_mutation_scheduler(config, operators):
+    """
+    Returns mutation scheduler described by the immune system config.
+    """
+    if config.mutation_scheduler == 'uniform':
+        return MutationScheduler(operators)
+    if config.mutation_scheduler == 'adaptive':
+        return AdaptiveMutationScheduler(operators)
+    raise ValueError('Unknown mutation scheduler: {0}'.format(config.mutation_scheduler))
+
+class SubsampleSchedule:
+    """
+    Defines size of the subset of points used for the fitness function.
+    Size starts from initial_size and is multiplied by growth every time
+    the best fitness value becomes improvement times less than it was when
+    the size was changed last time. Size never exceeds number_of_points.
+    """
+    def __init__(self, initial_size, number_of_points, growth=2.0, improvement=0.5):
+        self.size = min(initial_size, number_of_points)
+        self.number_of_points = number_of_points
+        self.growth = growth
+        self.improvement = improvement
+        self.reference_fitness = None
+
+    def next_size(self, best_fitness):
+        """
+        Returns size of the subset for the next generation.
+        best_fitness - the best value of the fitness function in the
+        current generation.
+        """
+        if math.isinf(best_fitness):
+            return self.size
+        if self.reference_fitness is None:
+            self.reference_fitness = best_fitness
+        while (self.size < self.number_of_points and
+               best_fitness <= self.reference_fitness * self.improvement):
+            self.size = min(max(self.size + 1, int(self.size * self.growth)),
+                            self.number_of_points)
+            self.reference_fitness *= self.improvement
+        return self.size
+
+class ExchangeSchedule:
+    """
+    Defines generations when the immune system exchanges lymphocytes with
+    the other nodes: every interval generations (except the first one).
+    Collects number of exchanges and time spent in them.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.exchanges = 0
+        self.time = 0.0
+        self.generations = []
+
+    def is_exchange(self, generation):
+        """
+        Returns True if the exchange should be done in the given generation.
+        """
+        return generation != 0 and generation % self.interval == 0
+
+    def update(self, generation, best_fitness):
+        """
+        Stores the best value of the fitness function in the generation.
+        """
+        pass
+
+    def record(self, generation, elapsed):
+        """
+        Stores the exchange done in the generation that took elapsed seconds.
+        """
+        self.exchanges += 1
+        self.time += elapsed
+        self.generations.append(generation)
+
+    def statistics(self):
+        """
+        Returns dictionary with number of exchanges, total time spent in
+        them and generations when they were done.
+        """
+        return {'exchanges': self.exchanges,
+                'time': self.time,
+                'mean_time': self.time / self.exchanges if self.exchanges > 0 else 0.0,
+                'generations': list(self.generations)}
+
+class StagnationExchangeSchedule(ExchangeSchedule):
+    """
+    Exchanges lymphocytes when the island stagnates: the best fitness value
+    improved less than tolerance (relatively) during the last window
+    generations. Exchange is never done earlier than min_interval and
+    never later than max_interval generations after the previous one.
+    While the island improves quickly, it doesn't pay for the exchange,
+    when it stalls - it doesn't wait for the fixed interval.
+    Nodes publish their lymphocytes only in their own exchanging steps,
+    so islands exchange in different generations. SYNC and BOUNDED
+    exchange modes wait for the batch of the same generation and would
+    mostly wait out the whole timeout, so this schedule is allowed only
+    with the ASYNC mode (see create_exchange_schedule).
+    """
+    def __init__(self, window=10, min_interval=10, max_interval=50, tolerance=1e-3):
+        ExchangeSchedule.__init__(self, max_interval)
+        self.window = window
+        self.min_interval = max(1, min_interval)
+        self.max_interval = max(self.min_interval, max_interval)
+        self.tolerance = tolerance
+        self.last_exchange = None
+        #best values since the last exchange, at most window + 1 of them
+        self.history = []
+
+    def is_exchange(self, generation):
+        if self.last_exchange is None:
+            self.last_exchange = generation
+        since = generation - self.last_exchange
+        if generation == 0 or since < self.min_interval:
+            return False
+        return since >= self.max_interval or self.is_stagnated()
+
+    def is_stagnated(self):
+        """
+        Returns True if the best value improved less than tolerance during
+        the last window generations.
+        """
+        if len(self.history) <= self.window:
+            return False
+        (old, new) = (self.history[0], self.history[-1])
+        if math.isinf(old):
+            return math.isinf(new)
+        return old - new <= self.tolerance * abs(old)
+
+    def update(self, generation, best_fitness):
+        self.history.append(best_fitness)
+        del self.history[:-(self.window + 1)]
+
+    def record(self, generation, elapsed):
+        ExchangeSchedule.record(self, generation, elapsed)
+        self.last_exchange = generation
+        #improvement is measured again with the received lymphocytes
+        self.history = []
+
+def create_exchange_schedule(config):
+    """
+    Returns exchange schedule described by the immune system config.
+    Stagnation schedule requires the async exchange mode.
+    """
+    if config.exchange_schedule == 'fixed':
+        return ExchangeSchedule(config.number_of_iterations_to_exchange)
+    if config.exchange_schedule == 'stagnation':
+        if config.exchange_mode != 'async':
+            raise ValueError('Stagnation exchange schedule requires async exchange mode, '
+                             'not {0}'.format(config.exchange_mode))
+        return StagnationExchangeSchedule(window=config.exchange_window,
+                                          min_interval=config.exchange_min_interval,
+                                          max_interval=config.exchange_max_interval)
+    raise ValueError('Unknown exchange schedule: {0}'.format(config.exchange_schedule))
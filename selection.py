@@ -0,0 +1,110 @@
+__author__ = 'Stanislav Ushakov'
+
+import heapq
+import random
+
+import numpy
+
+#heap is used only if k * ratio <= n
+_heap_selection_ratio = 8
+#shorter sequences are selected as lists, numpy overhead is bigger for them
+_numpy_selection_size = 256
+
+def best_indices(fitness_values, k):
+    """
+    Returns indices of the k smallest fitness values in ascending order
+    of fitness, equal values are in the order of indices.
+    fitness_values - list or numpy array.
+    For small k uses partial selection (heap of size k), so the cost is
+    O(n log k) instead of O(n log n) for the full sort. For big k (e.g.
+    the half of the population) or numpy array numpy.argpartition finds
+    the k smallest values in O(n) and only they are sorted. Short
+    sequences are handled as lists, numpy overhead is bigger for them.
+    """
+    n = len(fitness_values)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    if k == 1:
+        return [best_index(fitness_values)]
+    is_array = isinstance(fitness_values, numpy.ndarray)
+    if n >= _numpy_selection_size and (is_array or k * _heap_selection_ratio > n):
+        values = numpy.asarray(fitness_values, dtype=numpy.float64)
+        if k < n:
+            #all values equal to the k-th one are candidates, so ties are
+            #resolved by index exactly as by the stable sort
+            kth = values[numpy.argpartition(values, k - 1)[k - 1]]
+            part = numpy.flatnonzero(values <= kth)
+        else:
+            part = numpy.arange(n)
+        #sorted by value, then by index
+        return part[numpy.lexsort((part, values[part]))][:k].tolist()
+    if is_array:
+        fitness_values = fitness_values.tolist()
+    if k * _heap_selection_ratio <= n:
+        return heapq.nsmallest(k, range(n), key=fitness_values.__getitem__)
+    return sorted(range(n), key=fitness_values.__getitem__)[:k]
+
+def best_index(fitness_values):
+    """
+    Returns index of the smallest fitness value. Simple O(n) scan.
+    """
+    if isinstance(fitness_values, numpy.ndarray):
+        return int(numpy.argmin(fitness_values))
+    return min(range(len(fitness_values)), key=fitness_values.__getitem__)
+
+class TruncationSelection:
+    """
+    Selects the k best lymphocytes. This is the original behaviour of
+    the immune system: the best half survives.
+    """
+    def select(self, fitness_values, k):
+        """
+        Returns indices of the selected lymphocytes, the best first.
+        """
+        return best_indices(fitness_values, k)
+
+class TournamentSelection:
+    """
+    Selects lymphocytes by running k tournaments between randomly chosen
+    lymphocytes (participants are chosen with replacement). Every winner is
+    removed from the pool, so one lymphocyte can't be selected twice.
+    tournament_size - number of participants of the single tournament.
+    elitism - number of the best lymphocytes that always survive.
+    """
+    def __init__(self, tournament_size=3, elitism=1):
+        self.tournament_size = tournament_size
+        self.elitism = elitism
+
+    def select(self, fitness_values, k):
+        """
+        Returns indices of the selected lymphocytes. Elite lymphocytes go first.
+        """
+        if isinstance(fitness_values, numpy.ndarray):
+            #single items of the list are accessed much faster
+            fitness_values = fitness_values.tolist()
+        k = min(k, len(fitness_values))
+        selected = best_indices(fitness_values, min(self.elitism, k))
+        elite = set(selected)
+        pool = [i for i in range(len(fitness_values)) if i not in elite]
+        while len(selected) < k:
+            winner = random.randrange(len(pool))
+            for t in range(1, self.tournament_size):
+                p = random.randrange(len(pool))
+                if fitness_values[pool[p]] < fitness_values[pool[winner]]:
+                    winner = p
+            selected.append(pool[winner])
+            #remove winner from the pool in O(1)
+            pool[winner] = pool[-1]
+            pool.pop()
+        return selected
+
+def create_selection(config):
+    """
+    Returns selection strategy object described by the immune system config.
+    """
+    if config.selection == 'truncation':
+        return TruncationSelection()
+    if config.selection == 'tournament':
+        return TournamentSelection(tournament_size=config.tournament_size)
+    raise ValueError('Unknown selection strategy: {0}'.format(config.selection))
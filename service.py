@@ -0,0 +1,334 @@
+__author__ = 'Stanislav Ushakov'
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from expression import Expression
+from immune import (ExpressionsImmuneSystem, ExpressionsImmuneSystemConfig,
+                    DataFileStorageHelper, FitnessFunction)
+from exchanger import SimpleRandomExchanger
+from telemetry import Telemetry
+
+#start as "python service.py [--port 8765] [--workers N] [--cache-dir .cache]"
+#POST /jobs with json {"dataset": "<content of the data file>", "config": {...}}
+#GET /jobs/<id> - status and result, GET /jobs/<id>/progress - json lines stream
+
+class ResultCache:
+    """
+    On-disk cache of the job results. Key is the hash of the data set
+    content and the config, result is stored as json file.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(dataset, config):
+        """
+        Returns content hash of the data set string and config dictionary.
+        """
+        digest = hashlib.sha256(dataset.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(json.dumps(config, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Returns stored result or None.
+        """
+        try:
+            with open(self._filename(key)) as input:
+                return json.load(input)
+        except (IOError, ValueError):
+            return None
+
+    def put(self, key, result):
+        """
+        Stores result. File is written atomically, so concurrent readers
+        never see the partial result.
+        """
+        filename = self._filename(key)
+        temporary = '{0}.{1}.tmp'.format(filename, uuid.uuid4().hex)
+        with open(temporary, 'w') as output:
+            json.dump(result, output)
+        os.replace(temporary, filename)
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+class Job:
+    """
+    Single regression job: state, progress records and result.
+    status - 'queued', 'running', 'done' or 'failed'.
+    """
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = 'queued'
+        self.progress = []
+        self.result = None
+        self.error = None
+        self.cached = False
+        self.condition = threading.Condition()
+
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+    def to_dict(self):
+        return {'id': self.id, 'status': self.status, 'cached': self.cached,
+                'generations': len(self.progress), 'result': self.result,
+                'error': self.error}
+
+def _run_job(job_id, dataset, config_dict, seed, progress_queue):
+    """
+    Solves the job in the worker process. Start of the job and progress
+    of each generation are put to the queue as (job id, record).
+    """
+    start = time.perf_counter()
+    #record None means that the worker has started the job
+    progress_queue.put((job_id, None))
+    variables, columns, targets = DataFileStorageHelper.load_columns_from_string(dataset)
+    config = ExpressionsImmuneSystemConfig.from_dict(config_dict)
+    exchanger = SimpleRandomExchanger(
+        lambda: [Expression.generate_random(max_height=config.maximal_height, variables=variables)
+                 for i in range(0, config.number_of_lymphocytes // 2)])
+    def sink(record):
+        if 'generation' in record:
+            progress_queue.put((job_id, {'generation': record['generation'],
+                                         'best_fitness': record['best_fitness']}))
+    system = ExpressionsImmuneSystem(None, variables, exchanger, config, seed=seed,
+                                     telemetry=Telemetry(sinks=[sink]),
+                                     fitness_function=FitnessFunction.from_columns(columns,
+                                                                                   targets))
+    best = system.solve()
+    return {'expression': str(best),
+            'fitness': system.fitness_function.full_value(best),
+            'variables': variables,
+            'time': time.perf_counter() - start}
+
+class JobService:
+    """
+    Schedules regression jobs on the pool of worker processes.
+    Identical jobs (the same data set and config) are answered from the
+    result cache or attached to the job that is already running.
+    Only finished_capacity finished jobs are kept, the oldest ones are
+    forgotten (their results stay in the cache).
+    """
+    def __init__(self, workers=None, cache_directory='.cache', finished_capacity=1000):
+        self.cache = ResultCache(cache_directory)
+        self.finished_capacity = finished_capacity
+        #ids of the finished jobs in the order of finishing
+        self.finished_jobs = {}
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.manager = multiprocessing.Manager()
+        self.progress_queue = self.manager.Queue()
+        self.jobs = {}
+        self.running_by_key = {}
+        self.lock = threading.Lock()
+        self.progress_thread = threading.Thread(target=self._collect_progress, daemon=True)
+        self.progress_thread.start()
+
+    def submit(self, dataset, config=None, seed=None):
+        """
+        Submits job: dataset - content of the data file, config - dictionary
+        of the config values (missing values are set to defaults).
+        Returns Job object.
+        """
+        config = ExpressionsImmuneSystemConfig.from_dict(config or {}).to_dict()
+        key = ResultCache.key(dataset, dict(config, seed=seed))
+        with self.lock:
+            if key in self.running_by_key:
+                return self.running_by_key[key]
+            job = Job(key)
+            self.jobs[job.id] = job
+            cached = self.cache.get(key)
+            if cached is not None:
+                job.result = cached
+                job.cached = True
+                job.status = 'done'
+                self._forget_finished(job)
+                return job
+            self.running_by_key[key] = job
+        #job is marked running when the worker starts it, see _collect_progress
+        future = self.executor.submit(_run_job, job.id, dataset, config, seed,
+                                      self.progress_queue)
+        future.add_done_callback(lambda f: self._finish(job, f))
+        return job
+
+    def get(self, job_id):
+        """
+        Returns job by id or None.
+        """
+        return self.jobs.get(job_id)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.progress_queue.put(None)
+        self.progress_thread.join()
+        self.manager.shutdown()
+
+    def _finish(self, job, future):
+        try:
+            result = future.result()
+            self.cache.put(job.key, result)
+        except Exception as e:
+            result = None
+            error = repr(e)
+        with self.lock:
+            self.running_by_key.pop(job.key, None)
+            self._forget_finished(job)
+        with job.condition:
+            if result is not None:
+                job.result = result
+                job.status = 'done'
+            else:
+                job.error = error
+                job.status = 'failed'
+            job.condition.notify_all()
+
+    def _forget_finished(self, job):
+        """
+        Registers finished job and removes the oldest finished jobs if
+        there are more than finished_capacity. Called under the lock.
+        """
+        self.finished_jobs[job.id] = None
+        while len(self.finished_jobs) > self.finished_capacity:
+            oldest = next(iter(self.finished_jobs))
+            del self.finished_jobs[oldest]
+            self.jobs.pop(oldest, None)
+
+    def _collect_progress(self):
+        while True:
+            item = self.progress_queue.get()
+            if item is None:
+                break
+            (job_id, record) = item
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            with job.condition:
+                if job.status == 'queued':
+                    job.status = 'running'
+                if record is not None:
+                    job.progress.append(record)
+                job.condition.notify_all()
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of the job service.
+    """
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            return self._send_json(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+        except ValueError:
+            return self._send_json(400, {'error': 'expected json with dataset'})
+        error = self._validate(request)
+        if error is not None:
+            return self._send_json(400, {'error': error})
+        job = self.server.service.submit(request['dataset'], request.get('config'),
+                                         request.get('seed'))
+        self._send_json(202, job.to_dict())
+
+    @staticmethod
+    def _validate(request):
+        """
+        Returns description of the error in the job request or None.
+        """
+        if not isinstance(request, dict):
+            return 'expected json object with dataset'
+        if not isinstance(request.get('dataset'), str):
+            return 'dataset must be a string with content of the data file'
+        if not isinstance(request.get('config'), (dict, type(None))):
+            return 'config must be an object'
+        seed = request.get('seed')
+        if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool)):
+            return 'seed must be an integer'
+        return None
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) < 2 or parts[0] != 'jobs':
+            return self._send_json(404, {'error': 'not found'})
+        job = self.server.service.get(parts[1])
+        if job is None:
+            return self._send_json(404, {'error': 'unknown job'})
+        if len(parts) == 2:
+            return self._send_json(200, job.to_dict())
+        if parts[2] == 'progress':
+            return self._stream_progress(job)
+        self._send_json(404, {'error': 'not found'})
+
+    def _stream_progress(self, job):
+        """
+        Sends progress records as json lines while the job is running,
+        the last line is the final state of the job.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        sent = 0
+        while True:
+            with job.condition:
+                while sent == len(job.progress) and not job.is_finished():
+                    job.condition.wait()
+                records = job.progress[sent:]
+                finished = job.is_finished()
+            for record in records:
+                self.wfile.write((json.dumps(record) + '\n').encode('utf-8'))
+            sent += len(records)
+            self.wfile.flush()
+            if finished:
+                break
+        self.wfile.write((json.dumps(job.to_dict()) + '\n').encode('utf-8'))
+        self.close_connection = True
+
+    def _send_json(self, code, value):
+        body = json.dumps(value).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def create_server(service, host='localhost', port=8765):
+    """
+    Returns HTTP server for the service, call serve_forever to start it.
+    """
+    server = ThreadingHTTPServer((host, port), JobRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local symbolic regression job service.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache-dir', default='.cache')
+    args = parser.parse_args()
+
+    service = JobService(workers=args.workers, cache_directory=args.cache_dir)
+    server = create_server(service, args.host, args.port)
+    print('Serving on {0}:{1}'.format(args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
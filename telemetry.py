@@ -0,0 +1,195 @@
+__author__ = 'Stanislav Ushakov'
+
+import cProfile
+import io
+import json
+import pstats
+import time
+import tracemalloc
+
+class _Phase:
+    """
+    Context manager that adds time spent inside it to the phase of
+    the current generation.
+    """
+    def __init__(self, telemetry, name):
+        self.telemetry = telemetry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.telemetry.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+class _NullPhase:
+    """
+    Context manager that does nothing.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_null_phase = _NullPhase()
+
+class NullTelemetry:
+    """
+    Telemetry that collects nothing. Used when instrumentation is
+    turned off, all methods are no-ops.
+    """
+    enabled = False
+
+    def phase(self, name):
+        return _null_phase
+
+    def add_time(self, name, seconds):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def end_generation(self, generation, **values):
+        pass
+
+    def start_capture(self):
+        pass
+
+    def stop_capture(self):
+        pass
+
+class Telemetry:
+    """
+    Collects generation-level telemetry of the immune system:
+    time of each phase (mutation, evaluation, selection, exchange, ...)
+    and counters (evaluated nodes, copied trees, exchange bytes).
+    At the end of each generation the record is passed to all sinks.
+    Sink is any callable taking dictionary, e.g. JsonLinesSink.
+    profile - if True, the whole solve is profiled with cProfile.
+    trace_memory - if True, memory allocations are traced with tracemalloc.
+    """
+    enabled = True
+
+    def __init__(self, sinks=None, profile=False, trace_memory=False):
+        self.sinks = list(sinks) if sinks is not None else []
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.profiler = None
+        self.memory_peak = None
+        self.total_phases = {}
+        self.total_counters = {}
+        self.capturing = False
+        self._reset()
+
+    def phase(self, name):
+        """
+        Returns context manager measuring time of the phase, e.g.
+        with telemetry.phase('mutation'): ...
+        """
+        return _Phase(self, name)
+
+    def add_time(self, name, seconds):
+        """
+        Adds time (in seconds) to the phase of the current generation.
+        """
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        """
+        Increases counter of the current generation.
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def end_generation(self, generation, **values):
+        """
+        Finishes record of the current generation and passes it to sinks.
+        values - any additional values to store, e.g. best fitness.
+        """
+        record = {'generation': generation,
+                  'time': time.perf_counter() - self.generation_start,
+                  'phases': self.phases,
+                  'counters': self.counters}
+        record.update(values)
+        if self.trace_memory and tracemalloc.is_tracing():
+            record['memory'], record['memory_peak'] = tracemalloc.get_traced_memory()
+        self._accumulate()
+        self._emit(record)
+        self._reset()
+
+    def start_capture(self):
+        """
+        Starts profiling and memory tracing if they are turned on.
+        """
+        self.capturing = True
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self._reset()
+
+    def stop_capture(self):
+        """
+        Stops profiling and memory tracing and emits the summary record.
+        Phases measured after the last generation (e.g. simplification)
+        are included only in the summary. Does nothing if the capture
+        is already stopped, so it may be called again after failure.
+        """
+        if not self.capturing:
+            return
+        self.capturing = False
+        self._accumulate()
+        self._reset()
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.trace_memory and tracemalloc.is_tracing():
+            self.memory_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        summary = {'summary': True,
+                   'phases': self.total_phases,
+                   'counters': self.total_counters}
+        if self.memory_peak is not None:
+            summary['memory_peak'] = self.memory_peak
+        self._emit(summary)
+
+    def profile_report(self, limit=20, sort='cumulative'):
+        """
+        Returns text report of the cProfile capture.
+        """
+        if self.profiler is None:
+            return ''
+        output = io.StringIO()
+        pstats.Stats(self.profiler, stream=output).sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+    def _accumulate(self):
+        for (name, seconds) in self.phases.items():
+            self.total_phases[name] = self.total_phases.get(name, 0.0) + seconds
+        for (name, value) in self.counters.items():
+            self.total_counters[name] = self.total_counters.get(name, 0) + value
+
+    def _emit(self, record):
+        for sink in self.sinks:
+            sink(record)
+
+    def _reset(self):
+        self.phases = {}
+        self.counters = {}
+        self.generation_start = time.perf_counter()
+
+class JsonLinesSink:
+    """
+    Sink that writes every telemetry record as a json line to the file.
+    """
+    def __init__(self, filename):
+        self.file = open(filename, 'a')
+
+    def __call__(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -2,10 +2,42 @@ __author__ = 'Stanislav Ushakov'
 
 import unittest
 import pickle
+import weakref
+import math
+import os
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
 
-from expression import Expression, NotSupportedOperationError, Operations, Node
-from immune import FitnessFunction, ExpressionMutator, ExpressionsImmuneSystem, ExpressionsImmuneSystemConfig
-from exchanger import SimpleRandomExchanger, LocalhostNodesManager
+import numpy
+
+from expression import (Expression, NotSupportedOperationError, ExpressionSyntaxError,
+                        Operations, Operation, Node, NodePool)
+from immune import (FitnessFunction, ExpressionMutator, ExpressionsImmuneSystem,
+                    ExpressionsImmuneSystemConfig, DataFileStorageHelper, DataFormatError,
+                    MultiTargetFitnessFunction, MultiTargetImmuneSystem)
+from exchanger import (SimpleRandomExchanger, LocalhostNodesManager, RosterNodesManager,
+                       ServerThread, GetterThread, PeerToPeerExchanger, RingExchanger)
+from selection import best_indices, best_index, TournamentSelection
+from optimization import ConstantsOptimizer
+from archive import HallOfFame
+from telemetry import Telemetry, JsonLinesSink
+from runner import run_restarts, SharedDataset, attach_dataset
+from autotune import grid_candidates, score, tune, successive_halving
+from service import JobService, ResultCache, create_server
+from local_server import NodeSupervisor
+from export import export_source, export_predictor, save
+from benchmarks.problems import PROBLEMS
+from benchmarks.run import compare
+from scheduling import (MutationScheduler, AdaptiveMutationScheduler, SubsampleSchedule,
+                        ExchangeSchedule, StagnationExchangeSchedule,
+                        create_exchange_schedule)
 
 class OperationTest(unittest.TestCase):
     def test_pickle_number(self):
@@ -28,6 +60,35 @@ class OperationTest(unittest.TestCase):
         returned_operation = pickle.loads(pickle.dumps(operation))
         self._test_for_equality(operation, returned_operation)
 
+    def test_pickle_returns_registered_operation(self):
+        for operation in Operations.get_all_operations():
+            self.assertIs(pickle.loads(pickle.dumps(operation)), operation)
+
+    def test_registry(self):
+        self.assertIs(Operations.get_operation(Operations.DIVISION.opcode), Operations.DIVISION)
+        self.assertIs(Operations.get_operation_by_name('cos'), Operations.COS)
+        self.assertRaises(NotSupportedOperationError, Operations.get_operation, 1000)
+        self.assertRaises(ValueError, Operations.register,
+                          Operation(Operations.PLUS.opcode, Operations._binary_operation,
+                                    action=(lambda x, y: x)))
+        self.assertNotIn(Operations.SQRT, Operations.get_unary_operations())
+
+    def test_protected_operations(self):
+        points = [-2.0, 0.0, 3.0]
+        for operation in [Operations.DIVISION, Operations.POWER]:
+            vector = operation.vector_action(numpy.array(points), numpy.array([0.0, -1.0, 2.0]))
+            scalar = [operation.action(x, y) for (x, y) in zip(points, [0.0, -1.0, 2.0])]
+            for (v, s) in zip(vector, scalar):
+                self.assertAlmostEqual(v, s)
+        for operation in [Operations.EXP, Operations.LOG, Operations.SQRT]:
+            vector = operation.vector_action(numpy.array(points))
+            for (v, x) in zip(vector, points):
+                self.assertAlmostEqual(v, operation.action(x))
+        #integer constants come from rounding in number mutation
+        node = Node(Operations.POWER, left=Node(Operations.NUMBER, value=2),
+                    right=Node(Operations.NUMBER, value=-2))
+        self.assertEqual(node.value_in_columns({'x': numpy.zeros(3)}), 0.25)
+
     def _test_for_equality(self, op1, op2):
         self.assertEqual(op1._operation_type, op2._operation_type)
         self.assertEqual(op1.action, op2.action)
@@ -61,6 +122,23 @@ class ExpressionNodeTest(unittest.TestCase):
         self.assertEqual(node.right, None)
         self.assertEqual(node.value, 0.0)
 
+    def test_simplify_infinite_number(self):
+        node = Node(Operations.POWER,
+            left=Node(Operations.NUMBER, value=1e200),
+            right=Node(Operations.NUMBER, value=3))
+        self.assertEqual(node.simplify(), True)
+        node.simplify()
+        self.assertEqual(node.value, math.inf)
+
+    def test_simplify_huge_numbers(self):
+        for text in ['sin((800.0 * 1e308))', 'cos(((0.0 - 1e308) * 10.0))',
+                     '(x + 1e306)', '((1.0 / sin((-65.0 ^ exp(52.27)))) + x)']:
+            e = Expression.parse(text, ['x'])
+            e.simplify()
+            e.value_in_point({'x': 1.0})
+        self.assertTrue(math.isnan(Expression.parse('sin((800.0 * 1e308))', ['x'])
+                                   .value_in_point({})))
+
     def test_simplify_unary_and_number(self):
         node = Node(Operations.SIN,
             left=Node(Operations.NUMBER, value=0))
@@ -117,6 +195,22 @@ class ExpressionNodeTest(unittest.TestCase):
         self.assertEqual(node.right.value, returned_node.right.value)
 
 class ExpressionTest(unittest.TestCase):
+    def test_interval(self):
+        x = Node(Operations.IDENTITY, value='x')
+        ranges = {'x': (-2.0, 3.0)}
+        self.assertEqual(Node(Operations.MULTIPLICATION, left=x, right=x).interval(ranges),
+                         (-6.0, 9.0))
+        self.assertEqual(Node(Operations.MINUS, left=x, right=Node(Operations.NUMBER, value=1)
+                              ).interval(ranges), (-3.0, 2.0))
+        self.assertEqual(Node(Operations.COS, left=x).interval(ranges), (-1.0, 1.0))
+        self.assertEqual(Node(Operations.DIVISION, left=Node(Operations.NUMBER, value=1), right=x
+                              ).interval(ranges), (-math.inf, math.inf))
+        self.assertEqual(Node(Operations.DIVISION, left=x, right=Node(Operations.NUMBER, value=2)
+                              ).interval(ranges), (-1.0, 1.5))
+        self.assertEqual(Node(Operations.SQRT, left=x).interval(ranges), (0.0, math.sqrt(3.0)))
+        self.assertEqual(Node(Operations.LOG, left=x).interval(ranges)[0], -math.inf)
+
+
     def test_pickle_expression(self):
         node = Node(Operations.PLUS,
             Node(Operations.MULTIPLICATION,
@@ -138,6 +232,31 @@ class ExpressionTest(unittest.TestCase):
         self.assertEqual(e.root.right.operation.action, returned_expression.root.right.operation.action)
         self.assertEqual(e.root.right.value, returned_expression.root.right.value)
 
+    def test_parse_round_trip(self):
+        for i in range(0, 100):
+            e = Expression.generate_random(max_height=4, variables=['x', 'y'])
+            parsed = Expression.parse(str(e), ['x', 'y'])
+            self.assertEqual(str(parsed), str(e))
+            self.assertEqual(parsed.value_in_point({'x': 0.5, 'y': 2.0}),
+                             e.value_in_point({'x': 0.5, 'y': 2.0}))
+        for text in ('(x + -1.5)', '(-inf * nan)', 'sin(cos((x / 1e-05)))', '(4 - x)'):
+            self.assertEqual(str(Expression.parse(text)), text)
+        self.assertEqual(Expression.parse('(x * (y + inf))').variables, ['x', 'y'])
+        self.assertIsInstance(Expression.parse('(x * 4)').root.right.value, int)
+
+    def test_parse_errors(self):
+        for text in ('', '(x + )', '(x + y', 'x y', 'sin(x + y)', '(x + None)'):
+            self.assertRaises(ExpressionSyntaxError, Expression.parse, text)
+        self.assertRaises(ExpressionSyntaxError, Expression.parse, '(x + z)', ['x'])
+        self.assertRaises(NotSupportedOperationError, Expression.parse, 'foo(x)')
+
+    def test_deep_tree(self):
+        node = Node(Operations.IDENTITY, value='x')
+        for i in range(0, 5000):
+            node = Node(Operations.PLUS, left=node, right=Node(Operations.NUMBER, value=1.0))
+        text = str(Expression(root=node, variables=['x']))
+        self.assertEqual(str(Expression.parse(text)), text)
+
 class FitnessFunctionTest(unittest.TestCase):
     def setUp(self):
         values = [({'x': i , 'y': j}, 4 * i + 2 * j)
@@ -167,6 +286,47 @@ class FitnessFunctionTest(unittest.TestCase):
         e = Expression(root=wrong, variables=['x', 'y'])
         self.assertGreater(self.f.expression_value(e), 0.0)
 
+    def test_subsample(self):
+        e = Expression(root=Node(Operations.IDENTITY, value='x'), variables=['x', 'y'])
+        full = self.f.expression_value(e)
+        for stratified in (False, True):
+            self.f.resample(10, stratified=stratified)
+            self.assertTrue(self.f.is_subsampled())
+            self.assertEqual(len(self.f.active_targets), 10)
+            self.assertEqual(len(set(self.f.sample)), 10)
+            self.assertEqual(self.f.full_value(e), full)
+        self.f.resample(1000)
+        self.assertFalse(self.f.is_subsampled())
+        self.assertEqual(self.f.expression_value(e), full)
+
+    def test_lower_bound(self):
+        for i in range(0, 100):
+            e = Expression.generate_random(max_height=4, variables=['x', 'y'])
+            self.assertLessEqual(self.f.lower_bound(e), self.f.expression_value(e) * (1 + 1e-9))
+        constant = Expression(root=Node(Operations.NUMBER, value=100.0), variables=['x', 'y'])
+        self.assertAlmostEqual(self.f.lower_bound(constant), self.f.expression_value(constant))
+        bounded = Expression(root=Node(Operations.SIN, left=Node(Operations.IDENTITY, value='x')),
+                             variables=['x', 'y'])
+        self.assertGreater(self.f.lower_bound(bounded), 0)
+        self.f.resample(10)
+        self.assertLessEqual(self.f.lower_bound(bounded), self.f.expression_value(bounded))
+
+    def test_float32_precision(self):
+        e = Expression(root=Node(Operations.SIN, left=Node(Operations.IDENTITY, value='x')),
+                       variables=['x', 'y'])
+        exact = self.f.expression_value(e)
+        memory = self.f.memory_usage()
+        self.f.set_precision('float32')
+        self.assertTrue(self.f.is_approximate())
+        self.assertEqual(self.f.memory_usage(), memory // 2)
+        self.assertEqual(self.f.evaluation_targets.dtype, numpy.float32)
+        self.assertAlmostEqual(self.f.expression_value(e), exact, places=3)
+        self.assertEqual(self.f.full_value(e), exact)
+        self.f.resample(10)
+        self.assertEqual(self.f.evaluation_columns['x'].dtype, numpy.float32)
+        self.assertEqual(self.f.exact_residuals(e).dtype, numpy.float64)
+        self.assertRaises(ValueError, self.f.set_precision, 'float16')
+
 
 class ExpressionMutatorTest(unittest.TestCase):
     def setUp(self):
@@ -187,6 +347,57 @@ class ExpressionMutatorTest(unittest.TestCase):
         mutated_value = mutator.expression.value_in_point(point)
         self.assertNotEqual(original_value, mutated_value)
 
+    def test_mutator_is_freed_without_collector(self):
+        mutator = ExpressionMutator(expression=self.f)
+        mutator.mutation()
+        reference = weakref.ref(mutator)
+        del mutator
+        self.assertIsNone(reference())
+
+class NodePoolTest(unittest.TestCase):
+    def setUp(self):
+        self.f = Expression.parse('(sin((x * 4)) + (y / 2.5))', ['x', 'y'])
+
+    def test_copy(self):
+        copied = self.f.copy()
+        self.assertEqual(str(copied), str(self.f))
+        copied.root.left.operation = Operations.COS
+        copied.root.right.right.value = 3
+        self.assertEqual(str(self.f), '(sin((x * 4)) + (y / 2.5))')
+
+    def test_reuse(self):
+        pool = NodePool()
+        copied = self.f.copy(pool)
+        self.assertEqual((pool.created, pool.reused), (8, 0))
+        pool.release(copied.root)
+        self.assertEqual(len(pool), 8)
+        self.assertEqual(str(self.f.copy(pool)), str(self.f))
+        self.assertEqual((pool.created, pool.reused, len(pool)), (8, 8, 0))
+
+    def test_capacity(self):
+        pool = NodePool(capacity=3)
+        pool.release(self.f.copy().root)
+        self.assertEqual(len(pool), 3)
+
+    def test_same_result_with_pool(self):
+        values = [({'x': x}, x * x + 1) for x in range(0, 10)]
+        results = []
+        for (pool_size, gc_tuning) in ((0, False), (1000, True)):
+            config = ExpressionsImmuneSystemConfig()
+            config.number_of_lymphocytes = 20
+            config.number_of_iterations = 15
+            config.node_pool_size = pool_size
+            config.gc_tuning = gc_tuning
+            exchanger = SimpleRandomExchanger(
+                lambda: [Expression.generate_random(max_height=3, variables=['x'])
+                         for i in range(0, 10)])
+            system = ExpressionsImmuneSystem(values, ['x'], exchanger, config, seed=3)
+            results.append((str(system.solve(accuracy=0.0)),
+                            [str(e) for e in system.hall_of_fame.expressions()]))
+            if pool_size > 0:
+                self.assertGreater(system.node_pool.reused, 0)
+        self.assertEqual(results[0], results[1])
+
 class LocalhostNodesManagerTest(unittest.TestCase):
     def test_self_address(self):
         manager = LocalhostNodesManager(1, 2)
@@ -198,6 +409,208 @@ class LocalhostNodesManagerTest(unittest.TestCase):
         self.assertEqual(manager.get_next_node_address()[0], 'localhost')
         self.assertNotEqual(manager.get_self_address()[1], manager.get_next_node_address()[1])
 
+def _free_ports(number):
+    """
+    Returns ports that are free now, sockets are bound at the same time,
+    so the ports are different.
+    """
+    sockets = [socket.socket() for i in range(0, number)]
+    try:
+        for s in sockets:
+            s.bind(('localhost', 0))
+        return [s.getsockname()[1] for s in sockets]
+    finally:
+        for s in sockets:
+            s.close()
+
+def _write_roster(nodes):
+    """
+    Writes roster with the given nodes to the temporary file, returns its name.
+    """
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as roster:
+        json.dump({'nodes': nodes}, roster)
+    return roster.name
+
+def _localhost_nodes(ports):
+    return [{'host': 'localhost', 'port': port} for port in ports]
+
+class RosterNodesManagerTest(unittest.TestCase):
+    def setUp(self):
+        nodes = _localhost_nodes(_free_ports(3))
+        for (node, name) in zip(nodes, ['a', 'b', 'c']):
+            node['name'] = name
+        nodes[2]['weight'] = 2
+        self.filename = _write_roster(nodes)
+        (self.a, self.b, self.c) = [('localhost', node['port']) for node in nodes]
+        self.now = 0.0
+        self.manager = RosterNodesManager(self.filename, 'a', max_failures=3,
+                                          clock=lambda: self.now)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_self_address(self):
+        self.assertEqual(self.manager.get_self_address(), self.a)
+        self.assertEqual(RosterNodesManager(self.filename, 2).get_self_address(), self.b)
+
+    def test_backoff_and_eviction(self):
+        (b, c) = (self.b, self.c)
+        self.manager.report_failure(b)
+        self.assertEqual(self.manager.get_next_node_address(), c)
+        self.now = 1.0
+        self.assertEqual(self.manager.get_next_node_address(), b)
+        self.manager.report_failure(b)
+        self.manager.report_failure(b)
+        self.now = 100.0
+        for i in range(0, 10):
+            self.assertEqual(self.manager.get_next_node_address(), c)
+        self.assertTrue(self.manager.statistics()[0]['evicted'])
+        #the only alive peer is backing off
+        self.manager.report_failure(c)
+        self.assertIsNone(self.manager.get_next_node_address())
+        self.now = 101.0
+        self.assertEqual(self.manager.get_next_node_address(), c)
+
+    def test_fastest_peer_is_preferred(self):
+        (b, c) = (self.b, self.c)
+        self.manager.report_success(b, 1.0)
+        self.manager.report_success(c, 0.001)
+        addresses = [self.manager.get_next_node_address() for i in range(0, 100)]
+        self.assertGreater(addresses.count(c), 90)
+
+    def test_exchange_with_local_ports(self):
+        (b, c) = (self.b, self.c)
+        server = ServerThread('localhost', b[1], lambda: pickle.dumps(['lymphocyte']))
+        server.daemon = True
+        server.start()
+        self.addCleanup(server.close)
+        received = []
+        for address in (b, c):
+            getter = None
+            for attempt in range(0, 50):
+                getter = GetterThread(address, lambda l, size: received.append(l),
+                                      on_success=self.manager.report_success,
+                                      on_failure=self.manager.report_failure)
+                getter.run()
+                if address == c or received:
+                    break
+                time.sleep(0.05)
+                self.now += 100
+        self.assertEqual(received, [['lymphocyte']])
+        statistics = {s['name']: s for s in self.manager.statistics()}
+        self.assertIsNotNone(statistics['b']['latency'])
+        self.assertEqual(statistics['c']['failures'], 1)
+
+class PeerToPeerExchangerTest(unittest.TestCase):
+    def setUp(self):
+        self.filename = None
+
+    def tearDown(self):
+        if self.filename is not None:
+            os.remove(self.filename)
+
+    def _exchangers(self, mode, delta=True):
+        self.filename = _write_roster(_localhost_nodes(_free_ports(2)))
+        other = PeerToPeerExchanger(RosterNodesManager(self.filename, 2))
+        self.addCleanup(other.close)
+        exchanger = PeerToPeerExchanger(RosterNodesManager(self.filename, 1),
+                                        mode=mode, timeout=0.5, delta=delta)
+        self.addCleanup(exchanger.close)
+        return exchanger, other
+
+    def test_sync_barrier(self):
+        exchanger, other = self._exchangers(PeerToPeerExchanger.SYNC)
+        other.set_lymphocytes_to_exchange(['a', 'b'], generation=3)
+        self.assertEqual(exchanger.get_lymphocytes(generation=3), ['a', 'b'])
+        statistics = exchanger.exchange_statistics[-1]
+        self.assertEqual(statistics['staleness'], 0)
+        self.assertTrue(statistics['fresh'])
+
+        #other node is behind - wait until timeout and return stale batch
+        exchanger.get_lymphocytes(generation=10)
+        statistics = exchanger.exchange_statistics[-1]
+        self.assertEqual(statistics['staleness'], 7)
+        self.assertGreaterEqual(statistics['wait_time'], 0.5)
+
+    def test_sync_silent_peer(self):
+        #peer accepts the connection but never answers
+        silent = socket.socket()
+        silent.bind(('localhost', 0))
+        silent.listen(1)
+        self.addCleanup(silent.close)
+        self.filename = _write_roster(_localhost_nodes(_free_ports(1) +
+                                                      [silent.getsockname()[1]]))
+        exchanger = PeerToPeerExchanger(RosterNodesManager(self.filename, 1),
+                                        mode=PeerToPeerExchanger.SYNC, timeout=0.3)
+        self.addCleanup(exchanger.close)
+        start = time.perf_counter()
+        self.assertEqual(exchanger.get_lymphocytes(generation=1), [])
+        self.assertLess(time.perf_counter() - start, 0.3 + 0.5)
+
+    def test_close(self):
+        server = ServerThread('localhost', 0, lambda: b'')
+        self.assertNotEqual(server.port, 0)
+        server.daemon = True
+        server.start()
+        server.close()
+        #the port is free again
+        with socket.socket() as s:
+            s.bind(('localhost', server.port))
+
+    def test_bounded_wait(self):
+        #the same batch is received twice, so all lymphocytes are requested
+        exchanger, other = self._exchangers(PeerToPeerExchanger.BOUNDED, delta=False)
+        other.set_lymphocytes_to_exchange(['a'], generation=1)
+        exchanger.get_lymphocytes(generation=1)
+        self.assertEqual(exchanger.get_lymphocytes(generation=2), ['a'])
+        self.assertEqual(exchanger.exchange_statistics[-1]['source_generation'], 1)
+        self.assertLess(exchanger.exchange_statistics[-1]['wait_time'], 0.5)
+
+    def test_snapshot_is_immutable(self):
+        exchanger, other = self._exchangers(PeerToPeerExchanger.SYNC)
+        lymphocytes = [Expression(root=Node(Operations.NUMBER, value=1), variables=['x'])]
+        other.set_lymphocytes_to_exchange(lymphocytes, generation=1)
+        snapshot = other._get_lymphocytes_to_exchange()
+        lymphocytes[0].root.value = 2
+        lymphocytes.append(lymphocytes[0])
+        self.assertIs(other._get_lymphocytes_to_exchange(), snapshot)
+        received = exchanger.get_lymphocytes(generation=1)
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0].root.value, 1)
+
+    def test_delta_exchange(self):
+        exchanger, other = self._exchangers(PeerToPeerExchanger.SYNC)
+        lymphocytes = [Expression.parse(text, ['x']) for text in ('(x + 1)', 'sin(x)', 'x')]
+        exchanger.set_lymphocytes_to_exchange(lymphocytes[2:], generation=1)
+        other.set_lymphocytes_to_exchange(lymphocytes[:2], generation=1)
+        received = exchanger.get_lymphocytes(generation=1)
+        self.assertEqual([str(e) for e in received], ['(x + 1)', 'sin(x)'])
+        #the first two are received already, the last one is in the own population
+        other.set_lymphocytes_to_exchange(lymphocytes, generation=2)
+        received = exchanger.get_lymphocytes(generation=2)
+        self.assertEqual(received, [])
+        self.assertEqual(exchanger.exchange_statistics[-1]['skipped'], 3)
+        other.set_lymphocytes_to_exchange([Expression.parse('cos(x)', ['x'])] + lymphocytes,
+                                          generation=3)
+        bytes_received = exchanger.bytes_received
+        received = exchanger.get_lymphocytes(generation=3)
+        self.assertEqual([str(e) for e in received], ['cos(x)'])
+        self.assertLess(exchanger.bytes_received - bytes_received,
+                        len(other._get_lymphocytes_to_exchange()))
+
+    def test_delta_sync_catching_up(self):
+        exchanger, other = self._exchangers(PeerToPeerExchanger.SYNC)
+        lymphocytes = [Expression.parse(text, ['x']) for text in ('(x + 1)', 'sin(x)', 'x')]
+        other.set_lymphocytes_to_exchange(lymphocytes, generation=0)
+        #stale batches received while waiting aren't returned, so they aren't known
+        timer = threading.Timer(0.1, other.set_lymphocytes_to_exchange, (lymphocytes, 5))
+        timer.start()
+        received = exchanger.get_lymphocytes(generation=5)
+        timer.join()
+        self.assertEqual(len(received), 3)
+        self.assertEqual(exchanger.exchange_statistics[-1]['source_generation'], 5)
+        self.assertEqual(exchanger.exchange_statistics[-1]['skipped'], 0)
+
 class ExpressionsImmuneSystemTest(unittest.TestCase):
     def test_solve_is_not_crashing(self):
         values = []
@@ -219,4 +632,726 @@ class ExpressionsImmuneSystemTest(unittest.TestCase):
                 exchanger=exchanger,
                 config=config)
         best = immuneSystem.solve()
-        self.assertGreaterEqual(f.expression_value(best), 0)
\ No newline at end of file
+        self.assertGreaterEqual(f.expression_value(best), 0)
+
+    def test_tournament_solve_is_not_crashing(self):
+        values = [({'x': x}, x * x) for x in range(0, 5)]
+        exchanger = SimpleRandomExchanger(
+            lambda: [Expression.generate_random(max_height=2, variables=['x'])
+                     for i in range(0, 5)])
+
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_lymphocytes = 10
+        config.number_of_iterations = 5
+        config.number_of_iterations_to_exchange = 2
+        config.selection = 'tournament'
+
+        immuneSystem = ExpressionsImmuneSystem(exact_values=values,
+                variables=['x'],
+                exchanger=exchanger,
+                config=config)
+        best = immuneSystem.solve()
+        self.assertEqual(len(immuneSystem.lymphocytes), 10)
+        self.assertGreaterEqual(FitnessFunction(values).expression_value(best), 0)
+
+    def test_initial_expressions(self):
+        values = [({'x': x}, x * x) for x in range(0, 5)]
+        exchanger = SimpleRandomExchanger(
+            lambda: [Expression.generate_random(max_height=2, variables=['x'])
+                     for i in range(0, 5)])
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_lymphocytes = 10
+        config.number_of_iterations = 5
+        immuneSystem = ExpressionsImmuneSystem(values, ['x'], exchanger, config,
+                                               initial_expressions=['(x * x)', 'sin(x)'])
+        self.assertEqual(len(immuneSystem.lymphocytes), 10)
+        self.assertEqual(str(immuneSystem.lymphocytes[1]), 'sin(x)')
+        self.assertEqual(str(immuneSystem.solve()), '(x * x)')
+
+class SelectionTest(unittest.TestCase):
+    def setUp(self):
+        self.fitness_values = [5.0, 1.0, 4.0, 2.0, 3.0, 0.5]
+
+    def test_best_indices(self):
+        self.assertEqual(best_indices(self.fitness_values, 3), [5, 1, 3])
+
+    def test_best_indices_of_array(self):
+        #big arrays go through numpy.argpartition, ties are ordered by index
+        values = [float(i % 7) for i in range(0, 1000)] + [math.inf] * 10
+        expected = sorted(range(0, len(values)), key=values.__getitem__)
+        for k in (2, 10, 500, 1005, 2000):
+            self.assertEqual(best_indices(numpy.array(values), k), expected[:k])
+            self.assertEqual(best_indices(values, k), expected[:k])
+        self.assertEqual(best_indices(numpy.array(self.fitness_values), 3), [5, 1, 3])
+
+    def test_best_index(self):
+        self.assertEqual(best_index(self.fitness_values), 5)
+
+    def test_tournament_selection(self):
+        selected = TournamentSelection(tournament_size=2).select(self.fitness_values, 4)
+        self.assertEqual(len(selected), 4)
+        self.assertEqual(len(set(selected)), 4)
+        self.assertEqual(selected[0], 5)
+
+class ConstantsOptimizerTest(unittest.TestCase):
+    def test_linear_constants(self):
+        root = Node(Operations.PLUS,
+            Node(Operations.MULTIPLICATION,
+                left=Node(Operations.NUMBER, value=1.0),
+                right=Node(Operations.IDENTITY, value='x')),
+            Node(Operations.NUMBER, value=0.0))
+        e = Expression(root=root, variables=['x'])
+        f = FitnessFunction([({'x': x}, 3 * x + 2) for x in range(0, 10)])
+        result = ConstantsOptimizer(f).optimize(e)
+        self.assertAlmostEqual(result, 0.0, places=5)
+        self.assertAlmostEqual(f.expression_value(e), result)
+        self.assertAlmostEqual(root.left.left.value, 3.0, places=5)
+
+    def test_no_constants(self):
+        e = Expression(root=Node(Operations.IDENTITY, value='x'), variables=['x'])
+        f = FitnessFunction([({'x': x}, x) for x in range(0, 10)])
+        self.assertEqual(ConstantsOptimizer(f).optimize(e), 0.0)
+
+class MutationSchedulerTest(unittest.TestCase):
+    def test_adaptive_prefers_productive_operator(self):
+        scheduler = AdaptiveMutationScheduler(['good', 'bad'], min_probability=0.1)
+        for i in range(0, 10):
+            scheduler.update('good', 10.0, 5.0, 0.001)
+            scheduler.update('bad', 10.0, 20.0, 0.001)
+        probabilities = scheduler.probabilities()
+        self.assertAlmostEqual(probabilities['bad'], 0.1)
+        self.assertAlmostEqual(probabilities['good'], 0.9)
+
+    def test_statistics(self):
+        scheduler = MutationScheduler(['a', 'b'])
+        scheduler.update('a', 10.0, 5.0, 0.5)
+        scheduler.update('a', 10.0, 15.0, 0.5)
+        statistics = scheduler.statistics()
+        self.assertEqual(statistics['a']['calls'], 2)
+        self.assertEqual(statistics['a']['improvements'], 1)
+        self.assertAlmostEqual(statistics['a']['improvement_per_second'], 0.5)
+        self.assertEqual(statistics['b']['calls'], 0)
+
+    def test_solve_exposes_statistics(self):
+        values = [({'x': x}, x * x) for x in range(0, 5)]
+        exchanger = SimpleRandomExchanger(
+            lambda: [Expression.generate_random(max_height=2, variables=['x'])
+                     for i in range(0, 5)])
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_lymphocytes = 10
+        config.number_of_iterations = 5
+        config.mutation_scheduler = 'adaptive'
+        immuneSystem = ExpressionsImmuneSystem(exact_values=values,
+                variables=['x'],
+                exchanger=exchanger,
+                config=config)
+        immuneSystem.solve(accuracy=-1)
+        calls = sum(s['calls'] for s in immuneSystem.mutation_statistics.values())
+        self.assertEqual(calls, 25)
+
+class TelemetryTest(unittest.TestCase):
+    def test_generation_records(self):
+        values = [({'x': x}, x * x) for x in range(0, 5)]
+        exchanger = SimpleRandomExchanger(
+            lambda: [Expression.generate_random(max_height=2, variables=['x'])
+                     for i in range(0, 5)])
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_lymphocytes = 10
+        config.number_of_iterations = 6
+        config.number_of_iterations_to_exchange = 3
+        records = []
+        telemetry = Telemetry(sinks=[records.append], profile=True, trace_memory=True)
+        immuneSystem = ExpressionsImmuneSystem(exact_values=values,
+                variables=['x'],
+                exchanger=exchanger,
+                config=config,
+                telemetry=telemetry)
+        immuneSystem.solve(accuracy=-1)
+        self.assertEqual(len(records), 7)
+        self.assertEqual([r['generation'] for r in records[:-1]], list(range(0, 6)))
+        self.assertIn('mutation', records[1]['phases'])
+        self.assertIn('exchange', records[3]['phases'])
+        self.assertEqual(records[1]['counters']['trees_copied'], 5)
+        self.assertGreater(records[1]['counters']['nodes_evaluated'], 0)
+        self.assertTrue(records[-1]['summary'])
+        self.assertIn('simplify', records[-1]['phases'])
+        self.assertNotIn('simplify', records[-2]['phases'])
+        self.assertGreater(records[-1]['memory_peak'], 0)
+        self.assertIn('step', telemetry.profile_report())
+
+    def test_json_lines_sink(self):
+        filename = 'test_telemetry.jsonl'
+        sink = JsonLinesSink(filename)
+        sink({'generation': 1})
+        sink.close()
+        with open(filename) as input:
+            self.assertEqual(input.read(), '{"generation": 1}\n')
+        os.remove(filename)
+
+    def test_capture_stops_on_failure(self):
+        def broken_generator():
+            raise RuntimeError('exchange failed')
+        values = [({'x': x}, x * x) for x in range(0, 5)]
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_lymphocytes = 10
+        config.number_of_iterations = 6
+        config.number_of_iterations_to_exchange = 3
+        records = []
+        telemetry = Telemetry(sinks=[records.append], trace_memory=True)
+        immuneSystem = ExpressionsImmuneSystem(values, ['x'],
+                                               SimpleRandomExchanger(broken_generator),
+                                               config, telemetry=telemetry)
+        self.assertRaises(RuntimeError, immuneSystem.solve, accuracy=-1)
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertTrue(records[-1]['summary'])
+        self.assertEqual(len(records), 4)
+
+class SubsampleScheduleTest(unittest.TestCase):
+    def test_size_grows_with_improvement(self):
+        schedule = SubsampleSchedule(10, 100, growth=2.0, improvement=0.5)
+        self.assertEqual(schedule.next_size(math.inf), 10)
+        self.assertEqual(schedule.next_size(8.0), 10)
+        self.assertEqual(schedule.next_size(5.0), 10)
+        self.assertEqual(schedule.next_size(3.9), 20)
+        self.assertEqual(schedule.next_size(0.0), 100)
+
+    def test_subsampled_solve(self):
+        values = [({'x': x / 10}, x * x / 100) for x in range(0, 200)]
+        exchanger = SimpleRandomExchanger(
+            lambda: [Expression.generate_random(max_height=2, variables=['x'])
+                     for i in range(0, 5)])
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_lymphocytes = 10
+        config.number_of_iterations = 5
+        config.number_of_iterations_to_exchange = 2
+        config.subsample_size = 20
+        config.subsample_mode = 'stratified'
+        immuneSystem = ExpressionsImmuneSystem(exact_values=values,
+                variables=['x'],
+                exchanger=exchanger,
+                config=config)
+        best = immuneSystem.solve()
+        self.assertGreaterEqual(FitnessFunction(values).expression_value(best), 0)
+
+class ExchangeScheduleTest(unittest.TestCase):
+    def test_fixed(self):
+        schedule = ExchangeSchedule(3)
+        self.assertEqual([i for i in range(0, 10) if schedule.is_exchange(i)], [3, 6, 9])
+
+    def run_schedule(self, schedule, best_values):
+        for (i, value) in enumerate(best_values):
+            if schedule.is_exchange(i):
+                schedule.record(i, 0.5)
+            schedule.update(i, value)
+        return schedule.statistics()
+
+    def test_stagnation(self):
+        schedule = StagnationExchangeSchedule(window=2, min_interval=3, max_interval=10)
+        #improves during 5 generations, then stalls
+        statistics = self.run_schedule(schedule, [10, 8, 6, 4, 2, 1, 1, 1, 1, 1, 1, 1])
+        self.assertEqual(statistics['generations'], [8, 11])
+        self.assertEqual(statistics['exchanges'], 2)
+        self.assertEqual(statistics['time'], 1.0)
+
+    def test_maximal_interval(self):
+        schedule = StagnationExchangeSchedule(window=2, min_interval=2, max_interval=4)
+        statistics = self.run_schedule(schedule, [2.0 ** -i for i in range(0, 10)])
+        self.assertEqual(statistics['generations'], [4, 8])
+
+    def test_stagnation_requires_async_mode(self):
+        for mode in ('sync', 'bounded'):
+            config = ExpressionsImmuneSystemConfig.from_dict(
+                {'exchange_schedule': 'stagnation', 'exchange_mode': mode})
+            self.assertRaises(ValueError, create_exchange_schedule, config)
+        config = ExpressionsImmuneSystemConfig.from_dict({'exchange_schedule': 'stagnation'})
+        self.assertIsInstance(create_exchange_schedule(config), StagnationExchangeSchedule)
+
+    def test_solve_with_stagnation_schedule(self):
+        values = [({'x': x}, x * x) for x in range(0, 10)]
+        exchanger = SimpleRandomExchanger(
+            lambda: [Expression.generate_random(max_height=2, variables=['x'])
+                     for i in range(0, 5)])
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_lymphocytes = 10
+        config.number_of_iterations = 30
+        config.exchange_schedule = 'stagnation'
+        config.exchange_window = 3
+        config.exchange_min_interval = 3
+        immuneSystem = ExpressionsImmuneSystem(values, ['x'], exchanger, config, seed=1)
+        immuneSystem.solve(accuracy=-1)
+        generations = immuneSystem.exchange_schedule.statistics()['generations']
+        self.assertGreater(len(generations), 0)
+        self.assertTrue(all(b - a >= 3 for (a, b) in zip(generations, generations[1:])))
+
+class BenchmarksTest(unittest.TestCase):
+    def test_problems_are_deterministic(self):
+        for problem in PROBLEMS:
+            values = problem.exact_values(10, seed=1)
+            self.assertEqual(values, problem.exact_values(10, seed=1))
+            self.assertEqual(sorted(values[0][0].keys()), sorted(problem.variables))
+
+    def test_compare(self):
+        old = {'micro': {'a': 1.0, 'b': 1.0}, 'solve': {'p': {'mean_time': 1.0}}}
+        new = {'micro': {'a': 1.05, 'b': 2.0}, 'solve': {'p': {'mean_time': 3.0}}}
+        self.assertEqual(len(compare(old, new, threshold=1.1)), 2)
+
+    def test_seed_makes_solve_reproducible(self):
+        values = [({'x': x}, x * x) for x in range(0, 5)]
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_lymphocytes = 10
+        config.number_of_iterations = 5
+        results = []
+        for i in range(0, 2):
+            exchanger = SimpleRandomExchanger(
+                lambda: [Expression.generate_random(max_height=2, variables=['x'])
+                         for i in range(0, 5)])
+            system = ExpressionsImmuneSystem(values, ['x'], exchanger, config, seed=42)
+            results.append(str(system.solve(accuracy=-1)))
+        self.assertEqual(results[0], results[1])
+
+class IntervalPruningTest(unittest.TestCase):
+    def test_pruning_keeps_result(self):
+        values = [({'x': x / 10}, 20 + x) for x in range(0, 50)]
+        results = []
+        for pruning in (False, True):
+            config = ExpressionsImmuneSystemConfig()
+            config.number_of_lymphocytes = 20
+            config.number_of_iterations = 10
+            config.number_of_iterations_to_exchange = 4
+            config.interval_pruning = pruning
+            exchanger = SimpleRandomExchanger(
+                lambda: [Expression.generate_random(max_height=3, variables=['x'])
+                         for i in range(0, 10)])
+            telemetry = Telemetry()
+            system = ExpressionsImmuneSystem(values, ['x'], exchanger, config, seed=3,
+                                             telemetry=telemetry)
+            results.append(str(system.solve(accuracy=-1)))
+        self.assertEqual(results[0], results[1])
+        self.assertGreater(telemetry.total_counters['lymphocytes_pruned'], 0)
+
+class PrecisionTest(unittest.TestCase):
+    def test_float32_solve_is_verified(self):
+        values = [({'x': x / 10}, math.sin(x / 10)) for x in range(0, 50)]
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_lymphocytes = 10
+        config.number_of_iterations = 5
+        config.evaluation_precision = 'float32'
+        config.verification_elites = 3
+        exchanger = SimpleRandomExchanger(
+            lambda: [Expression.generate_random(max_height=2, variables=['x'])
+                     for i in range(0, 5)])
+        system = ExpressionsImmuneSystem(values, ['x'], exchanger, config, seed=1)
+        best, hall_of_fame = system.solve(accuracy=-1, with_hall_of_fame=True)
+        self.assertEqual(system.verification_statistics['generations'], 5)
+        self.assertEqual(ExpressionsImmuneSystemConfig.from_dict(
+            {'subsample_elites': 3}).verification_elites, 3)
+        for (fitness, size, key, expression) in hall_of_fame.entries():
+            self.assertEqual(fitness, system.fitness_function.full_value(expression))
+
+class HallOfFameTest(unittest.TestCase):
+    def test_bounded_and_distinct(self):
+        hall_of_fame = HallOfFame(3)
+        expressions = [Expression.generate_random(max_height=3, variables=['x'])
+                       for i in range(0, 20)]
+        for (i, e) in enumerate(expressions):
+            hall_of_fame.add(e, float(i % 7))
+        self.assertFalse(hall_of_fame.add(expressions[0], 0.0))
+        self.assertFalse(hall_of_fame.add(expressions[1], math.inf))
+        entries = hall_of_fame.entries()
+        self.assertEqual(len(entries), 3)
+        self.assertEqual(len(set(key for (f, size, key, e) in entries)), 3)
+        fitness_values = [f for (f, size, key, e) in entries]
+        self.assertEqual(fitness_values, sorted(fitness_values))
+        self.assertIsNot(entries[0][3], expressions[0])
+
+    def test_size_breaks_ties(self):
+        hall_of_fame = HallOfFame(1)
+        hall_of_fame.add_entry('(x + 0.0)', 1.0, 3)
+        self.assertTrue(hall_of_fame.add_entry('x', 1.0, 1))
+        self.assertFalse(hall_of_fame.add_entry('(x * 1.0)', 1.0, 3))
+        self.assertEqual(hall_of_fame.expressions(), ['x'])
+
+    def test_merge(self):
+        first = HallOfFame.from_list([{'expression': 'x', 'fitness': 1.0, 'size': 1},
+                                      {'expression': 'y', 'fitness': 3.0, 'size': 1}])
+        second = HallOfFame.from_list([{'expression': 'x', 'fitness': 1.0, 'size': 1},
+                                       {'expression': 'z', 'fitness': 2.0, 'size': 1}])
+        merged = HallOfFame(2)
+        merged.merge(first)
+        merged.merge(second)
+        self.assertEqual(merged.expressions(), ['x', 'z'])
+        self.assertEqual(merged.to_list()[1], {'expression': 'z', 'fitness': 2.0, 'size': 1})
+
+    def test_solve_returns_hall_of_fame(self):
+        values = [({'x': x}, x * x) for x in range(0, 5)]
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_lymphocytes = 10
+        config.number_of_iterations = 5
+        config.hall_of_fame_size = 4
+        exchanger = SimpleRandomExchanger(
+            lambda: [Expression.generate_random(max_height=2, variables=['x'])
+                     for i in range(0, 5)])
+        system = ExpressionsImmuneSystem(values, ['x'], exchanger, config, seed=1)
+        best, hall_of_fame = system.solve(accuracy=-1, with_hall_of_fame=True)
+        self.assertEqual(len(hall_of_fame), 4)
+        (fitness, size, key, expression) = hall_of_fame.entries()[0]
+        self.assertAlmostEqual(fitness, system.fitness_function.expression_value(expression))
+
+class DataFileStorageHelperTest(unittest.TestCase):
+    def tearDown(self):
+        for filename in ('test_data.txt', 'test_data.npz'):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def test_seeded_text_file(self):
+        contents = []
+        for i in range(0, 2):
+            DataFileStorageHelper.save_to_file('test_data.txt', ['x', 'y'],
+                                               lambda x, y: x + numpy.sin(y), 20, seed=3)
+            with open('test_data.txt') as input:
+                contents.append(input.read())
+        self.assertEqual(contents[0], contents[1])
+        variables, values = DataFileStorageHelper.load_from_file('test_data.txt')
+        self.assertEqual(variables, ['x', 'y'])
+        self.assertEqual(len(values), 20)
+        for (point, value) in values:
+            self.assertEqual(value, point['x'] + math.sin(point['y']))
+
+    def test_grid_and_scalar_function(self):
+        DataFileStorageHelper.save_to_file('test_data.npz', ['x', 'y'],
+                                           lambda x, y: math.hypot(x, y), 9, grid=True,
+                                           min_point=-1.0, max_point=1.0)
+        variables, values = DataFileStorageHelper.load_from_file('test_data.npz')
+        self.assertEqual(variables, ['x', 'y'])
+        self.assertEqual(len(values), 9)
+        self.assertEqual(sorted(set(point['x'] for (point, value) in values)), [-1.0, 0.0, 1.0])
+        for (point, value) in values:
+            self.assertAlmostEqual(value, math.hypot(point['x'], point['y']))
+
+    def test_load_columns(self):
+        variables, columns, targets = DataFileStorageHelper.load_columns_from_string(
+            'x y\n1 2 3\n\n4 5 6\n')
+        self.assertEqual(variables, ['x', 'y'])
+        self.assertEqual(list(columns['y']), [2, 5])
+        self.assertEqual(list(targets), [3, 6])
+        variables, values = DataFileStorageHelper.load_from_string('x\n1 2\n')
+        self.assertEqual(values, [({'x': 1.0}, 2.0)])
+
+    def test_malformed_rows(self):
+        with self.assertRaisesRegex(DataFormatError, 'line 3'):
+            DataFileStorageHelper.load_columns_from_string('x y\n1 2 3\n4 5\n')
+        with self.assertRaisesRegex(DataFormatError, 'line 2'):
+            DataFileStorageHelper.load_columns_from_string('x\n1 a\n')
+        with self.assertRaisesRegex(DataFormatError, 'line 2'):
+            DataFileStorageHelper.load_columns_from_string('x\n1 2 3\n4 5 6\n')
+
+    def test_iterate(self):
+        with open('test_data.txt', 'w') as output:
+            output.write('x\n1 2\n3 4\n5\n')
+        values = DataFileStorageHelper.iterate('test_data.txt')
+        self.assertEqual(next(values), ({'x': 1.0}, 2.0))
+        self.assertEqual(next(values), ({'x': 3.0}, 4.0))
+        with self.assertRaisesRegex(DataFormatError, 'line 4'):
+            next(values)
+
+class MultiTargetTest(unittest.TestCase):
+    def setUp(self):
+        self.variables, self.columns, self.targets = \
+            DataFileStorageHelper.load_targets_from_string(
+                'x y | f g\n' + ''.join('{0} {1} {2} {3}\n'.format(x, y, x * y + 1, x - y)
+                                         for x in range(0, 5) for y in range(0, 5)))
+
+    def test_load_targets(self):
+        self.assertEqual(self.variables, ['x', 'y'])
+        self.assertEqual(list(self.targets), ['f', 'g'])
+        self.assertEqual(list(self.targets['g'][:3]), [0, -1, -2])
+        variables, columns, targets = DataFileStorageHelper.load_targets_from_string('x\n1 2\n')
+        self.assertEqual(list(targets), ['f'])
+        with self.assertRaisesRegex(DataFormatError, 'single target'):
+            DataFileStorageHelper.load_columns_from_string('x | f g\n1 2 3\n')
+        with self.assertRaisesRegex(DataFormatError, 'line 2'):
+            DataFileStorageHelper.load_targets_from_string('x | f g\n1 2\n')
+        with self.assertRaisesRegex(DataFormatError, 'line 1'):
+            DataFileStorageHelper.load_targets_from_string('x |\n1\n')
+
+    def test_values(self):
+        f = MultiTargetFitnessFunction(self.columns, self.targets)
+        e = Expression.parse('((x * y) + 0.5)', self.variables)
+        values = f.values(e)
+        for (i, name) in enumerate(f.target_names):
+            single = FitnessFunction.from_columns(self.columns, self.targets[name])
+            self.assertAlmostEqual(values[i], single.expression_value(e))
+            self.assertAlmostEqual(f.target(name).expression_value(e), values[i])
+        self.assertEqual((f.evaluations, f.cache_hits), (1, 2))
+
+    def test_ring_exchanger(self):
+        exchangers = RingExchanger.ring(2)
+        e = Expression.parse('(x + 1)', ['x'])
+        exchangers[1].set_lymphocytes_to_exchange([e])
+        received = exchangers[0].get_lymphocytes()
+        self.assertEqual([str(r) for r in received], ['(x + 1)'])
+        self.assertIsNot(received[0], e)
+        self.assertEqual(exchangers[1].get_lymphocytes(), [])
+
+    def test_solve(self):
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_lymphocytes = 20
+        config.number_of_iterations = 30
+        config.number_of_iterations_to_exchange = 5
+        system = MultiTargetImmuneSystem(self.variables, self.columns, self.targets, config,
+                                         seed=1)
+        best = system.solve()
+        self.assertEqual(list(best), ['f', 'g'])
+        for (name, e) in best.items():
+            value = system.systems[name].fitness_function.full_value(e)
+            self.assertLessEqual(value, system.systems[name].hall_of_fame.entries()[0][0] + 1e-9)
+        self.assertGreater(system.fitness_function.cache_hits, 0)
+
+class ExportTest(unittest.TestCase):
+    def setUp(self):
+        self.X = numpy.random.default_rng(0).uniform(-5.0, 5.0, size=(200, 2))
+        self.columns = {'x': self.X[:, 0], 'y': self.X[:, 1]}
+
+    def assertSameValues(self, e):
+        expected = numpy.broadcast_to(numpy.asarray(e.value_in_columns(self.columns),
+                                                    dtype=numpy.float64), (len(self.X),))
+        numpy.testing.assert_array_equal(export_predictor(e)(self.X), expected)
+
+    def test_operations(self):
+        for text in ['((x / (y - y)) + sin((x * y)))',
+                     '(cos((x * y)) * cos((x * y)))',
+                     '((exp(x) - log(y)) / sqrt((x ^ y)))',
+                     '((x - 1.5) * (2.0 + (3.0 * 4.0)))',
+                     '(log(0.0) + x)']:
+            self.assertSameValues(Expression.parse(text, ['x', 'y']))
+
+    def test_random_expressions(self):
+        for i in range(0, 50):
+            self.assertSameValues(Expression.generate_random(5, ['x', 'y']))
+
+    def test_constant_and_variable(self):
+        predict = export_predictor(Expression.parse('(2.0 * 3.0)', ['x', 'y']))
+        self.assertEqual(list(predict(self.X[:3])), [6.0, 6.0, 6.0])
+        predict = export_predictor(Expression.parse('y', ['x', 'y']))
+        result = predict(self.X)
+        self.assertEqual(list(result), list(self.X[:, 1]))
+        result[0] = 100.0
+        self.assertNotEqual(self.X[0, 1], 100.0)
+
+    def test_shapes(self):
+        predict = export_predictor(Expression.parse('(x - y)', ['x', 'y']))
+        self.assertEqual(list(predict([3, 1])), [2.0])
+        self.assertEqual(list(predict([[3, 1], [1, 3]])), [2.0, -2.0])
+        self.assertRaises(ValueError, predict, [[1, 2, 3]])
+        predict = export_predictor(Expression.parse('(x * x)', ['x']))
+        self.assertEqual(list(predict([1, 2, 3])), [1.0, 4.0, 9.0])
+
+    def test_not_supported_operation(self):
+        tanh = Operation(100, Operations._unary_operation, math.tanh, 'tanh', enabled=False)
+        e = Expression(root=Node(tanh, left=Node(Operations.IDENTITY, value='x')),
+                       variables=['x'])
+        self.assertRaises(NotSupportedOperationError, export_source, e)
+
+    def test_save(self):
+        filename = 'test_exported_predictor.py'
+        try:
+            save(Expression.parse('(x + sin(y))', ['x', 'y']), filename, name='f')
+            namespace = {}
+            with open(filename) as source:
+                exec(source.read(), namespace)
+        finally:
+            os.remove(filename)
+        self.assertEqual(namespace['VARIABLES'], ['x', 'y'])
+        self.assertEqual(namespace['EXPRESSION'], '(x + sin(y))')
+        self.assertAlmostEqual(namespace['f']([[1.0, 0.0]])[0], 1.0)
+
+class CheckpointTest(unittest.TestCase):
+    def tearDown(self):
+        if os.path.exists('test_checkpoint'):
+            os.remove('test_checkpoint')
+
+    def test_restore_continues_from_checkpoint(self):
+        values = [({'x': x}, x * x) for x in range(0, 5)]
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_lymphocytes = 10
+        config.number_of_iterations = 4
+        exchanger = SimpleRandomExchanger(
+            lambda: [Expression.generate_random(max_height=2, variables=['x'])
+                     for i in range(0, 5)])
+        system = ExpressionsImmuneSystem(values, ['x'], exchanger, config, seed=1)
+        system.solve(accuracy=-1, checkpoint='test_checkpoint', checkpoint_interval=2)
+
+        config.number_of_iterations = 6
+        restored = ExpressionsImmuneSystem(values, ['x'], exchanger, config, seed=2)
+        restored.restore_state('test_checkpoint')
+        self.assertEqual(restored.start_generation, 4)
+        self.assertEqual(len(restored.lymphocytes), len(system.lymphocytes))
+        restored.solve(accuracy=-1)
+        self.assertEqual(restored.generation, 5)
+        self.assertEqual(restored.start_generation, 0)
+
+    def test_supervisor_parses_node_result(self):
+        lines = ['Starting...', json.dumps({'node': '1', 'best': 'x', 'fitness': 0.5,
+                                            'generations': 10, 'time': 2.0})]
+        result = NodeSupervisor._parse_result(lines)
+        self.assertEqual(result['best'], 'x')
+        self.assertIsNone(NodeSupervisor._parse_result(['garbage']))
+
+    def test_supervisor_restarts_crashed_node(self):
+        directory = 'test_supervisor'
+        os.makedirs(directory, exist_ok=True)
+        #node crashes after saving the checkpoint of 4 generations, resumed node does 6 more
+        script = os.path.join(directory, 'node.py')
+        with open(script, 'w') as output:
+            output.write('import json, sys\n'
+                         'checkpoint = sys.argv[sys.argv.index("--checkpoint") + 1]\n'
+                         'if "--resume" not in sys.argv:\n'
+                         '    open(checkpoint, "w").close()\n'
+                         '    sys.exit("crashed")\n'
+                         'print(json.dumps({"best": "x", "fitness": 0.5, "start_generation": 4,\n'
+                         '                  "generations": 6, "time": 0.1,\n'
+                         '                  "exchanges": 0, "exchange_time": 0.0}))\n')
+        try:
+            supervisor = NodeSupervisor(1, max_restarts=2, pin_cpus=True,
+                                        checkpoint_directory=directory,
+                                        node_script=script)
+            summary = supervisor.run()[0]
+            self.assertEqual(os.listdir(directory), ['node.py'])
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual((summary['returncode'], summary['restarts']), (0, 1))
+        self.assertEqual(summary['generations'], 10)
+        self.assertAlmostEqual(summary['generations_per_second'],
+                               10 / summary['wall_time'])
+        self.assertEqual(supervisor.node_processes[0].errors, ['crashed'])
+
+class RunnerTest(unittest.TestCase):
+    def test_shared_dataset(self):
+        values = [({'x': x, 'y': 2 * x}, 3 * x) for x in range(0, 5)]
+        dataset = SharedDataset.from_exact_values(['x', 'y'], values)
+        try:
+            memory, variables, columns, targets = attach_dataset(dataset.descriptor())
+            self.assertEqual(variables, ['x', 'y'])
+            self.assertEqual(list(columns['y']), [0, 2, 4, 6, 8])
+            self.assertEqual(list(targets), [0, 3, 6, 9, 12])
+            del columns, targets
+            memory.close()
+        finally:
+            dataset.close()
+
+    def test_run_restarts(self):
+        values = [({'x': x}, x * x) for x in range(0, 5)]
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_lymphocytes = 10
+        config.number_of_iterations = 5
+        report = run_restarts(['x'], values, config, 3, processes=2, seeds=[1, 2, 3])
+        self.assertEqual(len(report['results']), 3)
+        self.assertEqual(sorted(r[2] for r in report['results']), [1, 2, 3])
+        self.assertEqual(report['results'], sorted(report['results']))
+        self.assertEqual(len(report['timings']), 3)
+        self.assertGreater(report['speedup'], 0)
+
+class AutotuneTest(unittest.TestCase):
+    def test_grid_and_score(self):
+        candidates = grid_candidates({'maximal_height': [3, 4], 'number_of_lymphocytes': [10]})
+        self.assertEqual(candidates, [{'maximal_height': 3, 'number_of_lymphocytes': 10},
+                                      {'maximal_height': 4, 'number_of_lymphocytes': 10}])
+        reached = [{'fitness': 0.0, 'seconds': 1.0}, {'fitness': 0.0005, 'seconds': 3.0}]
+        slow = [{'fitness': 0.0, 'seconds': 5.0}, {'fitness': 0.0, 'seconds': 5.0}]
+        failed = [{'fitness': 1.0, 'seconds': 0.5}, {'fitness': 2.0, 'seconds': 0.5}]
+        self.assertLess(score(reached, 0.001), score(slow, 0.001))
+        self.assertLess(score(slow, 0.001), score(failed, 0.001))
+
+    def test_successive_halving_arguments(self):
+        candidates = [{'maximal_height': 3}, {'maximal_height': 4}]
+        for eta in (0, 1):
+            self.assertRaises(ValueError, successive_halving, None, candidates, {}, eta=eta)
+        self.assertRaises(ValueError, successive_halving, None, candidates, {}, seeds=0)
+        self.assertRaises(ValueError, successive_halving, None,
+                          grid_candidates({'number_of_iterations': [10, 20]}), {})
+
+    def test_time_limit(self):
+        values = [({'x': x}, math.sin(x)) for x in range(0, 20)]
+        config = ExpressionsImmuneSystemConfig()
+        config.number_of_lymphocytes = 10
+        config.number_of_iterations = 10 ** 6
+        exchanger = SimpleRandomExchanger(
+            lambda: [Expression.generate_random(max_height=2, variables=['x'])
+                     for i in range(0, 5)])
+        system = ExpressionsImmuneSystem(values, ['x'], exchanger, config, seed=1)
+        start = time.perf_counter()
+        system.solve(accuracy=-1, time_limit=0.1)
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertGreater(system.generation, 0)
+
+    def test_tune(self):
+        columns = {'x': numpy.linspace(-1, 1, 20)}
+        config = tune(['x'], columns, columns['x'] ** 2,
+                      grid={'number_of_lymphocytes': [10, 20], 'maximal_height': [2]},
+                      budget=0.02, eta=2, seeds=1, processes=2)
+        self.assertIn(config.number_of_lymphocytes, (10, 20))
+        self.assertEqual(config.maximal_height, 2)
+        self.assertGreater(config.number_of_iterations, 0)
+
+class JobServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_directory = 'test_cache'
+        self.service = JobService(workers=2, cache_directory=self.cache_directory)
+        self.server = create_server(self.service, port=0)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://localhost:{0}/jobs'.format(self.server.server_address[1])
+        self.dataset = 'x\n' + ''.join('{0} {1}\n'.format(x, x * x) for x in range(0, 5))
+        self.config = {'number_of_lymphocytes': 10, 'number_of_iterations': 5}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.shutdown()
+        shutil.rmtree(self.cache_directory)
+
+    def _submit(self, seed=1):
+        request = urllib.request.Request(self.url, method='POST', data=json.dumps(
+            {'dataset': self.dataset, 'config': self.config, 'seed': seed}).encode('utf-8'))
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def _wait(self, job):
+        with urllib.request.urlopen('{0}/{1}/progress'.format(self.url, job['id'])) as response:
+            return [json.loads(line) for line in response.read().decode('utf-8').splitlines()]
+
+    def test_bad_requests(self):
+        for body in ([1, 2], {'config': {}}, {'dataset': 5},
+                     {'dataset': self.dataset, 'config': [1]},
+                     {'dataset': self.dataset, 'seed': 'one'}):
+            request = urllib.request.Request(self.url, method='POST',
+                                             data=json.dumps(body).encode('utf-8'))
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(request)
+            self.assertEqual(context.exception.code, 400)
+            context.exception.close()
+
+    def test_finished_jobs_are_forgotten(self):
+        self.service.finished_capacity = 1
+        first = self._submit(seed=1)
+        self.assertIn(first['status'], ('queued', 'running'))
+        self.assertEqual(self._wait(first)[-1]['status'], 'done')
+        second = self._submit(seed=2)
+        self.assertEqual(self._wait(second)[-1]['status'], 'done')
+        self.assertIsNone(self.service.get(first['id']))
+        self.assertEqual(self.service.get(second['id']).status, 'done')
+
+    def test_job_progress_and_cache(self):
+        job = self._submit()
+        self.assertFalse(job['cached'])
+        lines = self._wait(job)
+        self.assertEqual(lines[-1]['status'], 'done')
+        self.assertIn('expression', lines[-1]['result'])
+
+        cached = self._submit()
+        self.assertTrue(cached['cached'])
+        self.assertEqual(cached['result'], lines[-1]['result'])
+
+    def test_cache_key(self):
+        self.assertEqual(ResultCache.key('a', {'x': 1, 'y': 2}),
+                         ResultCache.key('a', {'y': 2, 'x': 1}))
+        self.assertNotEqual(ResultCache.key('a', {'x': 1}), ResultCache.key('b', {'x': 1}))